@@ -0,0 +1,59 @@
+import asyncio
+import logging
+from channels.db import database_sync_to_async
+from django.conf import settings
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+
+class MessageBuffer:
+    '''Write-behind buffer for chat messages.
+
+    Messages are collected in memory and written with a single bulk
+    INSERT once max_size messages are pending, or flush_interval seconds
+    after the first pending message, whichever comes first. Messages
+    still pending when the process exits are lost.
+    '''
+    def __init__(self, max_size, flush_interval):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.timer = None
+
+    async def add(self, message):
+        '''Adds an unsaved Message object to the buffer.'''
+        self.pending.append(message)
+        if len(self.pending) >= self.max_size:
+            await self.flush()
+        elif self.timer is None:
+            loop = asyncio.get_running_loop()
+            self.timer = loop.call_later(
+                self.flush_interval,
+                lambda: asyncio.ensure_future(self.flush())
+            )
+
+    async def flush(self):
+        '''Writes all pending messages to the database.'''
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        # swap the list before awaiting, so messages added during the
+        # write go into the next batch
+        messages, self.pending = self.pending, []
+        if not messages:
+            return
+        try:
+            await database_sync_to_async(Message.objects.bulk_create)(
+                messages
+            )
+        except Exception:
+            logger.exception('Failed to save %d chat messages',
+                             len(messages))
+
+
+# shared by all consumers of the process
+message_buffer = MessageBuffer(
+    max_size=settings.CHAT_BUFFER_SIZE,
+    flush_interval=settings.CHAT_BUFFER_FLUSH_INTERVAL
+)
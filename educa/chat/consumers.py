@@ -1,9 +1,34 @@
 import json
+import logging
+import time
+import uuid
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
 from django.utils import timezone
+from students.membership import is_enrolled
+from .buffer import message_buffer
+from .models import Message
+from .throttling import BucketRegistry, stats
+
+logger = logging.getLogger(__name__)
+
+# rate limits shared by all connections of this process
+user_buckets = BucketRegistry(*settings.CHAT_RATE_LIMITS['user'])
+room_buckets = BucketRegistry(*settings.CHAT_RATE_LIMITS['room'])
 
 class ChatConsumer(AsyncWebsocketConsumer):
-    '''Basic WebSocket Consumer.'''
+    '''Basic WebSocket Consumer.
+
+    Messages are rate limited per user and per room. Clients acknowledge
+    the sequence number of the messages they receive; when a client falls
+    more than CHAT_SEND_WINDOW messages behind, or messages reach the
+    consumer more than CHAT_MAX_QUEUE_LAG seconds late, messages are no
+    longer sent individually. Once the client has caught up it receives
+    a single catch_up frame, so it can reload the room history. Clients
+    that stay behind for CHAT_SLOW_CONSUMER_TIMEOUT seconds are
+    disconnected.
+    '''
     async def connect(self):
         '''Called when a new connection is received.'''
         # retrieve user info
@@ -12,6 +37,16 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.id = self.scope['url_route']['kwargs']['course_id']
         # build the group name
         self.room_group_name = 'chat_%s' % self.id
+        # only students of the course can join the room
+        if not await database_sync_to_async(is_enrolled)(self.user, self.id):
+            await self.close()
+            return
+        # sequence numbers of the last message sent and acknowledged
+        self.sent_seq = 0
+        self.acked_seq = None
+        # messages skipped while the client is behind
+        self.skipped = 0
+        self.behind_since = None
         # join room group
         await self.channel_layer.group_add(
             self.room_group_name,
@@ -19,6 +54,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
         # accept connection
         await self.accept()
+        stats['connections_accepted'] += 1
     
     async def disconnect(self, close_code):
         '''Called when the socket closed.'''
@@ -35,11 +71,50 @@ class ChatConsumer(AsyncWebsocketConsumer):
         (json) data. The json data is deserialized into a 
         dictionary through json.loads. The message key is accessed from 
         the dictionary, serialized to json, and then returned/sent.
+        Frames with an ack key acknowledge received messages. Malformed
+        frames are ignored and answered with an error frame.
         '''
         # receive messages from websocket
-        text_data_json = json.loads(text_data)
-        message = text_data_json['message']
+        try:
+            text_data_json = json.loads(text_data or '')
+        except ValueError:
+            text_data_json = None
+        if not isinstance(text_data_json, dict):
+            await self.invalid_frame()
+            return
+        if 'ack' in text_data_json:
+            seq = text_data_json['ack']
+            # only messages that were sent can be acknowledged
+            if type(seq) is not int or not 0 <= seq <= self.sent_seq:
+                await self.invalid_frame()
+                return
+            await self.acknowledge(seq)
+            return
+        message = text_data_json.get('message')
+        if not isinstance(message, str) or not message.strip():
+            await self.invalid_frame()
+            return
+        stats['messages_received'] += 1
+        if not user_buckets.consume(self.user.id or self.channel_name):
+            stats['messages_rate_limited_user'] += 1
+            await self.send_error('rate_limited')
+            return
+        if not room_buckets.consume(self.id):
+            stats['messages_rate_limited_room'] += 1
+            await self.send_error('room_rate_limited')
+            return
         now = timezone.now()
+        # the key identifies the message before it is saved
+        key = uuid.uuid4()
+        # store the message through the write-behind buffer
+        if self.user.is_authenticated:
+            await message_buffer.add(Message(
+                course_id=self.id,
+                user_id=self.user.id,
+                content=message,
+                sent=now,
+                key=key
+            ))
         # send message to room group
         await self.channel_layer.group_send(
             self.room_group_name,
@@ -48,10 +123,74 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'message':message,
                 'user': self.user.username,
                 'datetime': now.isoformat(),
+                'key': str(key),
+                'timestamp': time.time(),
             }
         )
     
     async def chat_message(self, event):
         '''Receive messages from the group.'''
+        lag = time.time() - event.pop('timestamp', time.time())
+        backlog = self.backlog()
+        if self.behind_since is None:
+            if lag > settings.CHAT_MAX_QUEUE_LAG \
+                    or backlog > settings.CHAT_SEND_WINDOW:
+                self.behind_since = time.monotonic()
+                stats['slow_consumers_detected'] += 1
+        elif lag <= settings.CHAT_MAX_QUEUE_LAG / 2 \
+                and backlog <= settings.CHAT_SEND_WINDOW // 2:
+            await self.catch_up()
+        if self.behind_since is not None:
+            # skip the message, the client reloads the history once it
+            # has caught up
+            self.skipped += 1
+            stats['messages_coalesced'] += 1
+            if time.monotonic() - self.behind_since \
+                    > settings.CHAT_SLOW_CONSUMER_TIMEOUT:
+                stats['slow_consumers_disconnected'] += 1
+                logger.warning('Disconnecting slow chat consumer %s',
+                               self.channel_name)
+                await self.close(code=4008)
+            return
+        self.sent_seq += 1
+        event['seq'] = self.sent_seq
         # Send message to WebSocket
-        await self.send(text_data=json.dumps(event))
\ No newline at end of file
+        await self.send(text_data=json.dumps(event))
+
+    def backlog(self):
+        '''Returns the number of messages sent to the client that it has
+        not acknowledged yet. Clients that never acknowledge messages
+        have no backlog.'''
+        if self.acked_seq is None:
+            return 0
+        return self.sent_seq - self.acked_seq
+
+    async def acknowledge(self, seq):
+        '''Records the last message received by the client.'''
+        self.acked_seq = seq
+        if self.behind_since is not None \
+                and self.backlog() <= settings.CHAT_SEND_WINDOW // 2:
+            await self.catch_up()
+
+    async def catch_up(self):
+        '''Sends a single catch_up frame in place of the messages that
+        were skipped while the client was behind.'''
+        self.behind_since = None
+        await self.send(text_data=json.dumps({
+            'type': 'catch_up',
+            'skipped': self.skipped,
+        }))
+        self.skipped = 0
+
+    async def invalid_frame(self):
+        '''Answers a frame that is not valid JSON, or has no valid ack
+        or message.'''
+        stats['frames_invalid'] += 1
+        await self.send_error('invalid_frame')
+
+    async def send_error(self, error):
+        '''Sends an error frame to the WebSocket client.'''
+        await self.send(text_data=json.dumps({
+            'type': 'error',
+            'error': error,
+        }))
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.7 on 2026-10-17 05:01
+
+from django.db import migrations, models
+import uuid
+
+
+def fill_keys(apps, schema_editor):
+    # the default is evaluated once for the existing rows
+    Message = apps.get_model('chat', 'Message')
+    for pk in Message.objects.values_list('pk', flat=True).iterator():
+        Message.objects.filter(pk=pk).update(key=uuid.uuid4())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='key',
+            field=models.UUIDField(default=uuid.uuid4, editable=False),
+        ),
+        migrations.RunPython(fill_keys, migrations.RunPython.noop),
+    ]
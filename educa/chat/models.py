@@ -1,3 +1,40 @@
+import uuid
 from django.db import models
+from django.contrib.auth.models import User
+from courses.models import Course
 
-# Create your models here.
+class Message(models.Model):
+    '''Model for the chat messages of a course chat room.
+
+    Fields include:
+        course: Foreign key to the Course object of the chat room.
+        user: Foreign key to the User object that sent the message.
+        content (str): The text of the message.
+        sent (datetime obj): Date and time the message was sent.
+        key (uuid): Identifier given to the message when it is sent,
+            before it is saved, so clients can tell the messages they
+            received live from the same messages in the room history.
+    '''
+    course = models.ForeignKey(
+        to=Course,
+        related_name='chat_messages',
+        on_delete=models.CASCADE
+    )
+    user = models.ForeignKey(
+        to=User,
+        related_name='chat_messages',
+        on_delete=models.CASCADE
+    )
+    content = models.TextField()
+    sent = models.DateTimeField()
+    key = models.UUIDField(default=uuid.uuid4, editable=False)
+
+    class Meta:
+        ordering = ['-id']
+        indexes = [
+            # supports the keyset pagination of the room history
+            models.Index(fields=['course', '-id']),
+        ]
+
+    def __str__(self):
+        return f"{self.user}: {self.content[:50]}"
@@ -1,3 +1,215 @@
-from django.test import TestCase
+import asyncio
+import json
+from unittest import mock
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from courses.models import Subject, Course
+from . import consumers
+from .buffer import MessageBuffer
+from .models import Message
+from .routing import websocket_urlpatterns
+from .throttling import TokenBucket, BucketRegistry, stats
 
-# Create your tests here.
+# Tests run against a local memory cache rather than memcached.
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+IN_MEMORY_CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    }
+}
+
+
+class ChatTestMixin:
+    '''Creates a course with an enrolled student.'''
+
+    def setUp(self):
+        self.student = User.objects.create_user('student', password='pass')
+        subject = Subject.objects.create(title='Maths', slug='maths')
+        self.course = Course.objects.create(
+            owner=User.objects.create_user('instructor'),
+            subject=subject,
+            title='Course',
+            slug='course',
+            overview='Overview'
+        )
+        self.course.students.add(self.student)
+
+    def message(self, content='Hello'):
+        return Message(course=self.course, user=self.student,
+                       content=content, sent=timezone.now())
+
+
+class MessageBufferTest(ChatTestMixin, TestCase):
+    '''Tests for the write-behind chat message buffer.'''
+
+    async def test_flushes_when_full(self):
+        buffer = MessageBuffer(max_size=3, flush_interval=60)
+        await buffer.add(self.message())
+        await buffer.add(self.message())
+        self.assertEqual(await self.count(), 0)
+        await buffer.add(self.message())
+        self.assertEqual(await self.count(), 3)
+        self.assertEqual(buffer.pending, [])
+
+    async def test_flushes_after_interval(self):
+        buffer = MessageBuffer(max_size=100, flush_interval=0.01)
+        await buffer.add(self.message())
+        await asyncio.sleep(0.1)
+        self.assertEqual(await self.count(), 1)
+
+    async def count(self):
+        return await database_sync_to_async(Message.objects.count)()
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CHAT_HISTORY_PAGE_SIZE=2)
+class ChatHistoryTest(ChatTestMixin, TestCase):
+    '''Tests for the chat room history endpoint.'''
+
+    def setUp(self):
+        super().setUp()
+        Message.objects.bulk_create(
+            [self.message(f'Message {i}') for i in range(5)]
+        )
+        self.url = reverse('chat:course_chat_history', args=[self.course.id])
+
+    def test_history_is_paginated(self):
+        self.client.force_login(self.student)
+        data = self.client.get(self.url).json()
+        self.assertEqual([m['message'] for m in data['messages']],
+                         ['Message 3', 'Message 4'])
+        # the keys tell the history from the messages received live
+        self.assertEqual(
+            [m['key'] for m in data['messages']],
+            [str(key) for key in Message.objects.order_by('id')
+             .values_list('key', flat=True)[3:]]
+        )
+        seen = data['messages']
+        while data['next']:
+            data = self.client.get(data['next']).json()
+            seen = data['messages'] + seen
+        self.assertEqual([m['message'] for m in seen],
+                         [f'Message {i}' for i in range(5)])
+
+    def test_history_requires_enrollment(self):
+        self.client.force_login(User.objects.create_user('visitor'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class TokenBucketTest(TestCase):
+    '''Tests for the token bucket rate limiter.'''
+
+    def test_burst_then_limit(self):
+        bucket = TokenBucket(rate=0, burst=2)
+        self.assertTrue(bucket.consume())
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+
+    def test_refill(self):
+        bucket = TokenBucket(rate=1000, burst=1)
+        bucket.consume()
+        bucket.updated -= 1
+        self.assertTrue(bucket.consume())
+
+
+@override_settings(CACHES=LOCMEM_CACHES,
+                   CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+                   CHAT_SEND_WINDOW=2)
+class ChatConsumerTest(ChatTestMixin, TestCase):
+    '''Tests for the rate limiting and slow client handling of the
+    chat consumer.'''
+
+    def setUp(self):
+        super().setUp()
+        patches = [
+            mock.patch.object(consumers, 'user_buckets',
+                              BucketRegistry(rate=0, burst=2)),
+            mock.patch.object(consumers, 'room_buckets',
+                              BucketRegistry(rate=0, burst=100)),
+            mock.patch.object(consumers, 'message_buffer',
+                              MessageBuffer(max_size=100,
+                                            flush_interval=60)),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    async def connect(self, user=None):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns),
+            f'/ws/chat/room/{self.course.id}/'
+        )
+        communicator.scope['user'] = user or self.student
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_connection_requires_enrollment(self):
+        visitor = await database_sync_to_async(User.objects.create_user)(
+            'visitor'
+        )
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns),
+            f'/ws/chat/room/{self.course.id}/'
+        )
+        communicator.scope['user'] = visitor
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+    async def test_messages_are_rate_limited_per_user(self):
+        communicator = await self.connect()
+        limited = stats['messages_rate_limited_user']
+        for i in range(3):
+            await communicator.send_json_to({'message': f'Message {i}'})
+        frames = [await communicator.receive_json_from() for i in range(3)]
+        self.assertEqual(sorted(f['type'] for f in frames),
+                         ['chat_message', 'chat_message', 'error'])
+        self.assertEqual(stats['messages_rate_limited_user'], limited + 1)
+        await communicator.disconnect()
+
+    async def test_slow_client_receives_catch_up(self):
+        consumers.user_buckets.burst = 100
+        communicator = await self.connect()
+        await communicator.send_json_to({'ack': 0})
+        for i in range(4):
+            await communicator.send_json_to({'message': f'Message {i}'})
+        frames = [await communicator.receive_json_from() for i in range(3)]
+        self.assertEqual([f['seq'] for f in frames], [1, 2, 3])
+        # the fourth message is skipped, the client is 3 messages behind
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.send_json_to({'ack': 3})
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame, {'type': 'catch_up', 'skipped': 1})
+        await communicator.disconnect()
+
+    async def test_malformed_frames_are_ignored(self):
+        communicator = await self.connect()
+        for frame in ('not json', '[1]', '{"ack": "x"}', '{"ack": 5}',
+                      '{"ack": null}', '{}', '{"message": 1}'):
+            await communicator.send_to(text_data=frame)
+            self.assertEqual(await communicator.receive_json_from(),
+                             {'type': 'error', 'error': 'invalid_frame'})
+        # the consumer keeps serving the connection
+        await communicator.send_json_to({'message': 'Hello'})
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame['message'], 'Hello')
+        await communicator.disconnect()
+
+    async def test_live_messages_match_the_history(self):
+        communicator = await self.connect()
+        await communicator.send_json_to({'message': 'Hello'})
+        frame = await communicator.receive_json_from()
+        await consumers.message_buffer.flush()
+        key = await database_sync_to_async(
+            lambda: str(Message.objects.get().key)
+        )()
+        self.assertEqual(frame['key'], key)
+        await communicator.disconnect()
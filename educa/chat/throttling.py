@@ -0,0 +1,63 @@
+import time
+from collections import Counter
+
+# Counters of the chat consumers of this process, e.g. the number of
+# rate limited messages. Exposed by the chat_stats view.
+stats = Counter()
+
+
+class TokenBucket:
+    '''Token bucket rate limiter.
+
+    The bucket holds up to burst tokens and is refilled with rate tokens
+    per second. Every allowed message takes one token.
+    '''
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, tokens=1):
+        '''Takes the given number of tokens from the bucket. Returns
+        False if there are not enough tokens.'''
+        self.refill()
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+    def is_full(self):
+        self.refill()
+        return self.tokens >= self.burst
+
+
+class BucketRegistry:
+    '''Token buckets of this process, keyed by e.g. user or room.
+
+    Full buckets behave the same as new ones, so they are dropped when
+    the registry grows beyond max_size.
+    '''
+    def __init__(self, rate, burst, max_size=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_size = max_size
+        self.buckets = {}
+
+    def consume(self, key, tokens=1):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_size:
+                self.prune()
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+        return bucket.consume(tokens)
+
+    def prune(self):
+        self.buckets = {key: bucket for key, bucket in self.buckets.items()
+                        if not bucket.is_full()}
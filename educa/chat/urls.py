@@ -9,4 +9,14 @@ urlpatterns = [
         views.course_chat_room,
         name='course_chat_room'
         ),
+    path(
+        'room/<int:course_id>/history/',
+        views.course_chat_history,
+        name='course_chat_history'
+        ),
+    path(
+        'stats/',
+        views.chat_stats,
+        name='chat_stats'
+        ),
 ]
@@ -1,7 +1,14 @@
+from django.conf import settings
 from django.contrib.auth import login
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponseForbidden
+from django.http import HttpResponseForbidden, HttpResponseBadRequest, JsonResponse
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.urls import reverse
+from courses.models import Course
+from students.membership import is_enrolled
+from .models import Message
+from .throttling import stats
 
 @login_required
 def course_chat_room(request, course_id):
@@ -10,10 +17,81 @@ def course_chat_room(request, course_id):
     
     Arguments include the id (int) of the course.
     '''
-    try:
-        # retrieve course with given id joined by the current user
-        course = request.user.courses_joined.get(id=course_id)
-    except:
+    if not is_enrolled(request.user, course_id):
         # user is not a student of the course or course does not exist
-        return HttpResponseForbidden
-    return render(request, 'chat/room.html', {'course': course})
+        return HttpResponseForbidden()
+    course = get_object_or_404(Course, id=course_id)
+    return render(request, 'chat/room.html', {
+        'course': course,
+        # messages reach the history at most this late
+        'flush_interval': settings.CHAT_BUFFER_FLUSH_INTERVAL,
+    })
+
+
+@login_required
+def course_chat_history(request, course_id):
+    '''View for the message history of a course chat room. Returns a page
+    of messages in JSON, oldest first.
+
+    Pages are selected with the "before" query parameter, the id of the
+    oldest message already received; the response includes the URL of
+    the previous page in "next", or None if there are no older messages.
+
+    Arguments include the id (int) of the course.
+    '''
+    if not is_enrolled(request.user, course_id):
+        # user is not a student of the course or course does not exist
+        return HttpResponseForbidden()
+    page_size = settings.CHAT_HISTORY_PAGE_SIZE
+    messages = Message.objects.filter(course_id=course_id)
+    before = request.GET.get('before')
+    if before:
+        try:
+            messages = messages.filter(id__lt=int(before))
+        except ValueError:
+            return HttpResponseBadRequest()
+    # fetch one extra message to know if there is a previous page
+    messages = list(
+        messages.order_by('-id')
+                .values('id', 'key', 'content', 'sent', 'user__username')
+                [:page_size + 1]
+    )
+    next_url = None
+    if len(messages) > page_size:
+        messages = messages[:page_size]
+        next_url = '{}?before={}'.format(
+            reverse('chat:course_chat_history', args=[course_id]),
+            messages[-1]['id']
+        )
+    return JsonResponse({
+        'messages': [
+            {
+                'id': m['id'],
+                'key': str(m['key']),
+                'message': m['content'],
+                'user': m['user__username'],
+                'datetime': m['sent'].isoformat(),
+            }
+            for m in reversed(messages)
+        ],
+        'next': next_url,
+    })
+
+
+@staff_member_required
+def chat_stats(request):
+    '''View returning the rate limiting and slow consumer counters of the
+    chat consumers in JSON, together with the configured limits.
+
+    Counters are kept per process, so this view reports the consumers
+    running in the process that serves the request.
+    '''
+    return JsonResponse({
+        'counters': dict(stats),
+        'limits': {
+            'rate_limits': settings.CHAT_RATE_LIMITS,
+            'send_window': settings.CHAT_SEND_WINDOW,
+            'max_queue_lag': settings.CHAT_MAX_QUEUE_LAG,
+            'slow_consumer_timeout': settings.CHAT_SLOW_CONSUMER_TIMEOUT,
+        },
+    })
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Subject, Course, Module
+from .models import Subject, Course, Module, Job
+from .search import search_courses
 
 # use memcache admin index site
 admin.site.index_template = 'memcache_status/admin_index.html'
@@ -18,4 +19,18 @@ class CourseAdmin(admin.ModelAdmin):
     list_filter = ['created', 'subject']
     search_fields = ['title', 'overview']
     prepopulated_fields = {'slug': ('title',)}
-    inlines = [ModuleInline]
\ No newline at end of file
+    inlines = [ModuleInline]
+
+    def get_search_results(self, request, queryset, search_term):
+        '''Searches the full-text index instead of scanning the title
+        and overview of every course.'''
+        if not search_term:
+            return queryset, False
+        return search_courses(search_term, queryset), False
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'status', 'attempts', 'run_after', 'created']
+    list_filter = ['status', 'kind']
+    readonly_fields = ['locked_by', 'locked_until', 'error', 'created']
@@ -0,0 +1,28 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class CoursePagination(CursorPagination):
+    '''Cursor (keyset) pagination for courses, newest first.
+
+    Each page is fetched by seeking past the last item of the previous
+    page, rather than by an OFFSET, so the cost of a page does not grow
+    with how deep a client pages.
+    '''
+    ordering = ('-created', '-id')
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
+
+
+class SubjectPagination(CoursePagination):
+    '''Cursor (keyset) pagination for subjects, ordered by title.'''
+    ordering = ('title', 'id')
+
+
+class SearchPagination(PageNumberPagination):
+    '''Page number pagination for search results, which are ordered by
+    rank and so cannot be paginated by a cursor.'''
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
@@ -1,8 +1,23 @@
 from rest_framework.permissions import BasePermission
+from students.membership import is_enrolled
 
 class IsEnrolled(BasePermission):
     '''Custom permission class for students to access contents of the
     courses they are enrolled in.
     '''
     def has_object_permission(self, request, view, obj):
-        return obj.students.filter(id=request.user.id).exists()
\ No newline at end of file
+        return is_enrolled(request.user, obj.id)
+
+
+class IsOwner(BasePermission):
+    '''Custom permission class for instructors to access the courses
+    they own.
+    '''
+    def has_object_permission(self, request, view, obj):
+        return obj.owner_id == request.user.id
+
+
+class CanAddCourse(BasePermission):
+    '''Custom permission class for users allowed to create courses.'''
+    def has_permission(self, request, view):
+        return request.user.has_perm('courses.add_course')
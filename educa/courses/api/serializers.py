@@ -15,6 +15,14 @@ class ModuleSerializer(serializers.ModelSerializer):
         fields = ['order', 'title', 'description']
 
 
+class CourseSummarySerializer(serializers.ModelSerializer):
+    '''Serializer for the Course Model, without its Modules.'''
+    class Meta:
+        model = Course
+        fields = ['id', 'subject', 'title', 'slug',
+        'overview', 'created','owner']
+
+
 class CourseSerializer(serializers.ModelSerializer):
     '''Serializer for the Course Model. Includes a custom field for 
     Modules to render the list of Module objects instead of their primary
@@ -29,7 +37,8 @@ class CourseSerializer(serializers.ModelSerializer):
 
 
 class ItemRelatedField(serializers.RelatedField):
-    '''Custom Field for Content Item generic foreign key.'''
+    '''Custom Field for Content Item generic foreign key. Items are
+    rendered through ItemBase.render(), which caches the rendered HTML.'''
     def to_representation(self, value):
         return value.render()
 
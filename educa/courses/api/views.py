@@ -1,16 +1,26 @@
 from rest_framework import generics, viewsets
 from ..models import Subject, Course
-from .serializers import SubjectSerializer, CourseSerializer, CourseWithContentsSerializer
+from .serializers import SubjectSerializer, CourseSerializer, CourseWithContentsSerializer, \
+    CourseSummarySerializer
+from .pagination import CoursePagination, SubjectPagination, SearchPagination
+from ..search import search_courses
+from ..conditional import course_condition
+from django.utils.decorators import method_decorator
 from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.authentication import BasicAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action, authentication_classes, permission_classes
-from .permissions import IsEnrolled
+from .permissions import IsEnrolled, IsOwner, CanAddCourse
+from ..transfer import ArchiveError, export_ndjson, export_zip, import_course
+from ..downloads import spooled_response
+from rest_framework import status
+from students.roster import enroll_roster, read_roster, write_outcomes
+from educa.routers import ReplicaReadAPIMixin
 
 
-class SubjectListView(generics.ListAPIView):
+class SubjectListView(ReplicaReadAPIMixin, generics.ListAPIView):
     '''API View to retrieve the list of subjects.
     
     Attributes:
@@ -19,6 +29,7 @@ class SubjectListView(generics.ListAPIView):
     '''
     queryset = Subject.objects.all()
     serializer_class = SubjectSerializer
+    pagination_class = SubjectPagination
 
 
 class SubjectDetailView(generics.RetrieveAPIView):
@@ -32,12 +43,60 @@ class SubjectDetailView(generics.RetrieveAPIView):
     serializer_class = SubjectSerializer
 
 
-class CourseViewSet(viewsets.ReadOnlyModelViewSet):
+class CourseViewSet(ReplicaReadAPIMixin, viewsets.ReadOnlyModelViewSet):
     '''Viewset for the Course model. Retrieves the list of objects or 
     detail of a course object.
+
+    The list of courses is cursor paginated. Nested modules can be left
+    out of the list with the ?modules=false query parameter. Courses are
+    searched with courses/search/?q=<query>, best match first.
+
+    The detail and contents of a course answer conditional GETs, see
+    courses.conditional. Reads are served by the read replicas, see
+    educa.routers.
+
+    Owners enroll students in bulk by posting a CSV roster of usernames
+    or email addresses to courses/<pk>/enroll/bulk/, either as the
+    request body with the text/csv content type or as the roster field
+    of a form; the outcome of each row is sent back as CSV, see
+    students.roster.
+
+    Owners export a course with courses/<pk>/export/, as NDJSON or with
+    ?archive=zip as a zip archive including the files, and import one
+    by posting it as the archive field of courses/import/, see
+    courses.transfer.
     '''
     queryset = Course.objects.all()
     serializer_class = CourseSerializer
+    pagination_class = CoursePagination
+
+    def include_modules(self):
+        '''Returns False if the client asked to leave out the nested
+        modules of the listed courses.'''
+        if self.action in ('search', 'export', 'import_course',
+                           'enroll_bulk'):
+            return False
+        if self.action != 'list':
+            return True
+        param = self.request.query_params.get('modules', '')
+        return param.lower() not in ('0', 'false', 'no')
+
+    def get_serializer_class(self):
+        if not self.include_modules():
+            return CourseSummarySerializer
+        return super().get_serializer_class()
+
+    def get_queryset(self):
+        '''Prefetch the modules, contents and content items when the
+        course contents are serialized, to avoid a query per item.'''
+        qs = super().get_queryset()
+        if self.action == 'contents':
+            qs = qs.with_contents()
+        elif self.action == 'export':
+            qs = qs.select_related('subject')
+        elif self.include_modules():
+            qs = qs.prefetch_related('modules')
+        return qs
 
     @action(
         detail=True, # action performed on a specific object
@@ -50,6 +109,33 @@ class CourseViewSet(viewsets.ReadOnlyModelViewSet):
         course.students.add(request.user)
         return Response({'enrolled':True})
 
+    @action(
+        detail=True,
+        methods=['post'],
+        url_path='enroll/bulk',
+        url_name='enroll-bulk',
+        authentication_classes = [BasicAuthentication],
+        permission_classes = [IsAuthenticated, IsOwner]
+    )
+    def enroll_bulk(self, request, *args, **kwargs):
+        course = self.get_object()
+        if request.content_type.startswith('text/csv'):
+            # the roster is read from the request body as it streams in
+            lines = request.stream or []
+        else:
+            lines = request.FILES.get('roster')
+            if lines is None:
+                return Response({'roster': ['No file was submitted.']},
+                                status=status.HTTP_400_BAD_REQUEST)
+        outcomes = enroll_roster(course, read_roster(lines))
+        # the roster is enrolled before the response is sent, see
+        # courses.downloads.spooled_response
+        return spooled_response(write_outcomes(outcomes), 'text/csv')
+
+    @method_decorator(course_condition())
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     @action(
         detail=True, # action performed on a specific object
         methods=['get'],
@@ -57,5 +143,61 @@ class CourseViewSet(viewsets.ReadOnlyModelViewSet):
         authentication_classes = [BasicAuthentication],
         permission_classes = [IsAuthenticated, IsEnrolled] # only access to enrolled students
     )
+    # the enrollment is checked before answering 304 Not Modified
+    @method_decorator(course_condition(enrolled_only=True))
     def contents(self, request, *args, **kwargs):
-        return self.retrieve(request, *args, **kwargs)
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        pagination_class=SearchPagination # results are ordered by rank
+    )
+    def search(self, request, *args, **kwargs):
+        courses = search_courses(
+            request.query_params.get('q', ''), self.get_queryset()
+        )
+        page = self.paginate_queryset(courses)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=True,
+        methods=['get'],
+        authentication_classes = [BasicAuthentication],
+        permission_classes = [IsAuthenticated, IsOwner]
+    )
+    def export(self, request, *args, **kwargs):
+        course = self.get_object()
+        if request.query_params.get('archive') == 'zip':
+            response = spooled_response(export_zip(course), 'application/zip')
+            extension = 'zip'
+        else:
+            response = spooled_response(export_ndjson(course),
+                                        'application/x-ndjson')
+            extension = 'ndjson'
+        response['Content-Disposition'] = \
+            f'attachment; filename="{course.slug}.{extension}"'
+        return response
+
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='import',
+        url_name='import',
+        authentication_classes = [BasicAuthentication],
+        permission_classes = [IsAuthenticated, CanAddCourse]
+    )
+    def import_course(self, request, *args, **kwargs):
+        archive = request.FILES.get('archive')
+        if archive is None:
+            return Response({'archive': ['No file was submitted.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            course = import_course(archive, request.user,
+                                   request.data.get('slug') or None)
+        except ArchiveError as e:
+            return Response({'archive': [str(e)]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        serializer = self.get_serializer(course)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -0,0 +1,55 @@
+'''
+Helpers for the bulk operations on courses: deletes of the job queue,
+imports and copies of whole courses.
+'''
+from django.db import connections, router
+
+# number of objects per statement of the bulk operations
+BATCH_SIZE = 500
+
+
+def batched(items, size=BATCH_SIZE):
+    '''Yields successive lists of at most size items.'''
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def next_pk(model, using):
+    '''Returns the first primary key the database would assign to the
+    next object of the given model.'''
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            # the tables are AUTOINCREMENT, keys of deleted rows are not
+            # reused
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s',
+                           [table])
+        else:
+            cursor.execute('SELECT MAX({}) FROM {}'.format(
+                connection.ops.quote_name(model._meta.pk.column),
+                connection.ops.quote_name(table)
+            ))
+        row = cursor.fetchone()
+    return (row[0] if row and row[0] else 0) + 1
+
+
+def bulk_insert(model, objs):
+    '''Inserts the given objects with bulk_create, in batches, and sets
+    their primary keys.
+
+    Backends that cannot return the keys of rows inserted in bulk, such
+    as SQLite, are given the keys up front, following the last key of
+    the table. This must run in a transaction, which SQLite serializes
+    with the other writers.'''
+    objs = list(objs)
+    if not objs:
+        return objs
+    using = router.db_for_write(model)
+    if not connections[using].features.can_return_rows_from_bulk_insert:
+        for pk, obj in enumerate(objs, next_pk(model, using)):
+            obj.pk = pk
+    return model._default_manager.using(using).bulk_create(
+        objs, batch_size=BATCH_SIZE
+    )
@@ -0,0 +1,104 @@
+import hashlib
+import re
+import time
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+# Rendered content items are keyed by their updated timestamp, so a
+# stale entry is never served and may be kept for a long time.
+RENDER_CACHE_TIMEOUT = 60 * 60 * 24
+# Cached pages are keyed by the last update of what they display.
+PAGE_CACHE_TIMEOUT = 60 * 15
+
+
+
+def get_version(name):
+    '''Returns the current version of the given cache namespace.
+
+    Versions are stored without expiry. A missing version is initialised
+    with the current time rather than a counter, so that an evicted
+    version can never be re-issued and match older cached entries.
+    '''
+    return cache.get_or_set(f'version:{name}', time.time_ns, None)
+
+
+def bump_version(name):
+    '''Invalidates every cache entry keyed with the given namespace
+    version by moving the namespace to a new version.'''
+    cache.set(f'version:{name}', time.time_ns(), None)
+
+
+def module_version_name(module_id):
+    '''Returns the version namespace for the contents of a module.'''
+    return f'module_{module_id}_contents'
+
+
+def get_module_version(module_id):
+    '''Returns the current version of the contents of a module.'''
+    return get_version(module_version_name(module_id))
+
+
+def bump_module_versions(module_ids):
+    '''Invalidates the cached contents of the given modules.'''
+    for module_id in set(module_ids):
+        bump_version(module_version_name(module_id))
+
+
+def item_render_key(item):
+    '''Returns the cache key for the rendered HTML of a content item,
+    based on its model, primary key and last update.'''
+    return 'item_render:{}:{}:{}'.format(
+        item._meta.label_lower,
+        item.pk,
+        item.updated.timestamp()
+    )
+
+
+def get_catalog_version():
+    '''Returns the current generation of the course catalog cache.'''
+    return get_version('catalog')
+
+
+def bump_catalog_version():
+    '''Invalidates the cached course catalog.'''
+    bump_version('catalog')
+
+
+def page_key(name, updated, *parts):
+    '''Returns the cache key of a shared page, based on its name, its
+    URL arguments and the last update of what it displays.'''
+    return 'page:{}:{}:{}'.format(
+        name, ':'.join(str(part) for part in parts), updated.timestamp()
+    )
+
+
+# Per-user parts of a shared cached page are left out as markers, which
+# cannot be forged by page content without the secret key. The token is
+# derived on first use, so importing this module needs no SECRET_KEY.
+@lru_cache(maxsize=None)
+def hole_token():
+    return hashlib.sha256(
+        f'page-cache-hole:{settings.SECRET_KEY}'.encode()
+    ).hexdigest()[:16]
+
+
+@lru_cache(maxsize=None)
+def hole_re():
+    return re.compile(rf'<!--hole:{hole_token()}:([\w./-]+)-->')
+
+
+def hole_marker(template_name):
+    '''Returns the marker left in a shared page in place of the given
+    per-user template.'''
+    return f'<!--hole:{hole_token()}:{template_name}-->'
+
+
+def fill_holes(content, request):
+    '''Renders the per-user templates of a shared page for the given
+    request in place of their markers.'''
+    return hole_re().sub(
+        lambda match: render_to_string(match.group(1), request=request),
+        content
+    )
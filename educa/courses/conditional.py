@@ -0,0 +1,53 @@
+'''
+Conditional GET support for the views of a course.
+
+Course.updated moves whenever the course, one of its modules or one of
+their contents change (see courses.signals), so it versions everything
+rendered from a course. Requests whose If-None-Match or
+If-Modified-Since validators are still current are answered with 304 Not
+Modified before the view queries, serializes or renders anything.
+'''
+from django.views.decorators.http import condition
+from students.membership import is_enrolled
+from .models import Course
+
+
+def get_course_updated(request, pk):
+    '''Returns the last update of the course, or None if there is no
+    such course. Fetched once per request.'''
+    updated = request.__dict__.setdefault('_course_updated', {})
+    if pk not in updated:
+        try:
+            updated[pk] = Course.objects.filter(pk=pk) \
+                                        .values_list('updated', flat=True) \
+                                        .first()
+        except (TypeError, ValueError):
+            updated[pk] = None
+    return updated[pk]
+
+
+def course_condition(enrolled_only=False, per_user=False):
+    '''Returns a decorator answering conditional GETs to a view of the
+    course given by the pk URL argument.
+
+    With enrolled_only, requests of users not enrolled on the course get
+    no validators and reach the view, which denies them. With per_user,
+    the ETag is specific to the user, for pages displaying the user.
+    Other URL arguments, e.g. a module id, are part of the ETag.
+    '''
+    def last_modified(request, pk, **kwargs):
+        if enrolled_only and not is_enrolled(request.user, pk):
+            return None
+        return get_course_updated(request, pk)
+
+    def etag(request, pk, **kwargs):
+        updated = last_modified(request, pk, **kwargs)
+        if updated is None:
+            return None
+        parts = ['course', pk, updated.timestamp()]
+        parts += [f'{key}-{value}' for key, value in sorted(kwargs.items())]
+        if per_user:
+            parts.append(f'user-{request.user.pk}')
+        return '-'.join(str(part) for part in parts)
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
@@ -0,0 +1,54 @@
+'''
+Denormalized counters of the catalog: the number of courses of each
+subject, and the number of modules and of enrolled students of each
+course.
+
+The counters are kept up to date by courses.signals with atomic F()
+updates, so reading them needs no aggregate query. Changes that bypass
+the signals (bulk_create, raw SQL) can leave them stale; the
+rebuild_counters command finds and repairs stale counters.
+'''
+from django.db.models import Count, F, Q
+from django.db.models.functions import Greatest
+from .models import Subject, Course
+
+# (model, counter field, relation counted, filter of the related rows)
+COUNTERS = [
+    # deleted courses waiting for the job queue are not counted
+    (Subject, 'total_courses', 'courses', Q(courses__deleted=False)),
+    (Course, 'total_modules', 'modules', None),
+    (Course, 'student_count', 'students', None),
+]
+
+
+def adjust(model, field, pks, delta):
+    '''Atomically adds delta to the counter field of the given objects.
+    Counters are never decremented below zero.'''
+    pks = list(pks)
+    if not pks or not delta:
+        return
+    value = F(field) + delta
+    if delta < 0:
+        value = Greatest(value, 0)
+    model.objects.filter(pk__in=pks).update(**{field: value})
+
+
+def find_stale():
+    '''Returns (model, field, pk, stored, actual) for every counter
+    that does not match the count of its relation.'''
+    stale = []
+    for model, field, relation, related in COUNTERS:
+        rows = model.objects.annotate(
+            actual=Count(relation, filter=related)
+        ).exclude(**{field: F('actual')}).values_list('pk', field, 'actual')
+        stale += [(model, field, pk, stored, actual)
+                  for pk, stored, actual in rows]
+    return stale
+
+
+def rebuild():
+    '''Repairs the stale counters and returns them, as find_stale().'''
+    stale = find_stale()
+    for model, field, pk, stored, actual in stale:
+        model.objects.filter(pk=pk).update(**{field: actual})
+    return stale
@@ -0,0 +1,119 @@
+'''
+Delivery of the protected files of the course contents.
+
+In production the permission checked download view hands the transfer
+to nginx, by answering with an X-Accel-Redirect to the internal
+PROTECTED_MEDIA_LOCATION, so no application worker is held while the
+file is sent; nginx also serves range requests. In development the
+file is streamed by a FileResponse, which supports single byte ranges.
+
+Responses generated with queries, such as course exports, are spooled
+to a temporary file by the view: Django 3.2 iterates the content of a
+streaming response on the event loop under ASGI, where the ORM cannot
+be used.
+'''
+import mimetypes
+import re
+import tempfile
+from urllib.parse import quote
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# bytes of a spooled response kept in memory before moving to disk
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+class RangeFile:
+    '''File-like object reading length bytes of a file from start.'''
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    '''Returns the (start, end) byte positions of a single range header,
+    or None if the whole file should be sent. Raises ValueError if the
+    range cannot be satisfied.'''
+    match = RANGE_RE.match(header or '')
+    if match is None:
+        # missing, malformed or multiple ranges, send the whole file
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # suffix range, the last bytes of the file
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise ValueError('Range not satisfiable')
+    return start, end
+
+
+def accel_response(name, filename, attachment):
+    '''Returns a response handing the transfer of the stored file to
+    nginx.'''
+    response = HttpResponse()
+    response['X-Accel-Redirect'] = settings.PROTECTED_MEDIA_LOCATION + quote(name)
+    response['Content-Type'] = mimetypes.guess_type(name)[0] or \
+        'application/octet-stream'
+    set_disposition(response, filename, attachment)
+    return response
+
+
+def file_response(request, storage, name, filename, attachment):
+    '''Returns a response streaming the stored file, or the requested
+    byte range of it.'''
+    size = storage.size(name)
+    try:
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    file = storage.open(name, 'rb')
+    if byte_range is None:
+        response = FileResponse(file)
+        response['Content-Length'] = size
+    else:
+        start, end = byte_range
+        response = FileResponse(RangeFile(file, start, end - start + 1),
+                                status=206)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    response['Content-Type'] = mimetypes.guess_type(name)[0] or \
+        'application/octet-stream'
+    response['Accept-Ranges'] = 'bytes'
+    set_disposition(response, filename, attachment)
+    return response
+
+
+def set_disposition(response, filename, attachment):
+    disposition = 'attachment' if attachment else 'inline'
+    response['Content-Disposition'] = \
+        f"{disposition}; filename*=UTF-8''{quote(filename)}"
+
+
+def spooled_response(chunks, content_type):
+    '''Returns a response streaming the given chunks, of bytes or text,
+    from a temporary file they are all written to first.'''
+    file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    for chunk in chunks:
+        file.write(chunk.encode() if isinstance(chunk, str) else chunk)
+    file.seek(0)
+    return FileResponse(file, content_type=content_type)
@@ -1,31 +1,247 @@
-from django.db import models
-from django.core.exceptions import ObjectDoesNotExist
+from django.apps import apps
+from django.db import models, router, transaction, IntegrityError
+from django.db.models import F, Max, Q, Case, When, Value
+from .bulk import batched
+
+# groups of objects per statement of OrderField.reserve_many()
+SCOPE_BATCH_SIZE = 200
 
 class OrderField(models.PositiveIntegerField):
     '''Custom model field, which inherits from models.PositiveIntegerfield,
     which is used to automatically assign an order value when no specific 
     order value is provided, and which orders objects with respect to other 
-    fields.'''
+    fields.
+
+    Order values are reserved from an OrderSequence row per group of
+    objects (i.e. per value of the "for_fields"). Reserving values is an
+    atomic increment of that row, so concurrent inserts never receive
+    the same order, and a whole batch of objects costs the same constant
+    number of queries as a single object, even across groups. Objects
+    saved with an explicit order move the sequence of their group past
+    it, so the values reserved next follow them.
+    '''
     def __init__(self, for_fields=None, *args, **kwargs):
         self.for_fields = for_fields
         super().__init__(*args, **kwargs)
-    
+
+    @property
+    def reserved_attname(self):
+        '''Name of the instance attribute holding the last order the
+        sequence of its group was moved past, so bulk_create(), which
+        calls pre_save() on every object, does not move it again.'''
+        return f'_{self.attname}_reserved'
+
+    def get_group(self, model_instance):
+        '''Returns the values of the "for_fields" of the given instance,
+        keyed by their attribute names.'''
+        return {
+            attname: getattr(model_instance, attname)
+            for attname in (
+                self.model._meta.get_field(field).attname
+                for field in self.for_fields or []
+            )
+        }
+
+    def get_scope(self, model_instance):
+        '''Returns the name of the sequence for the group of objects the
+        given instance is ordered in.'''
+        values = [f'{attname}={value}' for attname, value
+                  in self.get_group(model_instance).items()]
+        return f'{self.model._meta.label_lower}.{self.attname}:' \
+               + ','.join(values)
+
+    def delete_sequences(self, values, using=None):
+        '''Deletes the sequences of the groups of objects set by the given
+        values of the single "for_fields" field, e.g. once the course
+        the modules were ordered under is deleted.'''
+        OrderSequence = apps.get_model('courses', 'OrderSequence')
+        using = using or router.db_for_write(self.model)
+        attname = self.model._meta.get_field(self.for_fields[0]).attname
+        prefix = f'{self.model._meta.label_lower}.{self.attname}:{attname}='
+        for batch in batched(values):
+            OrderSequence.objects.using(using).filter(
+                scope__in=[f'{prefix}{value}' for value in batch]
+            ).delete()
+
+    def get_next_value(self, model_instance, using):
+        '''Returns the order following the last existing object of the
+        group of the given instance.'''
+        # filter by objects with the same field values for fields in
+        # "for_fields"
+        qs = self.model._default_manager.using(using) \
+                 .filter(**self.get_group(model_instance))
+        last = qs.aggregate(last=Max(self.attname))['last']
+        return 0 if last is None else last + 1
+
+    def reserve(self, model_instance, count):
+        '''Reserves count consecutive order values in the group of the
+        given instance and returns the first one.'''
+        OrderSequence = apps.get_model('courses', 'OrderSequence')
+        using = router.db_for_write(self.model, instance=model_instance)
+        sequences = OrderSequence.objects.using(using)
+        scope = self.get_scope(model_instance)
+        with transaction.atomic(using=using):
+            # the update locks the sequence row until the end of the
+            # transaction, serializing concurrent reservations
+            updated = sequences.filter(scope=scope) \
+                               .update(value=F('value') + count)
+            if not updated:
+                # first reservation of the group, start after the
+                # existing objects
+                start = self.get_next_value(model_instance, using)
+                try:
+                    with transaction.atomic(using=using):
+                        sequences.create(scope=scope, value=start + count)
+                except IntegrityError:
+                    # created by a concurrent reservation
+                    sequences.filter(scope=scope) \
+                             .update(value=F('value') + count)
+            value = sequences.filter(scope=scope) \
+                             .values_list('value', flat=True).get()
+        return value - count
+
+    def get_next_values(self, instances, using):
+        '''Returns the next order of the group of each of the given
+        instances, by scope. Groups set by a single field are looked up
+        with one query.'''
+        if len(self.for_fields or []) != 1:
+            return {self.get_scope(obj): self.get_next_value(obj, using)
+                    for obj in instances}
+        attname = self.model._meta.get_field(self.for_fields[0]).attname
+        scopes = {getattr(obj, attname): self.get_scope(obj)
+                  for obj in instances}
+        last = dict(
+            self.model._default_manager.using(using)
+                .filter(**{f'{attname}__in': list(scopes)})
+                .order_by()
+                .values_list(attname)
+                .annotate(last=Max(self.attname))
+        )
+        return {scope: last.get(value, -1) + 1
+                for value, scope in scopes.items()}
+
+    def reserve_many(self, groups):
+        '''Reserves order values in several groups at once, given as a
+        dict of scope: (instance of the group, count). Returns the first
+        reserved value of each group, by scope.
+
+        Costs a constant number of queries per batch of groups, where
+        reserve() costs them per group; e.g. for the contents of all the
+        modules of an imported course.'''
+        OrderSequence = apps.get_model('courses', 'OrderSequence')
+        instance = next(iter(groups.values()))[0]
+        using = router.db_for_write(self.model, instance=instance)
+        sequences = OrderSequence.objects.using(using)
+        starts = {}
+        with transaction.atomic(using=using):
+            for scopes in batched(groups, SCOPE_BATCH_SIZE):
+                sequences.filter(scope__in=scopes).update(
+                    value=F('value') + Case(
+                        *[When(scope=scope, then=Value(groups[scope][1]))
+                          for scope in scopes],
+                        output_field=models.PositiveIntegerField()
+                    )
+                )
+                values = dict(sequences.filter(scope__in=scopes)
+                                       .values_list('scope', 'value'))
+                missing = [scope for scope in scopes if scope not in values]
+                if missing:
+                    # first reservation of these groups, start after the
+                    # existing objects
+                    nexts = self.get_next_values(
+                        [groups[scope][0] for scope in missing], using
+                    )
+                    try:
+                        with transaction.atomic(using=using):
+                            sequences.bulk_create([
+                                OrderSequence(
+                                    scope=scope,
+                                    value=nexts[scope] + groups[scope][1]
+                                ) for scope in missing
+                            ])
+                    except IntegrityError:
+                        # some were created by concurrent reservations
+                        for scope in missing:
+                            starts[scope] = self.reserve(*groups[scope])
+                    else:
+                        for scope in missing:
+                            values[scope] = nexts[scope] + groups[scope][1]
+                for scope in scopes:
+                    if scope not in starts:
+                        starts[scope] = values[scope] - groups[scope][1]
+        return starts
+
+    def advance(self, instances):
+        '''Moves the sequences of the groups of the given instances past
+        the orders the instances were given explicitly, so the values
+        reserved next follow them. Sequences not created yet start after
+        the existing objects anyway.'''
+        tops = {}
+        for obj in instances:
+            order = getattr(obj, self.attname)
+            if order is not None and \
+                    getattr(obj, self.reserved_attname, None) != order:
+                scope = self.get_scope(obj)
+                tops[scope] = max(order + 1, tops.get(scope, 0))
+                setattr(obj, self.reserved_attname, order)
+        if not tops:
+            return
+        OrderSequence = apps.get_model('courses', 'OrderSequence')
+        using = router.db_for_write(self.model, instance=instances[0])
+        sequences = OrderSequence.objects.using(using)
+        for scopes in batched(tops, SCOPE_BATCH_SIZE):
+            # only the sequences behind are written, and locked
+            behind = Q()
+            for scope in scopes:
+                behind |= Q(scope=scope, value__lt=tops[scope])
+            sequences.filter(behind).update(
+                value=Case(
+                    *[When(scope=scope, then=Value(tops[scope]))
+                      for scope in scopes],
+                    output_field=models.PositiveIntegerField()
+                )
+            )
+
+    def allocate(self, instances):
+        '''Assigns order values to the given instances that have none,
+        with a single reservation for all their groups of objects.'''
+        groups = {}
+        for obj in instances:
+            if getattr(obj, self.attname) is None:
+                groups.setdefault(self.get_scope(obj), []).append(obj)
+        if not groups:
+            return
+        if len(groups) == 1:
+            (scope, objs), = groups.items()
+            starts = {scope: self.reserve(objs[0], len(objs))}
+        else:
+            starts = self.reserve_many({
+                scope: (objs[0], len(objs)) for scope, objs in groups.items()
+            })
+        for scope, objs in groups.items():
+            for i, obj in enumerate(objs):
+                setattr(obj, self.attname, starts[scope] + i)
+                setattr(obj, self.reserved_attname, starts[scope] + i)
+
     def pre_save(self, model_instance, add):
         if getattr(model_instance, self.attname) is None: #self.attname is the name of the field in the model
             # no current value
-            try:
-                qs = self.model.objects.all()
-                if self.for_fields:
-                    # filter by objects with the same field values
-                    # for fields in "for_fields"
-                    query = {field:getattr(model_instance, field) for field in self.for_fields}
-                    qs = qs.filter(**query)
-                # get the order of the last item
-                last_item = qs.latest(self.attname)
-                value = last_item.order + 1
-            except ObjectDoesNotExist:
-                value = 0
-            setattr(model_instance, self.attname, value)
-            return value
+            self.allocate([model_instance])
+            return getattr(model_instance, self.attname)
         else:
-            return super().pre_save(model_instance, add)
\ No newline at end of file
+            self.advance([model_instance])
+            return super().pre_save(model_instance, add)
+
+
+class OrderedQuerySet(models.QuerySet):
+    '''QuerySet for models with an OrderField. Assigns the order values
+    of objects created in bulk with one reservation per group of
+    objects, rather than one per object.'''
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for field in self.model._meta.concrete_fields:
+            if isinstance(field, OrderField):
+                field.advance(objs)
+                field.allocate(objs)
+        return super().bulk_create(objs, *args, **kwargs)
@@ -0,0 +1,152 @@
+'''
+Responsive variants of the Image content items.
+
+When an Image is saved with a new file, a thumbnail and resized copies
+of the file at the IMAGE_VARIANT_WIDTHS narrower than the original, in
+the original format and in WebP, are generated off the request path by a
+pool of IMAGE_VARIANT_WORKERS threads. The variants are stored on disk
+next to each other under variants/, named after the original file, so
+items sharing a file share its variants. Once generated they are
+recorded in Image.variants and served through srcset by Image.render;
+until then the original is served.
+'''
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image as PILImage, ImageOps
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = Lock()
+
+
+def get_executor():
+    '''Returns the worker pool, started on first use.'''
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_VARIANT_WORKERS,
+                thread_name_prefix='image-variants'
+            )
+    return _executor
+
+
+def schedule_variants(image_id):
+    '''Generates the variants of an image in the worker pool once the
+    current transaction commits. Without workers they are generated
+    right away, e.g. in development.'''
+    def submit():
+        if settings.IMAGE_VARIANT_WORKERS:
+            get_executor().submit(run_in_worker, image_id)
+        else:
+            generate_variants(image_id)
+    transaction.on_commit(submit)
+
+
+def run_in_worker(image_id):
+    try:
+        generate_variants(image_id)
+    except Exception:
+        logger.exception('Generating the variants of image %s failed.',
+                         image_id)
+    finally:
+        # worker threads do not go through the request cycle
+        connections.close_all()
+
+
+def variant_name(source, label, extension):
+    '''Returns the storage name of a variant of the given file.'''
+    return f'variants/{os.path.splitext(source)[0]}/{label}{extension}'
+
+
+def delete_variants(source):
+    '''Deletes the stored variants of the given file.'''
+    directory = os.path.dirname(variant_name(source, '', ''))
+    try:
+        files = default_storage.listdir(directory)[1]
+    except FileNotFoundError:
+        return
+    for name in files:
+        default_storage.delete(f'{directory}/{name}')
+
+
+def save_variant(original, source, label, size, fmt):
+    '''Stores the original resized to fit the given size, unless the
+    variant is already on disk. Returns the name of the variant.'''
+    extension = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}[fmt]
+    name = variant_name(source, label, extension)
+    if default_storage.exists(name):
+        return name
+    image = original.copy()
+    image.thumbnail(size, PILImage.LANCZOS)
+    if fmt == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, quality=settings.IMAGE_VARIANT_QUALITY)
+    return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def generate_variants(image_id):
+    '''Generates the missing variants of an image and records them in
+    Image.variants.'''
+    from .models import Image
+    image = Image.objects.filter(pk=image_id).first()
+    if image is None or not image.content:
+        return
+    source = image.content.name
+    variants = {'source': source, 'widths': []}
+    try:
+        with image.content.open('rb') as f:
+            original = PILImage.open(f)
+            fmt = 'PNG' if original.format in ('PNG', 'GIF') else 'JPEG'
+            original = ImageOps.exif_transpose(original)
+    except (OSError, ValueError):
+        # a missing file or not an image, the original is served as is
+        logger.warning('No variants for image %s: cannot read %s.',
+                       image_id, source)
+        record_variants(image_id, variants)
+        return
+
+    width, height = original.size
+    variants['width'] = width
+    thumbnail = settings.IMAGE_THUMBNAIL_SIZE
+    variants['thumbnail'] = save_variant(
+        original, source, 'thumbnail', (thumbnail, thumbnail), fmt
+    )
+    for w in sorted(settings.IMAGE_VARIANT_WIDTHS):
+        if w >= width:
+            break
+        variants['widths'].append({
+            'width': w,
+            'src': save_variant(original, source, w, (w, height), fmt),
+            'webp': save_variant(original, source, w, (w, height), 'WEBP'),
+        })
+    # the original completes the srcset, along with its WebP version
+    variants['widths'].append({
+        'width': width,
+        'src': source,
+        'webp': save_variant(original, source, width, (width, height),
+                             'WEBP'),
+    })
+    record_variants(image_id, variants)
+
+
+def record_variants(image_id, variants):
+    '''Saves the variants of an image, unless the image was given
+    another file meanwhile. Saving the image invalidates its cached
+    renders.'''
+    from .models import Image
+    image = Image.objects.filter(
+        pk=image_id, content=variants['source']
+    ).first()
+    if image is not None:
+        image.variants = variants
+        image.save(update_fields=['variants', 'updated'])
@@ -0,0 +1,272 @@
+'''
+Database-backed background job queue.
+
+Work that should not hold up a request, such as deleting a course with
+all its contents or removing files from disk, is enqueued as a Job row
+in the transaction of the request and processed by the run_jobs worker
+processes once the transaction commits.
+
+Workers claim pending jobs in batches, and jobs of the same kind are
+handed together to their handler, so a handler can process a batch in
+a few set-based statements. A failed batch is retried job by job, so
+one bad job does not hold back the others; failed jobs are retried with
+a growing delay until JOB_MAX_ATTEMPTS, then kept with status failed.
+
+Bulk deletes run with the per-object signal handlers muted (see
+bulk_delete()); the handlers maintain the counters, blob references and
+caches for the whole batch instead.
+'''
+import logging
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from functools import wraps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import CharField, F, Q, Value
+from django.db.models.functions import Cast, Concat
+from django.utils import timezone
+from students.membership import invalidate_memberships
+from .bulk import batched
+from .caching import bump_catalog_version
+from .counters import adjust
+from .images import delete_variants
+from .models import (Job, Subject, Course, Module, Content, Blob, File, Image,
+                     DownloadMixin, DELETED_SLUG_PREFIX)
+from .storage import content_storage, release
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+_bulk = ContextVar('bulk_delete', default=False)
+
+
+def handler(kind):
+    '''Registers the decorated function as the handler of the jobs of
+    the given kind. Handlers receive a list of job payloads.'''
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, **payload):
+    '''Adds a job to the queue. Enqueued within a transaction, the job
+    is only seen by the workers once the transaction commits.'''
+    return Job.objects.create(kind=kind, payload=payload)
+
+
+@contextmanager
+def bulk_delete():
+    '''Mutes the signal handlers decorated with unless_bulk, while a job
+    handler deletes objects in bulk and does their bookkeeping itself.'''
+    token = _bulk.set(True)
+    try:
+        yield
+    finally:
+        _bulk.reset(token)
+
+
+def unless_bulk(func):
+    '''Skips the decorated signal handler within bulk_delete().'''
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _bulk.get():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def claim(worker, limit):
+    '''Claims up to limit jobs for the given worker and returns them.
+
+    Pending jobs that are due, and running jobs whose worker lease has
+    expired, are available. The claim is a single conditional UPDATE, so
+    concurrent workers never claim the same job.'''
+    now = timezone.now()
+    available = Q(status=Job.PENDING, run_after__lte=now) | \
+        Q(status=Job.RUNNING, locked_until__lt=now)
+    ids = list(Job.objects.filter(available)
+                          .values_list('id', flat=True)[:limit])
+    if not ids:
+        return []
+    Job.objects.filter(available, id__in=ids).update(
+        status=Job.RUNNING,
+        locked_by=worker,
+        locked_until=now + timedelta(seconds=settings.JOB_LEASE),
+        attempts=F('attempts') + 1
+    )
+    return list(Job.objects.filter(id__in=ids, status=Job.RUNNING,
+                                   locked_by=worker))
+
+
+def fail(job, error):
+    '''Schedules a failed job for another attempt, or gives up on it
+    after JOB_MAX_ATTEMPTS attempts.'''
+    job.error = repr(error)
+    job.locked_by = ''
+    job.locked_until = None
+    if job.attempts >= settings.JOB_MAX_ATTEMPTS:
+        job.status = Job.FAILED
+    else:
+        job.status = Job.PENDING
+        job.run_after = timezone.now() + \
+            timedelta(seconds=2 ** job.attempts)
+    job.save(update_fields=['status', 'run_after', 'error', 'locked_by',
+                            'locked_until'])
+
+
+def process(jobs):
+    '''Runs the handler of each kind of job on the batch of its jobs.
+    Each batch runs in a transaction; if it fails, its jobs are run one
+    by one.'''
+    by_kind = defaultdict(list)
+    for job in jobs:
+        by_kind[job.kind].append(job)
+    for kind, batch in by_kind.items():
+        func = HANDLERS.get(kind)
+        if func is None:
+            for job in batch:
+                fail(job, LookupError(f'No handler for job kind {kind}.'))
+            continue
+        try:
+            with transaction.atomic():
+                func([job.payload for job in batch])
+                Job.objects.filter(id__in=[job.id for job in batch]).delete()
+            continue
+        except Exception as e:
+            if len(batch) == 1:
+                logger.exception('Job %s failed.', batch[0])
+                fail(batch[0], e)
+                continue
+        for job in batch:
+            try:
+                with transaction.atomic():
+                    func([job.payload])
+                    job.delete()
+            except Exception as e:
+                logger.exception('Job %s failed.', job)
+                fail(job, e)
+
+
+def run_pending(worker, limit=None):
+    '''Claims and processes a batch of jobs. Returns the number of jobs
+    claimed, 0 when the queue is empty.'''
+    jobs = claim(worker, limit or settings.JOB_BATCH_SIZE)
+    process(jobs)
+    return len(jobs)
+
+
+def group_items(pairs):
+    '''Groups (content type id, object id) pairs into a dict of model:
+    set of object ids.'''
+    items = defaultdict(set)
+    for content_type_id, object_id in pairs:
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        items[model].add(object_id)
+    return items
+
+
+def delete_items(pairs):
+    '''Deletes the content items given as (content type id, object id)
+    pairs, except those still displayed by a module, in batched
+    statements. Releases their files and returns the names of the files.
+    Must be called within bulk_delete().'''
+    names = []
+    for model, ids in group_items(pairs).items():
+        content_type = ContentType.objects.get_for_model(model)
+        for batch in batched(sorted(ids)):
+            items = model.objects.filter(id__in=batch).exclude(
+                id__in=Content.objects.filter(
+                    content_type=content_type, object_id__in=batch
+                ).values('object_id')
+            )
+            if issubclass(model, DownloadMixin):
+                names += items.values_list('content', flat=True)
+            items.delete()
+    release(names)
+    return [name for name in names if name]
+
+
+def hide_courses(course_ids):
+    '''Marks the given courses deleted, in the request deleting them, so
+    they leave the catalog, the manage lists and the API right away, and
+    updates the counters and caches that count them. Their slugs are
+    freed for new courses. The delete_courses job removes them.'''
+    courses = list(Course.objects.filter(id__in=course_ids)
+                                 .values_list('id', 'subject_id'))
+    if not courses:
+        return
+    Course.objects.filter(id__in=[pk for pk, s in courses]).update(
+        deleted=True,
+        slug=Concat(Value(DELETED_SLUG_PREFIX), Cast('id', CharField()),
+                    output_field=CharField())
+    )
+    for subject_id, count in Counter(s for pk, s in courses).items():
+        adjust(Subject, 'total_courses', [subject_id], -count)
+    transaction.on_commit(bump_catalog_version)
+
+
+@handler('delete_courses')
+def delete_courses(payloads):
+    '''Deletes courses with their modules, contents and content items.'''
+    course_ids = {p['course_id'] for p in payloads}
+    # courses enqueued without being hidden first
+    hide_courses(course_ids)
+    course_ids = list(Course.all_objects.filter(id__in=course_ids)
+                                        .values_list('id', flat=True))
+    if not course_ids:
+        return
+    student_ids = list(
+        Course.students.through.objects.filter(course_id__in=course_ids)
+                                       .values_list('user_id', flat=True)
+                                       .distinct()
+    )
+    contents = Content.objects.filter(module__course_id__in=course_ids)
+    with bulk_delete():
+        pairs = list(contents.values_list('content_type_id', 'object_id'))
+        for batch in batched(contents.values_list('id', flat=True)):
+            Content.objects.filter(id__in=batch).delete()
+        names = delete_items(pairs)
+        modules = Module.objects.filter(course_id__in=course_ids)
+        # the deleted objects no longer need their order sequences
+        Content._meta.get_field('order').delete_sequences(
+            list(modules.values_list('id', flat=True))
+        )
+        Module._meta.get_field('order').delete_sequences(course_ids)
+        modules.delete()
+        Course.all_objects.filter(id__in=course_ids).delete()
+    if names:
+        enqueue('delete_files', names=names)
+    transaction.on_commit(lambda: invalidate_memberships(student_ids))
+
+
+@handler('delete_items')
+def delete_content_items(payloads):
+    '''Deletes content items no longer displayed by any module.'''
+    with bulk_delete():
+        names = delete_items(
+            (p['content_type_id'], p['object_id']) for p in payloads
+        )
+    if names:
+        enqueue('delete_files', names=names)
+
+
+@handler('delete_files')
+def delete_files(payloads):
+    '''Deletes the files and image variants that no item references.
+
+    Files of the content-addressed storage are left to the cleanup_blobs
+    command, which deletes them after a grace period.'''
+    names = {name for p in payloads for name in p['names']}
+    names -= set(Blob.objects.filter(name__in=names)
+                             .values_list('name', flat=True))
+    for model in (File, Image):
+        names -= set(model.objects.filter(content__in=names)
+                                  .values_list('content', flat=True))
+    for name in sorted(names):
+        content_storage.delete(name)
+        delete_variants(name)
+
@@ -0,0 +1,248 @@
+import asyncio
+import io
+import sys
+import threading
+import time
+from asgiref.sync import async_to_sync
+from django.core.cache import caches
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+from django.urls import reverse
+from courses.synthetic import build_dataset
+from educa.routing import application
+from .loadtest import LOCMEM_CACHES, percentile
+
+
+def wsgi_environ(path):
+    '''Returns the WSGI environ of a GET request of the given path.'''
+    return {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+
+
+def asgi_scope(path):
+    '''Returns the ASGI scope of a GET request of the given path.'''
+    return {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(b'host', b'testserver')],
+        'client': ('127.0.0.1', 50000),
+        'server': ('testserver', 80),
+    }
+
+
+class Command(BaseCommand):
+    '''Compares the read-heavy endpoints served by the ASGI application,
+    as Daphne serves it, with the WSGI application served by a pool of
+    --workers workers, as uWSGI serves it, against a synthetic dataset in
+    a temporary test database.
+
+    --concurrency clients each send their share of --requests requests
+    to an endpoint, one after the other. Each client takes
+    --client-delay seconds to read a response: a WSGI worker is held
+    until the response is read, while the ASGI application serves other
+    requests meanwhile. The latencies include the time spent waiting for
+    a free worker.
+
+    The WSGI workers are threads of this process rather than uWSGI
+    processes, so both servers share the GIL; the comparison is about
+    the requests each server has in flight, not raw CPU throughput.
+    '''
+    help = 'Benchmark the ASGI application against a WSGI worker pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Timed requests per endpoint and server.')
+        parser.add_argument('--concurrency', type=int, default=32,
+                            help='Number of concurrent clients.')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of WSGI workers.')
+        parser.add_argument('--client-delay', type=float, default=0.02,
+                            help='Seconds a client takes to read a '
+                                 'response.')
+        parser.add_argument('--courses', type=int, default=20)
+        parser.add_argument('--modules', type=int, default=5,
+                            help='Modules per course.')
+        parser.add_argument('--items', type=int, default=4,
+                            help='Content items per module.')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            with override_settings(CACHES=LOCMEM_CACHES):
+                caches['default'].clear()
+                results = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        self.report(results)
+
+    def run(self, options):
+        data = build_dataset(
+            courses=options['courses'],
+            modules=options['modules'],
+            items=options['items'],
+            students=1,
+            prefix='benchmark'
+        )
+        course = data['courses'][0]
+        endpoints = {
+            'catalog': reverse('course_list'),
+            'course_detail': reverse('course_detail', args=[course.slug]),
+            'api_course_list': reverse('api:course-list'),
+        }
+        wsgi = WSGIHandler()
+        results = {}
+        for name, path in endpoints.items():
+            # warms up the cache and the connections
+            self.wsgi_request(wsgi, path, 0)
+            results[name] = {
+                'wsgi': self.measure_wsgi(wsgi, path, options),
+                'asgi': async_to_sync(self.measure_asgi)(path, options),
+            }
+        return results
+
+    def wsgi_request(self, handler, path, delay):
+        status = []
+        response = handler(
+            wsgi_environ(path),
+            lambda value, headers, exc_info=None: status.append(value)
+        )
+        try:
+            for chunk in response:
+                pass
+            # the worker writes the response to the client
+            time.sleep(delay)
+        finally:
+            response.close()
+        if not status[0].startswith('200'):
+            raise CommandError(f'{path}: HTTP {status[0]}')
+
+    def measure_wsgi(self, handler, path, options):
+        '''Times the requests of the clients to a pool of WSGI workers.'''
+        workers = threading.BoundedSemaphore(options['workers'])
+        latencies = []
+        errors = []
+
+        def client(count):
+            try:
+                for i in range(count):
+                    sent = time.perf_counter()
+                    with workers:
+                        self.wsgi_request(handler, path,
+                                          options['client_delay'])
+                    latencies.append(time.perf_counter() - sent)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        clients = [
+            threading.Thread(target=client, args=(count,))
+            for count in self.shares(options)
+        ]
+        start = time.perf_counter()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        if errors:
+            raise CommandError(f'{path}: {errors[0]!r}')
+        return self.summarize(latencies, elapsed)
+
+    async def asgi_request(self, path, delay):
+        received = []
+
+        async def receive():
+            if not received:
+                received.append(True)
+                return {'type': 'http.request', 'body': b'',
+                        'more_body': False}
+            # the client stays connected
+            await asyncio.Event().wait()
+
+        status = []
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+            elif not message.get('more_body'):
+                # the client reads the response
+                await asyncio.sleep(delay)
+
+        await application(asgi_scope(path), receive, send)
+        if status[0] != 200:
+            raise CommandError(f'{path}: HTTP {status[0]}')
+
+    async def measure_asgi(self, path, options):
+        '''Times the requests of the clients to the ASGI application.'''
+        latencies = []
+
+        async def client(count):
+            for i in range(count):
+                sent = time.perf_counter()
+                await self.asgi_request(path, options['client_delay'])
+                latencies.append(time.perf_counter() - sent)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            client(count) for count in self.shares(options)
+        ])
+        elapsed = time.perf_counter() - start
+        return self.summarize(latencies, elapsed)
+
+    def shares(self, options):
+        '''Returns the number of requests of each client.'''
+        clients = max(1, min(options['concurrency'], options['requests']))
+        share, rest = divmod(options['requests'], clients)
+        return [share + (i < rest) for i in range(clients)]
+
+    def summarize(self, latencies, elapsed):
+        return {
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'throughput_rps': len(latencies) / elapsed,
+        }
+
+    def report(self, results):
+        self.stdout.write(
+            f'{"endpoint":<20}{"server":<8}{"p50 ms":>9}{"p95 ms":>9}'
+            f'{"req/s":>9}'
+        )
+        for name, servers in results.items():
+            for server, r in servers.items():
+                self.stdout.write(
+                    f'{name:<20}{server:<8}{r["p50_ms"]:>9.2f}'
+                    f'{r["p95_ms"]:>9.2f}{r["throughput_rps"]:>9.1f}'
+                )
+            speedup = servers['asgi']['throughput_rps'] / \
+                servers['wsgi']['throughput_rps']
+            self.stdout.write(f'{"":<20}asgi/wsgi throughput {speedup:.2f}x')
@@ -0,0 +1,85 @@
+import json
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from courses.models import Subject, Course, Module
+from courses.views import ModuleOrderView
+
+
+class Command(BaseCommand):
+    '''Compares the per-row reorder path with the bulk reorder path of
+    ModuleOrderView for courses of different sizes.
+
+    The benchmark data is created inside a transaction that is rolled
+    back afterwards, so the command can be run against any database.
+    '''
+    help = 'Benchmark module reordering with per-row and bulk updates.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', nargs='+', type=int, default=[10, 100, 1000],
+            help='Numbers of modules to reorder.'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Number of timed runs per size; the best run is reported.'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'{"items":>6} {"path":>9} {"queries":>8} {"best ms":>9}'
+        )
+        with transaction.atomic():
+            user = User.objects.create_user('benchmark-reorder')
+            subject = Subject.objects.create(
+                title='Benchmark', slug='benchmark-reorder'
+            )
+            for size in options['sizes']:
+                course = Course.objects.create(
+                    owner=user, subject=subject, title='Benchmark',
+                    slug=f'benchmark-reorder-{size}', overview=''
+                )
+                Module.objects.bulk_create([
+                    Module(course=course, title=f'Module {i}', order=i)
+                    for i in range(size)
+                ])
+                ids = list(course.modules.values_list('id', flat=True))
+                for name, path in (('per-row', self.per_row),
+                                   ('bulk', self.bulk)):
+                    best, queries = None, 0
+                    for run in range(options['repeat']):
+                        # reverse the order on every run, so every row
+                        # changes
+                        ids.reverse()
+                        orders = {id: i for i, id in enumerate(ids)}
+                        with CaptureQueriesContext(connection) as ctx:
+                            start = time.perf_counter()
+                            path(user, orders)
+                            elapsed = time.perf_counter() - start
+                        queries = len(ctx.captured_queries)
+                        best = elapsed if best is None else min(best, elapsed)
+                    self.stdout.write(
+                        f'{size:>6} {name:>9} {queries:>8} '
+                        f'{best * 1000:>9.2f}'
+                    )
+            transaction.set_rollback(True)
+
+    def per_row(self, user, orders):
+        '''The previous reorder path, one UPDATE per module.'''
+        for id, order in orders.items():
+            Module.objects.filter(id=id,
+                   course__owner=user).update(order=order)
+
+    def bulk(self, user, orders):
+        '''The current reorder path through ModuleOrderView.'''
+        request = RequestFactory().post(
+            '/course/module/order',
+            data=json.dumps(orders),
+            content_type='application/json'
+        )
+        request.user = user
+        response = ModuleOrderView.as_view()(request)
+        assert response.status_code == 200, response.content
@@ -0,0 +1,41 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from courses.models import Blob
+from courses.images import delete_variants
+from courses.storage import content_storage
+
+
+class Command(BaseCommand):
+    '''Deletes the blobs of the content-addressed storage that no item
+    references, along with their image variants.
+
+    Blobs released or uploaded within the grace period are kept, so an
+    upload reusing a blob is not raced by its deletion.
+    '''
+    help = 'Delete unreferenced content blobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help='Keep blobs changed within this many '
+                                 'hours.')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['grace_hours'])
+        blobs = Blob.objects.filter(references=0, updated__lt=cutoff)
+        deleted = size = 0
+        for blob in blobs:
+            if options['dry_run']:
+                self.stdout.write(f'Would delete {blob.name}')
+            # the blob may have been referenced since it was listed
+            elif not Blob.objects.filter(pk=blob.pk, references=0,
+                                         updated__lt=cutoff).delete()[0]:
+                continue
+            else:
+                content_storage.delete(blob.name)
+                delete_variants(blob.name)
+            deleted += 1
+            size += blob.size
+        action = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(f'{action} {deleted} blobs, {size} bytes.')
@@ -0,0 +1,39 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from courses.models import Course
+from courses.transfer import export_ndjson, export_zip
+
+
+class Command(BaseCommand):
+    '''Exports a course with its modules, contents and content items,
+    as NDJSON or as a zip archive that also holds the files of the
+    items, to a file or to the standard output.'''
+    help = 'Export a course as NDJSON or as a zip archive.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('course', help='Id or slug of the course.')
+        parser.add_argument('--zip', action='store_true',
+                            help='Export a zip archive including the '
+                                 'files of the items.')
+        parser.add_argument('--output', default='-',
+                            help='File to write, the standard output by '
+                                 'default.')
+
+    def handle(self, *args, **options):
+        course = options['course']
+        lookup = {'pk': course} if course.isdigit() else {'slug': course}
+        try:
+            course = Course.objects.select_related('subject').get(**lookup)
+        except Course.DoesNotExist:
+            raise CommandError(f'No course {options["course"]}.')
+        chunks = export_zip(course) if options['zip'] else \
+            export_ndjson(course)
+        if options['output'] == '-':
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+        with open(options['output'], 'wb') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stderr.write(f'Exported {course} to {options["output"]}.')
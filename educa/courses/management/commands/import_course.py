@@ -0,0 +1,34 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from courses.transfer import ArchiveError, import_course
+
+
+class Command(BaseCommand):
+    '''Imports a course exported by the export_course command, as
+    NDJSON or as a zip archive, for the given owner. Files missing from
+    the archive are taken from the storage by name, for environments
+    sharing the media files.'''
+    help = 'Import a course from NDJSON or from a zip archive.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='The exported course.')
+        parser.add_argument('--owner', required=True,
+                            help='Username of the owner of the course.')
+        parser.add_argument('--slug',
+                            help='Slug of the imported course, the '
+                                 'exported slug by default.')
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(username=options['owner'])
+        except User.DoesNotExist:
+            raise CommandError(f'No user {options["owner"]}.')
+        try:
+            with open(options['file'], 'rb') as f:
+                course = import_course(f, owner, options['slug'],
+                                       reuse_files=True)
+        except (OSError, ArchiveError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            f'Imported {course} as {course.slug} (id {course.pk}).'
+        )
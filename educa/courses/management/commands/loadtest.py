@@ -0,0 +1,295 @@
+import json
+import time
+from contextlib import contextmanager
+from unittest import mock
+import django
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from chat import consumers
+from chat.routing import websocket_urlpatterns
+from chat.throttling import BucketRegistry
+from courses.synthetic import build_dataset
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+IN_MEMORY_CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    }
+}
+
+
+def percentile(values, pct):
+    '''Returns the nearest-rank percentile of the given values.'''
+    ordered = sorted(values)
+    index = max(0, int(round(pct / 100 * len(ordered))) - 1)
+    return ordered[index]
+
+
+class Recorder:
+    '''Counts the queries run on the default database and the hits and
+    misses of the default cache.'''
+
+    def __init__(self):
+        self.queries = 0
+        self.hits = 0
+        self.misses = 0
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def record(self):
+        cache = caches['default']
+        get, get_many = cache.get, cache.get_many
+
+        def counting_get(key, default=None, version=None):
+            value = get(key, default=None, version=version)
+            if value is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+        def counting_get_many(keys, version=None):
+            keys = list(keys)
+            values = get_many(keys, version=version)
+            self.hits += len(values)
+            self.misses += len(keys) - len(values)
+            return values
+
+        cache.get, cache.get_many = counting_get, counting_get_many
+        try:
+            with connection.execute_wrapper(self.count_query):
+                yield self
+        finally:
+            del cache.get, cache.get_many
+
+
+class Command(BaseCommand):
+    '''Load tests the core HTTP endpoints and the chat consumer against a
+    synthetic dataset in a temporary test database.
+
+    For each endpoint the latency percentiles, the throughput, the number
+    of queries per request and the cache hit ratio are reported and
+    written to a JSON file. Passing the file of an earlier run with
+    --baseline reports the differences and fails on regressions.
+    '''
+    help = 'Load test the core endpoints against a synthetic dataset.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Timed requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=5,
+                            help='Untimed requests per endpoint.')
+        parser.add_argument('--courses', type=int, default=20)
+        parser.add_argument('--modules', type=int, default=5,
+                            help='Modules per course.')
+        parser.add_argument('--items', type=int, default=8,
+                            help='Content items per module.')
+        parser.add_argument('--students', type=int, default=20)
+        parser.add_argument('--output', default='loadtest.json',
+                            help='Path of the JSON results file.')
+        parser.add_argument('--baseline',
+                            help='JSON results of an earlier run to '
+                                 'compare against.')
+        parser.add_argument('--tolerance', type=float, default=20.0,
+                            help='Allowed p95 latency regression against '
+                                 'the baseline, in percent.')
+        parser.add_argument('--configured-cache', action='store_true',
+                            help='Use the configured cache backend instead '
+                                 'of a local memory cache.')
+
+    def handle(self, *args, **options):
+        overrides = {'CHANNEL_LAYERS': IN_MEMORY_CHANNEL_LAYERS}
+        if not options['configured_cache']:
+            overrides['CACHES'] = LOCMEM_CACHES
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            with override_settings(**overrides):
+                caches['default'].clear()
+                results = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        self.report(results['endpoints'])
+        self.stdout.write(f'Results written to {options["output"]}')
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            if not self.compare(baseline['endpoints'], results['endpoints'],
+                                options['tolerance']):
+                raise CommandError('Performance regressions found.')
+
+    def run(self, options):
+        data = build_dataset(
+            courses=options['courses'],
+            modules=options['modules'],
+            items=options['items'],
+            students=options['students'],
+            prefix='loadtest'
+        )
+        course = data['courses'][0]
+        student = data['students'][0]
+        client = Client()
+        student_client = Client()
+        student_client.force_login(student)
+        api_client = APIClient()
+        api_student = APIClient()
+        api_student.force_authenticate(student)
+
+        endpoints = {
+            'catalog': lambda: client.get(reverse('course_list')),
+            'course_detail': lambda: client.get(
+                reverse('course_detail', args=[course.slug])
+            ),
+            'student_course_detail': lambda: student_client.get(
+                reverse('student_course_detail', args=[course.id])
+            ),
+            'api_course_list': lambda: api_client.get(
+                reverse('api:course-list')
+            ),
+            'api_course_detail': lambda: api_client.get(
+                reverse('api:course-detail', args=[course.id])
+            ),
+            'api_course_contents': lambda: api_student.get(
+                reverse('api:course-contents', args=[course.id])
+            ),
+        }
+        results = {}
+        for name, request in endpoints.items():
+            results[name] = self.measure(name, request, options)
+        results['chat'] = self.measure_chat(course, student, options)
+        return {
+            'meta': {
+                'created': timezone.now().isoformat(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'cache': caches['default'].__class__.__name__,
+                'dataset': {
+                    key: options[key]
+                    for key in ('courses', 'modules', 'items', 'students')
+                },
+                'requests': options['requests'],
+            },
+            'endpoints': results,
+        }
+
+    def measure(self, name, request, options):
+        '''Times the given request function and returns its statistics.'''
+        for i in range(options['warmup']):
+            self.check_response(name, request())
+        latencies = []
+        with Recorder().record() as recorder:
+            start = time.perf_counter()
+            for i in range(options['requests']):
+                sent = time.perf_counter()
+                response = request()
+                latencies.append(time.perf_counter() - sent)
+                self.check_response(name, response)
+            elapsed = time.perf_counter() - start
+        return self.summarize(latencies, elapsed, recorder)
+
+    def measure_chat(self, course, student, options):
+        '''Times the round trip of chat messages through the consumer.'''
+        latencies = []
+
+        async def chat():
+            communicator = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns),
+                f'/ws/chat/room/{course.id}/'
+            )
+            communicator.scope['user'] = student
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise CommandError('chat: connection rejected')
+            total = options['warmup'] + options['requests']
+            for i in range(total):
+                sent = time.perf_counter()
+                await communicator.send_json_to({'message': f'Message {i}'})
+                await communicator.receive_json_from()
+                if i >= options['warmup']:
+                    latencies.append(time.perf_counter() - sent)
+            await communicator.disconnect()
+            await consumers.message_buffer.flush()
+
+        # the load test measures the consumer, not the rate limits
+        unlimited = BucketRegistry(rate=1e9, burst=1e9)
+        with mock.patch.object(consumers, 'user_buckets', unlimited), \
+                mock.patch.object(consumers, 'room_buckets', unlimited), \
+                Recorder().record() as recorder:
+            start = time.perf_counter()
+            async_to_sync(chat)()
+            elapsed = time.perf_counter() - start
+        return self.summarize(latencies, elapsed, recorder)
+
+    def check_response(self, name, response):
+        if response.status_code != 200:
+            raise CommandError(f'{name}: HTTP {response.status_code}')
+
+    def summarize(self, latencies, elapsed, recorder):
+        lookups = recorder.hits + recorder.misses
+        return {
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'throughput_rps': round(len(latencies) / elapsed, 1),
+            'queries_per_request': round(recorder.queries / len(latencies), 2),
+            'cache_hit_ratio': round(recorder.hits / lookups, 3)
+                               if lookups else None,
+        }
+
+    def report(self, endpoints):
+        self.stdout.write(
+            f'{"endpoint":<24}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}'
+            f'{"req/s":>9}{"queries":>9}{"hits":>7}'
+        )
+        for name, r in endpoints.items():
+            hits = '-' if r['cache_hit_ratio'] is None \
+                else f'{r["cache_hit_ratio"]:.2f}'
+            self.stdout.write(
+                f'{name:<24}{r["p50_ms"]:>9.2f}{r["p95_ms"]:>9.2f}'
+                f'{r["p99_ms"]:>9.2f}{r["throughput_rps"]:>9.1f}'
+                f'{r["queries_per_request"]:>9.2f}{hits:>7}'
+            )
+
+    def compare(self, baseline, endpoints, tolerance):
+        '''Reports the changes against the baseline results. Returns False
+        if the p95 latency of an endpoint grew by more than tolerance
+        percent, or if it makes more queries per request.'''
+        ok = True
+        self.stdout.write('Changes against the baseline:')
+        for name, r in endpoints.items():
+            if name not in baseline:
+                continue
+            before = baseline[name]
+            p95 = (r['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100
+            queries = r['queries_per_request'] - before['queries_per_request']
+            regressed = p95 > tolerance or queries > 0
+            ok = ok and not regressed
+            self.stdout.write(
+                f'{name:<24} p95 {p95:+.1f}%  queries {queries:+.2f}'
+                + ('  REGRESSION' if regressed else '')
+            )
+        return ok
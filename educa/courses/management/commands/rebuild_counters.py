@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from courses import counters
+
+
+class Command(BaseCommand):
+    '''Checks the denormalized course counters against the counts of
+    their relations, and repairs the stale ones.
+
+    With --check the stale counters are only reported, and the command
+    fails if there are any.
+    '''
+    help = 'Rebuild or check the denormalized course counters.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Report stale counters without repairing '
+                                 'them.')
+
+    def handle(self, *args, **options):
+        if options['check']:
+            stale = counters.find_stale()
+        else:
+            stale = counters.rebuild()
+        for model, field, pk, stored, actual in stale:
+            self.stdout.write(
+                f'{model._meta.label} {pk} {field}: {stored} != {actual}'
+            )
+        if options['check'] and stale:
+            raise CommandError(f'{len(stale)} stale counters.')
+        action = 'found' if options['check'] else 'repaired'
+        self.stdout.write(f'{len(stale)} stale counters {action}.')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from courses.models import Course
+from courses.search import index_courses
+
+
+class Command(BaseCommand):
+    '''Rebuilds the search documents of all courses, in batches.
+
+    The index is kept up to date as courses change, so this is only
+    needed after the search migration or a change to what is indexed.
+    '''
+    help = 'Rebuild the full-text search index of the courses.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        ids = list(Course.objects.order_by('id').values_list('id', flat=True))
+        size = options['batch_size']
+        for start in range(0, len(ids), size):
+            index_courses(ids[start:start + size])
+        self.stdout.write(f'Indexed {len(ids)} courses.')
@@ -0,0 +1,69 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from django.core.management.base import BaseCommand
+from django.db import connections
+from courses import jobs
+
+
+class Command(BaseCommand):
+    '''Processes the background job queue (see courses.jobs).
+
+    Runs --processes worker processes, each claiming and processing
+    batches of jobs until it is stopped, polling the queue every --sleep
+    seconds while it is empty. With --once the workers exit as soon as
+    the queue is empty.
+    '''
+    help = 'Process the background job queue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Number of worker processes.')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Jobs claimed at a time, JOB_BATCH_SIZE '
+                                 'by default.')
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help='Seconds between polls of an empty queue.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        if options['processes'] <= 1:
+            processed = self.work(options)
+            self.stdout.write(f'Processed {processed} jobs.')
+            return
+        # the workers must not share the connections of this process
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(target=self.work, args=(options,))
+            for _ in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+
+    def work(self, options):
+        '''Processes jobs until stopped, or until the queue is empty with
+        --once. Returns the number of jobs processed.'''
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda *args: stopping.append(True))
+        processed = 0
+        try:
+            while not stopping:
+                claimed = jobs.run_pending(worker, options['batch_size'])
+                processed += claimed
+                if not claimed:
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+        finally:
+            connections.close_all()
+        return processed
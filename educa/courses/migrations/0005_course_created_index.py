@@ -0,0 +1,17 @@
+# Generated by Django 3.2.7 on 2026-10-17 03:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0004_course_students'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['-created', '-id'], name='courses_cou_created_6b44b3_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.7 on 2026-10-17 03:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0005_course_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=255, unique=True)),
+                ('value', models.PositiveIntegerField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.2.7 on 2026-10-17 09:12
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+def create_search_index(apps, schema_editor):
+    '''The GIN index on the search vector only exists on PostgreSQL;
+    other databases use the courses.search fallback.'''
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX courses_course_search_vector_gin '
+            'ON courses_course USING gin (search_vector)'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'DROP INDEX IF EXISTS courses_course_search_vector_gin'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0006_ordersequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='search_document',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.7 on 2026-10-17 03:57
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_counters(apps, schema_editor):
+    Subject = apps.get_model('courses', 'Subject')
+    Course = apps.get_model('courses', 'Course')
+    for subject in Subject.objects.annotate(n=Count('courses')):
+        Subject.objects.filter(pk=subject.pk).update(total_courses=subject.n)
+    for course in Course.objects.annotate(n=Count('modules')):
+        Course.objects.filter(pk=course.pk).update(total_modules=course.n)
+    for course in Course.objects.annotate(n=Count('students')):
+        Course.objects.filter(pk=course.pk).update(student_count=course.n)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0007_course_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='student_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='total_modules',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='subject',
+            name='total_courses',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.7 on 2026-10-17 10:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0008_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.7 on 2026-10-17 04:05
+
+import courses.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0009_course_updated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('references', models.PositiveIntegerField(default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='content',
+            field=models.FileField(storage=courses.storage.ContentAddressedStorage(), upload_to='files'),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='content',
+            field=models.FileField(storage=courses.storage.ContentAddressedStorage(), upload_to='images'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-17 04:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0010_content_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
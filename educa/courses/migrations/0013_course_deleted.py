@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-17 04:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0012_job_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='deleted',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
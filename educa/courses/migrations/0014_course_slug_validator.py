@@ -0,0 +1,19 @@
+# Generated by Django 3.2.7 on 2026-10-17 05:21
+
+import courses.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0013_course_deleted'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='course',
+            name='slug',
+            field=models.SlugField(max_length=200, unique=True, validators=[courses.models.validate_course_slug]),
+        ),
+    ]
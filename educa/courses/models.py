@@ -1,10 +1,19 @@
+import os
 from django.db import models
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.postgres.search import SearchVectorField
 from django.db.models.base import Model
-from .fields import OrderField
+from .fields import OrderField, OrderedQuerySet
 from django.template.loader import render_to_string
+from django.utils import timezone
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.urls import reverse
+from django.utils.text import slugify
+from .caching import item_render_key, RENDER_CACHE_TIMEOUT
+from .storage import content_storage
 
 class Subject(models.Model):
     '''Model for Subjects.
@@ -12,9 +21,12 @@ class Subject(models.Model):
     Fields include:
         title (str): The title of the Subject object.
         slug (slug): The slug of the Subject object. 
+        total_courses (int): Number of Courses of the Subject. Maintained by
+            courses.signals.
     '''
     title = models.CharField(max_length=200)
     slug = models.SlugField(max_length=200, unique=True)
+    total_courses = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         ordering = ['title']
@@ -23,6 +35,49 @@ class Subject(models.Model):
         return self.title
 
 
+class CourseQuerySet(models.QuerySet):
+    '''Custom QuerySet for the Course model.'''
+
+    def with_contents(self):
+        '''Returns the courses with their modules, the contents of each
+        module and the content items prefetched.
+
+        Modules and contents are fetched with one query each, and the
+        generic content items are resolved with one query per content
+        type (Text, Video, Image, File), regardless of the size of the
+        course.
+        '''
+        return self.prefetch_related('modules__contents__item')
+
+    def touch(self):
+        '''Marks the courses as updated, e.g. when their modules or
+        contents change. Returns the number of courses updated.'''
+        return self.update(updated=timezone.now())
+
+
+# prefix of the slugs given to deleted courses, freeing their slugs until
+# the job queue removes them
+DELETED_SLUG_PREFIX = 'deleted-'
+
+
+def validate_course_slug(value):
+    '''Rejects the slugs reserved for deleted courses, which the unique
+    checks of Course.objects do not see.'''
+    if value.startswith(DELETED_SLUG_PREFIX):
+        raise ValidationError(
+            f'Slugs starting with "{DELETED_SLUG_PREFIX}" are reserved.',
+            code='reserved'
+        )
+
+
+class CourseManager(models.Manager.from_queryset(CourseQuerySet)):
+    '''Default manager of the Course model, leaving out the deleted
+    courses that the job queue has not removed yet.'''
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted=False)
+
+
 class Course(models.Model):
     '''Model for Courses. A Subject comprises of various Courses
     (i.e. Subject-->Courses).
@@ -31,14 +86,29 @@ class Course(models.Model):
         owner: Foreign key to the User object related to the Course object.
         subject: Foreign key to the Subject object related to the Course object.
         title (str): The title of the Course object.
-        slug (slug): The slug of the Course object.
+        slug (slug): The slug of the Course object. Slugs starting with
+            DELETED_SLUG_PREFIX are reserved for the deleted courses.
         overview (str): An overview of the Course object.
         created (datetime obj): Date and time the course was created. Automatically 
             set by due to auto_now_add=True.
+        updated (datetime obj): Date and time the course, its modules or their
+            contents last changed. Drives the conditional GETs of the course.
         students: Many-to-many relationship between Course and User models to store
             enrolled students.
         modules: One-to-many relationship between the Course and its Modules as a
             list of the primary keys of the Modules.
+        total_modules (int): Number of Modules of the Course. Maintained by
+            courses.signals.
+        student_count (int): Number of students enrolled on the Course.
+            Maintained by courses.signals.
+        search_document (str): The searchable text of the Course, its Modules and
+            their Text items. Maintained by courses.search.
+        search_vector: Weighted full-text vector of the search document, only
+            populated on PostgreSQL.
+        deleted (bool): Whether the Course was deleted and waits for the
+            job queue to remove it with its contents (see courses.jobs).
+            Deleted courses are left out by Course.objects; all_objects
+            includes them.
     '''
     owner = models.ForeignKey(
         to=User,
@@ -51,22 +121,52 @@ class Course(models.Model):
         on_delete=models.CASCADE
     )
     title = models.CharField(max_length=200)
-    slug = models.SlugField(max_length=200, unique=True)
+    slug = models.SlugField(max_length=200, unique=True,
+                            validators=[validate_course_slug])
     overview = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
     students = models.ManyToManyField(
         User,
         related_name='courses_joined',
         blank=True
     )
+    total_modules = models.PositiveIntegerField(default=0, editable=False)
+    student_count = models.PositiveIntegerField(default=0, editable=False)
+    search_document = models.TextField(blank=True, editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+    deleted = models.BooleanField(default=False, editable=False)
+
+    objects = CourseManager()
+    all_objects = CourseQuerySet.as_manager()
 
     class Meta:
         ordering = ['-created']
+        indexes = [
+            # supports the keyset pagination of the courses API
+            models.Index(fields=['-created', '-id']),
+        ]
 
     def __str__(self):
         return self.title
 
 
+class OrderSequence(models.Model):
+    '''Model for the sequences from which OrderField values are
+    reserved. There is one sequence per group of ordered objects, e.g.
+    per Course for its Modules.
+
+    Fields include:
+        scope (str): Name of the group of ordered objects.
+        value (int): The next order value of the group.
+    '''
+    scope = models.CharField(max_length=255, unique=True)
+    value = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"{self.scope}: {self.value}"
+
+
 class Module(models.Model):
     '''Model for Modules. A Course comprises of various Modules (i.e. 
     Subject-->Course-->Modules).
@@ -86,6 +186,8 @@ class Module(models.Model):
     description = models.TextField(blank=True)
     order = OrderField(blank=True, for_fields=['course'])
 
+    objects = OrderedQuerySet.as_manager()
+
     class Meta:
         ordering = ['order']
 
@@ -123,6 +225,8 @@ class Content(models.Model):
     item = GenericForeignKey('content_type', 'object_id')
     order = OrderField(blank=True, for_fields=['module'])
 
+    objects = OrderedQuerySet.as_manager()
+
     class Meta:
         ordering = ['order']
 
@@ -154,7 +258,23 @@ class ItemBase(models.Model):
         return self.title
 
     def render(self):
-        '''Method to return the rendered content as a string.'''
+        '''Method to return the rendered content as a string.
+
+        The rendered content is cached under a key that includes the
+        updated timestamp of the item, so any change to the item is
+        picked up on the next call.
+        '''
+        if self.pk is None:
+            return self._render()
+        key = item_render_key(self)
+        html = cache.get(key)
+        if html is None:
+            html = self._render()
+            cache.set(key, html, RENDER_CACHE_TIMEOUT)
+        return html
+
+    def _render(self):
+        '''Renders the template of the content type for the item.'''
         return render_to_string(
             f'courses/content/{self._meta.model_name}.html',
             {'item':self}
@@ -167,17 +287,160 @@ class Text(ItemBase):
     '''Model to store text content. Inherits from the ItemBase model.'''
     content = models.TextField()
 
-class File(ItemBase):
+class DownloadMixin:
+    '''Mixin for content items with a file, which is only served by the
+    permission checked content_download view.'''
+
+    def get_download_url(self, variant=''):
+        if variant:
+            return reverse('content_download_variant',
+                           args=[self._meta.model_name, self.pk, variant])
+        return reverse('content_download',
+                       args=[self._meta.model_name, self.pk])
+
+    @property
+    def download_url(self):
+        return self.get_download_url()
+
+    def get_download_filename(self):
+        '''Returns the file name offered to the downloading user.'''
+        extension = os.path.splitext(self.content.name)[1]
+        return f'{slugify(self.title) or self._meta.model_name}{extension}'
+
+    def get_variant_files(self):
+        '''Returns the storage names of the variants of the file, by
+        their base name.'''
+        return {}
+
+
+class File(DownloadMixin, ItemBase):
     '''Model to store file content such as PDFs. Inherits from the ItemBase model.'''
-    content = models.FileField(upload_to='files')
+    content = models.FileField(upload_to='files', storage=content_storage)
+
+class Image(DownloadMixin, ItemBase):
+    '''Model to store image files. Inherits from the ItemBase model.
+
+    Fields include:
+        content: The original image file.
+        variants (dict): The responsive variants of the image, generated
+            by courses.images.
+    '''
+    content = models.FileField(upload_to='images', storage=content_storage)
+    variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    def get_variants(self):
+        '''Returns the variant widths of the current file, if generated.'''
+        if self.variants.get('source') != self.content.name:
+            return []
+        return self.variants['widths']
+
+    def get_variant_files(self):
+        if self.variants.get('source') != self.content.name:
+            return {}
+        names = [v[key] for v in self.variants['widths']
+                 for key in ('src', 'webp')]
+        if 'thumbnail' in self.variants:
+            names.append(self.variants['thumbnail'])
+        return {os.path.basename(name): name for name in names
+                if name != self.content.name}
 
-class Image(ItemBase):
-    '''Model to store image files. Inherits from the ItemBase model.'''
-    content = models.FileField(upload_to='images')
+    def get_variant_url(self, name):
+        if name == self.content.name:
+            return self.download_url
+        return self.get_download_url(os.path.basename(name))
+
+    def get_srcset(self, key):
+        return ', '.join(
+            f'{self.get_variant_url(v[key])} {v["width"]}w'
+            for v in self.get_variants()
+        )
+
+    @property
+    def srcset(self):
+        '''The srcset of the image in its original format.'''
+        return self.get_srcset('src')
+
+    @property
+    def webp_srcset(self):
+        '''The srcset of the image in WebP.'''
+        return self.get_srcset('webp')
+
+    @property
+    def thumbnail_url(self):
+        if self.variants.get('source') != self.content.name or \
+                'thumbnail' not in self.variants:
+            return None
+        return self.get_variant_url(self.variants['thumbnail'])
 
 class Video(ItemBase):
     '''Model to store video content. Inherits from the ItemBase model.
     
     A URLField is used to embed a video URL.
     '''
-    url = models.URLField()
\ No newline at end of file
+    url = models.URLField()
+
+class Blob(models.Model):
+    '''Model for the files of the content-addressed storage, one per
+    distinct content (see courses.storage).
+
+    Fields include:
+        digest (str): SHA-256 hex digest of the content.
+        name (str): Storage name of the file.
+        size (int): Size of the file in bytes.
+        references (int): Number of File and Image items using the file.
+        created (datetime obj): Date and time the file was stored.
+        updated (datetime obj): Date and time the file was last uploaded,
+            referenced or released.
+    '''
+    digest = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    references = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+
+class Job(models.Model):
+    '''Model for the jobs of the background job queue (see courses.jobs).
+    Jobs are deleted once they are done.
+
+    Fields include:
+        kind (str): Name of the handler processing the job.
+        payload (dict): Arguments of the job.
+        status (str): Pending, running or failed.
+        attempts (int): Number of times the job was claimed by a worker.
+        run_after (datetime obj): The job is not run before this time.
+        locked_by (str): Worker running the job.
+        locked_until (datetime obj): End of the lease of the worker; a
+            running job is claimed again once its lease has expired.
+        error (str): Error of the last failed attempt.
+        created (datetime obj): Date and time the job was enqueued.
+    '''
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (FAILED, 'Failed'),
+    ]
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self):
+        return f'{self.kind} #{self.pk}'
@@ -0,0 +1,127 @@
+'''
+Full-text search over the courses.
+
+Each course keeps a search document: its title and overview, the titles
+and descriptions of its modules and the titles and text of its Text
+items. On PostgreSQL a weighted vector of the document is stored in
+Course.search_vector, which is GIN indexed and matched with SearchQuery
+and ranked with SearchRank. Other databases fall back to matching each
+term of the query against the document, ranked by where terms occur.
+
+The documents are rebuilt incrementally, once the transaction saving a
+course, module or text item commits (see courses.signals).
+'''
+import re
+from collections import defaultdict
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.search import SearchQuery, SearchRank, \
+    SearchVector
+from django.db import connections, router, transaction
+from django.db.models import Case, F, IntegerField, Q, TextField, Value, When
+from .models import Course, Module, Content, Text
+
+TERM_RE = re.compile(r'\w+')
+# terms of a query considered by the fallback search
+MAX_TERMS = 8
+
+
+def index_courses(course_ids):
+    '''Rebuilds the search documents of the given courses.'''
+    course_ids = set(course_ids)
+    if not course_ids:
+        return
+    parts = defaultdict(list)
+    modules = Module.objects.filter(course_id__in=course_ids) \
+                            .values_list('course_id', 'title', 'description')
+    for course_id, title, description in modules:
+        parts[course_id] += [title, description]
+    text_courses = defaultdict(list)
+    contents = Content.objects.filter(
+        module__course_id__in=course_ids,
+        content_type=ContentType.objects.get_for_model(Text)
+    ).values_list('object_id', 'module__course_id')
+    for object_id, course_id in contents:
+        text_courses[object_id].append(course_id)
+    texts = Text.objects.filter(id__in=text_courses) \
+                        .values_list('id', 'title', 'content')
+    for text_id, title, content in texts:
+        for course_id in text_courses[text_id]:
+            parts[course_id] += [title, content]
+
+    db = router.db_for_write(Course)
+    postgres = connections[db].vendor == 'postgresql'
+    config = settings.SEARCH_CONFIG
+    courses = Course.objects.using(db).filter(id__in=course_ids) \
+                                      .values_list('id', 'title', 'overview')
+    for course_id, title, overview in courses:
+        body = '\n'.join(p for p in parts[course_id] if p)
+        fields = {
+            'search_document': '\n'.join(
+                p for p in (title, overview, body) if p
+            )
+        }
+        if postgres:
+            fields['search_vector'] = (
+                SearchVector('title', weight='A', config=config)
+                + SearchVector('overview', weight='B', config=config)
+                + SearchVector(Value(body, output_field=TextField()),
+                               weight='C', config=config)
+            )
+        Course.objects.using(db).filter(pk=course_id).update(**fields)
+
+
+def reindex(courses=(), modules=(), texts=()):
+    '''Rebuilds the search documents of the given courses and of the
+    courses containing the given modules or Text items.'''
+    course_ids = set(courses)
+    if modules:
+        course_ids.update(
+            Module.objects.filter(id__in=modules)
+                          .values_list('course_id', flat=True)
+        )
+    if texts:
+        course_ids.update(
+            Content.objects.filter(
+                content_type=ContentType.objects.get_for_model(Text),
+                object_id__in=texts
+            ).values_list('module__course_id', flat=True)
+        )
+    index_courses(course_ids)
+
+
+def schedule_reindex(**kwargs):
+    '''Reindexes once the current transaction commits, so an aborted
+    change leaves the index untouched.'''
+    transaction.on_commit(lambda: reindex(**kwargs))
+
+
+def search_courses(query, queryset=None):
+    '''Returns the courses matching the search query, best match first.'''
+    if queryset is None:
+        queryset = Course.objects.all()
+    terms = TERM_RE.findall(query.lower())[:MAX_TERMS]
+    if not terms:
+        return queryset.none()
+    if connections[queryset.db].vendor == 'postgresql':
+        search_query = SearchQuery(
+            query, search_type='websearch', config=settings.SEARCH_CONFIG
+        )
+        return queryset.filter(search_vector=search_query).annotate(
+            rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-rank', '-id')
+
+    # fallback: every term must occur in the document, and matches in the
+    # title and the overview rank higher than matches in the modules
+    matches = Q()
+    rank = Value(0)
+    for term in terms:
+        matches &= Q(search_document__icontains=term)
+        rank = rank + Case(
+            When(title__icontains=term, then=Value(4)),
+            When(overview__icontains=term, then=Value(2)),
+            default=Value(1),
+            output_field=IntegerField()
+        )
+    return queryset.filter(matches).annotate(rank=rank) \
+                   .order_by('-rank', '-id')
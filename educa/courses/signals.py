@@ -0,0 +1,259 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import (post_save, post_delete, post_init,
+                                      pre_delete, m2m_changed)
+from django.dispatch import receiver
+from .caching import (bump_module_versions, item_render_key,
+                      bump_catalog_version)
+from .models import Subject, Course, Module, Content, Text, Video, Image, File
+from .search import schedule_reindex
+from .counters import adjust
+from .storage import acquire, release
+from .images import schedule_variants
+from .jobs import unless_bulk
+
+
+@receiver(post_save, sender=Content)
+@receiver(post_delete, sender=Content)
+@unless_bulk
+def content_changed(sender, instance, **kwargs):
+    '''Invalidates the cached contents of the module when a Content
+    object is added, moved or removed.'''
+    bump_module_versions([instance.module_id])
+    Course.objects.filter(modules__id=instance.module_id).touch()
+
+
+@unless_bulk
+def item_changed(sender, instance, **kwargs):
+    '''Invalidates the cached contents of the modules displaying a
+    content item when the item is saved or deleted.'''
+    content_type = ContentType.objects.get_for_model(sender)
+    if kwargs.get('signal') is post_delete:
+        cache.delete(item_render_key(instance))
+    module_ids = list(Content.objects.filter(
+        content_type=content_type,
+        object_id=instance.pk
+    ).values_list('module_id', flat=True))
+    if module_ids:
+        bump_module_versions(module_ids)
+        Course.objects.filter(modules__id__in=module_ids).touch()
+
+
+for model in (Text, Video, Image, File):
+    post_save.connect(item_changed, sender=model)
+    post_delete.connect(item_changed, sender=model)
+
+
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+@unless_bulk
+def module_changed(sender, instance, **kwargs):
+    '''Marks the course of a module as updated when the module is saved
+    or deleted.'''
+    Course.objects.filter(pk=instance.course_id).touch()
+
+
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Subject)
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+@unless_bulk
+def catalog_changed(sender, instance, **kwargs):
+    '''Invalidates the cached course catalog when a subject, course or
+    module is saved or deleted.'''
+    bump_catalog_version()
+
+
+# parent model: model of the objects ordered under it
+ORDERED_CHILDREN = {
+    Course: Module,
+    Module: Content,
+}
+
+
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Module)
+@unless_bulk
+def ordered_parent_deleted(sender, instance, using, **kwargs):
+    '''Deletes the order sequence of the objects ordered under a deleted
+    course or module.'''
+    field = ORDERED_CHILDREN[sender]._meta.get_field('order')
+    field.delete_sequences([instance.pk], using)
+
+
+@receiver(post_save, sender=Course)
+def course_search_changed(sender, instance, **kwargs):
+    '''Reindexes a course when it is saved.'''
+    schedule_reindex(courses=[instance.pk])
+
+
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+@unless_bulk
+def module_search_changed(sender, instance, **kwargs):
+    '''Reindexes the course of a module when the module is saved or
+    deleted.'''
+    schedule_reindex(courses=[instance.course_id])
+
+
+@receiver(post_save, sender=Content)
+@receiver(post_delete, sender=Content)
+@unless_bulk
+def content_search_changed(sender, instance, **kwargs):
+    '''Reindexes the course of a module when a Text item is added to or
+    removed from the module.'''
+    if instance.content_type_id == \
+            ContentType.objects.get_for_model(Text).id:
+        schedule_reindex(modules=[instance.module_id])
+
+
+@receiver(post_save, sender=Text)
+@receiver(post_delete, sender=Text)
+@unless_bulk
+def text_search_changed(sender, instance, **kwargs):
+    '''Reindexes the courses displaying a Text item when the item is
+    saved or deleted.'''
+    schedule_reindex(texts=[instance.pk])
+
+
+# counted model: (attribute of the parent, parent model, counter field)
+COUNTED_CHILDREN = {
+    Course: ('subject_id', Subject, 'total_courses'),
+    Module: ('course_id', Course, 'total_modules'),
+}
+
+
+@receiver(post_init, sender=Course)
+@receiver(post_init, sender=Module)
+def remember_counted_parent(sender, instance, **kwargs):
+    '''Remembers the parent an object is counted under, so the count
+    can be moved if the object is saved under another parent.'''
+    attname = COUNTED_CHILDREN[sender][0]
+    # a deferred parent is not loaded just to be remembered
+    if attname in instance.__dict__:
+        instance._counted_parent_id = instance.__dict__[attname]
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Module)
+def counted_child_saved(sender, instance, created, raw=False, **kwargs):
+    '''Counts a new object under its parent, or moves its count to
+    its new parent.'''
+    if raw:
+        return
+    attname, parent, field = COUNTED_CHILDREN[sender]
+    parent_id = getattr(instance, attname)
+    if created:
+        adjust(parent, field, [parent_id], 1)
+    elif hasattr(instance, '_counted_parent_id') and \
+            instance._counted_parent_id != parent_id:
+        adjust(parent, field, [parent_id], 1)
+        adjust(parent, field, [instance._counted_parent_id], -1)
+    instance._counted_parent_id = parent_id
+
+
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Module)
+@unless_bulk
+def counted_child_deleted(sender, instance, **kwargs):
+    '''Uncounts a deleted object from its parent.'''
+    attname, parent, field = COUNTED_CHILDREN[sender]
+    adjust(parent, field, [getattr(instance, attname)], -1)
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def students_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    '''Updates the student counts of the courses affected by a change
+    of Course.students, from either side of the relation, and
+    invalidates the cached course catalog displaying them.'''
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(bump_catalog_version)
+    if action == 'post_add':
+        # pk_set only holds the pairs that were actually added
+        if reverse:
+            adjust(Course, 'student_count', pk_set, 1)
+        else:
+            adjust(Course, 'student_count', [instance.pk], len(pk_set))
+    elif action == 'pre_remove':
+        # pk_set may hold pairs that do not exist; keep the actual ones
+        if reverse:
+            instance._removed_enrollments = list(sender.objects.filter(
+                user_id=instance.pk, course_id__in=pk_set
+            ).values_list('course_id', flat=True))
+        else:
+            instance._removed_enrollments = sender.objects.filter(
+                course_id=instance.pk, user_id__in=pk_set
+            ).count()
+    elif action == 'post_remove':
+        if reverse:
+            adjust(Course, 'student_count', instance._removed_enrollments, -1)
+        else:
+            adjust(Course, 'student_count', [instance.pk],
+                   -instance._removed_enrollments)
+    elif action == 'pre_clear' and reverse:
+        instance._removed_enrollments = list(
+            instance.courses_joined.values_list('id', flat=True)
+        )
+    elif action == 'post_clear':
+        if reverse:
+            adjust(Course, 'student_count', instance._removed_enrollments, -1)
+        else:
+            Course.objects.filter(pk=instance.pk).update(student_count=0)
+
+
+@receiver(pre_delete, sender=User)
+def student_deleted(sender, instance, **kwargs):
+    '''Uncounts a deleted user from the courses they were enrolled on;
+    their enrollments are deleted without m2m_changed signals.'''
+    course_ids = list(instance.courses_joined.values_list('id', flat=True))
+    if course_ids:
+        adjust(Course, 'student_count', course_ids, -1)
+        transaction.on_commit(bump_catalog_version)
+
+
+def stored_name(value):
+    '''Returns the storage name of a file field value.'''
+    return getattr(value, 'name', value) or ''
+
+
+@receiver(post_init, sender=File)
+@receiver(post_init, sender=Image)
+def remember_blob(sender, instance, **kwargs):
+    '''Remembers the file an item references, so the reference can be
+    moved if the item is saved with another file.'''
+    if 'content' in instance.__dict__:
+        instance._blob_name = stored_name(instance.__dict__['content'])
+
+
+@receiver(post_save, sender=File)
+@receiver(post_save, sender=Image)
+def blob_item_saved(sender, instance, created, raw=False, **kwargs):
+    '''Counts the reference of a saved item to its file.'''
+    if raw:
+        return
+    name = stored_name(instance.content)
+    previous = '' if created else getattr(instance, '_blob_name', name)
+    if name != previous:
+        acquire([name])
+        release([previous])
+    instance._blob_name = name
+
+
+@receiver(post_delete, sender=File)
+@receiver(post_delete, sender=Image)
+@unless_bulk
+def blob_item_deleted(sender, instance, **kwargs):
+    '''Releases the reference of a deleted item to its file.'''
+    release([stored_name(instance.content)])
+
+
+@receiver(post_save, sender=Image)
+def image_saved(sender, instance, raw=False, **kwargs):
+    '''Generates the variants of an image saved with a new file.'''
+    if not raw and instance.content and \
+            instance.variants.get('source') != instance.content.name:
+        schedule_variants(instance.pk)
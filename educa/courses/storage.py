@@ -0,0 +1,148 @@
+'''
+Content-addressed storage for the File and Image content items.
+
+Uploads are hashed by the upload handlers while Django streams them to
+memory or to a temporary file, and stored once per SHA-256 digest under
+blobs/<2 hex digits>/<digest><extension>. Uploading known content again
+returns the existing blob without writing anything. Each blob is
+tracked by a Blob row counting the items that reference it; the
+references are maintained by courses.signals and unreferenced blobs are
+removed by the cleanup_blobs command.
+'''
+import hashlib
+import os
+from collections import Counter, defaultdict
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import (MemoryFileUploadHandler,
+                                             TemporaryFileUploadHandler)
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+
+def hash_file(content):
+    '''Returns the SHA-256 hex digest of a file, computed from its
+    chunks. Uploads are hashed as they are received instead.'''
+    digest = getattr(content, 'sha256', None)
+    if digest:
+        return digest
+    hasher = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        hasher.update(chunk)
+    content.seek(0)
+    return hasher.hexdigest()
+
+
+class HashingUploadHandlerMixin:
+    '''Mixin for upload handlers computing the SHA-256 digest of an
+    uploaded file as its chunks are received, stored in the sha256
+    attribute of the uploaded file.'''
+
+    def new_file(self, *args, **kwargs):
+        # set before the memory handler may stop the other handlers
+        self.hasher = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.hasher.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin,
+                                     MemoryFileUploadHandler):
+    '''Keeps small uploads in memory, hashing them.'''
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin,
+                                        TemporaryFileUploadHandler):
+    '''Streams large uploads to a temporary file, hashing them.'''
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    '''File system storage keeping one file per distinct content.
+
+    The name given to save() is only used for its extension. A new blob
+    is moved or written into place once; known content is not written
+    again.
+    '''
+    prefix = 'blobs'
+
+    def blob_name(self, digest, extension):
+        '''Returns the storage name of the blob with the given digest.'''
+        return f'{self.prefix}/{digest[:2]}/{digest}{extension}'
+
+    def _save(self, name, content):
+        from .models import Blob
+        digest = hash_file(content)
+        blob = Blob.objects.filter(digest=digest).first()
+        if blob is not None and self.exists(blob.name):
+            # known content, nothing is written
+            Blob.objects.filter(pk=blob.pk).update(updated=timezone.now())
+            return blob.name
+        extension = os.path.splitext(name)[1].lower()
+        name = super()._save(self.blob_name(digest, extension), content)
+        if blob is not None:
+            # the file of the blob was lost, point the blob at the new one
+            Blob.objects.filter(pk=blob.pk).update(name=name)
+            return name
+        try:
+            # the savepoint keeps an outer transaction usable on failure
+            with transaction.atomic():
+                Blob.objects.create(digest=digest, name=name,
+                                    size=content.size)
+        except IntegrityError:
+            # a concurrent upload of the same content created the blob,
+            # keep its file rather than an untracked copy
+            blob = Blob.objects.filter(digest=digest).first()
+            if blob is None:
+                raise
+            if blob.name != name:
+                self.delete(name)
+            return blob.name
+        return name
+
+
+def group_by_count(names):
+    '''Returns a dict of count: names occurring count times among the
+    given names, leaving out the empty ones.'''
+    groups = defaultdict(list)
+    for name, count in Counter(name for name in names if name).items():
+        groups[count].append(name)
+    return groups
+
+
+def acquire(names):
+    '''Counts a reference to each of the given blobs, once per
+    occurrence of its name. Names of files outside the content-addressed
+    storage are ignored.'''
+    from .models import Blob
+    # one statement per distinct number of references acquired
+    for count, group in group_by_count(names).items():
+        Blob.objects.filter(name__in=group).update(
+            references=F('references') + count, updated=timezone.now()
+        )
+
+
+def release(names):
+    '''Removes a reference to each of the given blobs, once per
+    occurrence of its name. Blobs are not deleted here: an upload of the
+    same content may be reusing them.'''
+    from .models import Blob
+    for count, group in group_by_count(names).items():
+        Blob.objects.filter(name__in=group).update(
+            references=Greatest(F('references') - count, 0),
+            updated=timezone.now()
+        )
+
+
+content_storage = ContentAddressedStorage()
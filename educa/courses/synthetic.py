@@ -0,0 +1,73 @@
+from django.contrib.auth.models import User
+from .models import Subject, Course, Module, Content, Text, Video, Image, File
+
+
+def create_items(owner, module, count):
+    '''Creates count content items in the given module, cycling through
+    the Text, Video, Image and File content types.'''
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            item = Text.objects.create(
+                owner=owner, title=f'Text {i}',
+                content='Lorem ipsum dolor sit amet. ' * 20
+            )
+        elif kind == 1:
+            item = Video.objects.create(
+                owner=owner, title=f'Video {i}',
+                url='https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+            )
+        elif kind == 2:
+            # there is no file to generate variants from
+            item = Image.objects.create(
+                owner=owner, title=f'Image {i}', content='images/image.png',
+                variants={'source': 'images/image.png', 'widths': []}
+            )
+        else:
+            item = File.objects.create(owner=owner, title=f'File {i}',
+                                       content='files/file.pdf')
+        Content.objects.create(module=module, item=item)
+
+
+def build_dataset(subjects=2, courses=10, modules=5, items=8, students=10,
+                  prefix='synthetic'):
+    '''Creates a synthetic dataset of subjects, courses with their modules
+    and content items, an instructor owning the courses and students
+    enrolled in every course.
+
+    Returns a dictionary with the instructor, the students and the
+    courses that were created.
+    '''
+    instructor = User.objects.create_user(
+        f'{prefix}-instructor', password='pass',
+        first_name='Synthetic', last_name='Instructor'
+    )
+    student_users = [
+        User.objects.create_user(f'{prefix}-student-{i}', password='pass')
+        for i in range(students)
+    ]
+    subject_objs = [
+        Subject.objects.create(title=f'Subject {i}', slug=f'{prefix}-subject-{i}')
+        for i in range(subjects)
+    ]
+    course_objs = []
+    for c in range(courses):
+        course = Course.objects.create(
+            owner=instructor,
+            subject=subject_objs[c % subjects],
+            title=f'Course {c}',
+            slug=f'{prefix}-course-{c}',
+            overview='Course overview. ' * 10
+        )
+        course.students.add(*student_users)
+        for m in range(modules):
+            module = Module.objects.create(course=course, title=f'Module {m}',
+                                           description='Module description')
+            create_items(instructor, module, items)
+        course_objs.append(course)
+    return {
+        'instructor': instructor,
+        'students': student_users,
+        'subjects': subject_objs,
+        'courses': course_objs,
+    }
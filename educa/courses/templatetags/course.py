@@ -1,4 +1,6 @@
 from django import template
+from django.utils.safestring import mark_safe
+from ..caching import hole_marker
 
 register = template.Library()
 
@@ -10,4 +12,14 @@ def model_name(obj):
     try:
         return obj._meta.model_name
     except AttributeError:
-        return None
\ No newline at end of file
+        return None
+
+@register.simple_tag(takes_context=True)
+def hole(context, template_name):
+    '''Renders the given per-user template. When the page is rendered
+    to be shared from the page cache, leaves a marker instead, which is
+    rendered per request by courses.caching.fill_holes().'''
+    if context.get('page_cache'):
+        return mark_safe(hole_marker(template_name))
+    return context.template.engine.get_template(template_name) \
+                                   .render(context)
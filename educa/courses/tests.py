@@ -1,3 +1,1428 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+import zipfile
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.template.base import Template
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .caching import (get_catalog_version, get_module_version,
+                      item_render_key)
+from PIL import Image as PILImage
+from .models import Subject, Course, Module, Content, Text, Video, File, \
+    Image, Blob, OrderSequence, Job
+from . import jobs, transfer
+from . import images
+from .storage import content_storage
+from .search import index_courses, search_courses
+from . import counters
+from .synthetic import create_items
+from . import urls as course_urls
+from .api import urls as api_urls
+from students import urls as student_urls
+from students.membership import is_enrolled
 
-# Create your tests here.
+# Tests run against a local memory cache rather than memcached.
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+def create_course(owner, subject, slug, modules=1, items_per_module=4):
+    '''Creates a course with the given number of modules, each holding
+    items_per_module content items cycling through the content types.'''
+    course = Course.objects.create(
+        owner=owner,
+        subject=subject,
+        title=slug.title(),
+        slug=slug,
+        overview='Overview'
+    )
+    for m in range(modules):
+        module = Module.objects.create(course=course, title=f'Module {m}')
+        create_items(owner, module, items_per_module)
+    return course
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CourseContentsAPITest(TestCase):
+    '''Tests for the course contents API endpoint.'''
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('instructor', password='pass')
+        self.student = User.objects.create_user('student', password='pass')
+        self.subject = Subject.objects.create(title='Maths', slug='maths')
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+
+    def get_contents(self, course):
+        return self.client.get(
+            reverse('api:course-contents', args=[course.id])
+        )
+
+    def test_contents_are_rendered(self):
+        course = create_course(self.owner, self.subject, 'small')
+        course.students.add(self.student)
+        response = self.get_contents(course)
+        self.assertEqual(response.status_code, 200)
+        contents = response.data['modules'][0]['contents']
+        self.assertEqual(len(contents), 4)
+        self.assertIn('Lorem ipsum', contents[0]['item'])
+
+    def test_query_count_does_not_grow_with_course_size(self):
+        small = create_course(self.owner, self.subject, 'small')
+        large = create_course(self.owner, self.subject, 'large',
+                              modules=20, items_per_module=15)
+        small.students.add(self.student)
+        large.students.add(self.student)
+        # warm up the content type cache
+        self.get_contents(small)
+        # course validator, course, modules, contents and one query per
+        # content type, the enrollment is checked against the cached
+        # memberships
+        with self.assertNumQueries(8):
+            self.get_contents(small)
+        with self.assertNumQueries(8):
+            response = self.get_contents(large)
+        self.assertEqual(len(response.data['modules']), 20)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ItemRenderCacheTest(TestCase):
+    '''Tests for the rendered content cache and its invalidation.'''
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('instructor', password='pass')
+        subject = Subject.objects.create(title='Maths', slug='maths')
+        self.course = create_course(self.owner, subject, 'course')
+        self.module = self.course.modules.get()
+        self.text = Text.objects.get()
+
+    def test_render_is_cached(self):
+        html = self.text.render()
+        self.assertEqual(cache.get(item_render_key(self.text)), html)
+
+    def test_render_reflects_updates(self):
+        self.assertIn('Lorem ipsum', self.text.render())
+        self.text.content = 'Edited text'
+        self.text.save()
+        self.assertIn('Edited text', Text.objects.get().render())
+
+    def test_delete_removes_rendered_item(self):
+        self.text.render()
+        key = item_render_key(self.text)
+        self.text.delete()
+        self.assertIsNone(cache.get(key))
+
+    def test_item_save_bumps_module_version(self):
+        version = get_module_version(self.module.id)
+        self.text.save()
+        self.assertNotEqual(get_module_version(self.module.id), version)
+
+    def test_content_changes_bump_module_version(self):
+        version = get_module_version(self.module.id)
+        content = Content.objects.create(module=self.module, item=self.text)
+        created_version = get_module_version(self.module.id)
+        self.assertNotEqual(created_version, version)
+        content.delete()
+        self.assertNotEqual(get_module_version(self.module.id),
+                            created_version)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CourseCatalogCacheTest(TestCase):
+    '''Tests for the cached course catalog.'''
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(
+            'instructor', password='pass', first_name='Ada',
+            last_name='Lovelace'
+        )
+        self.subject = Subject.objects.create(title='Maths', slug='maths')
+        create_course(self.owner, self.subject, 'algebra')
+
+    def test_warm_catalog_makes_no_queries(self):
+        url = reverse('course_list')
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, 'Algebra')
+        self.assertContains(response, 'Ada Lovelace')
+
+    def test_warm_subject_catalog_makes_no_queries(self):
+        url = reverse('course_list_subject', args=['maths'])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, 'Algebra')
+
+    def test_unknown_subject_returns_404(self):
+        url = reverse('course_list_subject', args=['unknown'])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_new_course_is_listed_immediately(self):
+        url = reverse('course_list')
+        self.client.get(url)
+        create_course(self.owner, self.subject, 'geometry')
+        self.assertContains(self.client.get(url), 'Geometry')
+
+    def test_module_changes_update_the_catalog(self):
+        url = reverse('course_list')
+        self.assertContains(self.client.get(url), '1 modules')
+        Module.objects.create(course=Course.objects.get(), title='Extra')
+        self.assertContains(self.client.get(url), '2 modules')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AsyncCourseViewTest(TestCase):
+    '''Tests for the async catalog and course detail views.'''
+
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user('instructor', password='pass')
+        self.subject = Subject.objects.create(title='Maths', slug='maths')
+        self.course = create_course(owner, self.subject, 'algebra')
+
+    def test_views_are_coroutine_functions(self):
+        for name, args in (('course_list', []),
+                           ('course_detail', ['algebra'])):
+            view = resolve(reverse(name, args=args)).func
+            self.assertTrue(asyncio.iscoroutinefunction(view))
+
+    async def test_catalog(self):
+        client = AsyncClient()
+        response = await client.get(reverse('course_list'))
+        self.assertContains(response, 'Algebra')
+        response = await client.get(
+            reverse('course_list_subject', args=['maths']), {'q': 'algebra'}
+        )
+        self.assertContains(response, 'Algebra')
+        response = await client.get(
+            reverse('course_list_subject', args=['unknown'])
+        )
+        self.assertEqual(response.status_code, 404)
+
+    async def test_course_detail(self):
+        client = AsyncClient()
+        response = await client.get(
+            reverse('course_detail', args=['algebra'])
+        )
+        self.assertContains(response, 'Algebra')
+        self.assertIn('enroll_form', response.context)
+        response = await client.get(
+            reverse('course_detail', args=['unknown'])
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_method_not_allowed(self):
+        response = self.client.post(reverse('course_list'))
+        self.assertEqual(response.status_code, 405)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CourseListAPITest(TestCase):
+    '''Tests for the paginated course and subject list API endpoints.'''
+
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user('instructor', password='pass')
+        subject = Subject.objects.create(title='Maths', slug='maths')
+        for i in range(5):
+            create_course(owner, subject, f'course-{i}', items_per_module=0)
+        self.client = APIClient()
+
+    def test_courses_are_cursor_paginated(self):
+        url = reverse('api:course-list')
+        response = self.client.get(url, {'page_size': 2})
+        slugs = [c['slug'] for c in response.data['results']]
+        self.assertEqual(slugs, ['course-4', 'course-3'])
+        self.assertIsNone(response.data['previous'])
+        seen = slugs
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            seen += [c['slug'] for c in response.data['results']]
+        self.assertEqual(seen, [f'course-{i}' for i in range(4, -1, -1)])
+
+    def test_page_query_count_is_constant(self):
+        url = reverse('api:course-list')
+        # courses and their prefetched modules
+        with self.assertNumQueries(2):
+            self.client.get(url, {'page_size': 5})
+
+    def test_modules_can_be_left_out(self):
+        url = reverse('api:course-list')
+        response = self.client.get(url)
+        self.assertIn('modules', response.data['results'][0])
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'modules': 'false'})
+        self.assertNotIn('modules', response.data['results'][0])
+
+    def test_subjects_are_cursor_paginated(self):
+        response = self.client.get(reverse('api:subject_list'))
+        self.assertEqual(response.data['results'][0]['slug'], 'maths')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class OrderViewTest(TestCase):
+    '''Tests for the module and content reorder views.'''
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('instructor', password='pass')
+        self.other = User.objects.create_user('other', password='pass')
+        subject = Subject.objects.create(title='Maths', slug='maths')
+        self.course = create_course(self.owner, subject, 'course', modules=3)
+        self.other_course = create_course(self.other, subject, 'other')
+        self.client.force_login(self.owner)
+
+    def post_order(self, url_name, orders):
+        return self.client.post(
+            reverse(url_name),
+            data=json.dumps(orders),
+            content_type='application/json'
+        )
+
+    def test_modules_are_reordered(self):
+        ids = list(self.course.modules.values_list('id', flat=True))
+        orders = {ids[0]: 2, ids[1]: 1, ids[2]: 0}
+        response = self.post_order('module_order', orders)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['updated'], [ids[0], ids[2]])
+        self.assertEqual(
+            list(self.course.modules.values_list('id', flat=True)),
+            list(reversed(ids))
+        )
+
+    def test_query_count_does_not_grow_with_items(self):
+        module = self.course.modules.first()
+        ids = list(module.contents.values_list('id', flat=True))
+        self.post_order('content_order', {ids[0]: 9})
+        # session, user, savepoint, select for update, update, sequence
+        # update, course update and savepoint release
+        with self.assertNumQueries(8):
+            self.post_order('content_order',
+                            {id: 10 + i for i, id in enumerate(ids)})
+
+    def test_content_reorder_bumps_module_version(self):
+        module = self.course.modules.first()
+        content = module.contents.first()
+        version = get_module_version(module.id)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.post_order('content_order', {content.id: 5})
+        # the version is bumped once the new order is committed
+        self.assertEqual(get_module_version(module.id), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(get_module_version(module.id), version)
+
+    def test_foreign_ids_are_rejected(self):
+        own = self.course.modules.first()
+        foreign = self.other_course.modules.get()
+        response = self.post_order('module_order', {own.id: 7, foreign.id: 8})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['rejected'], [foreign.id])
+        # nothing is applied
+        own.refresh_from_db()
+        self.assertNotEqual(own.order, 7)
+
+    def test_invalid_data_is_rejected(self):
+        module = self.course.modules.first()
+        response = self.post_order('module_order', {module.id: -1})
+        self.assertEqual(response.status_code, 400)
+        response = self.post_order('module_order', [module.id])
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class OrderFieldTest(TestCase):
+    '''Tests for the order allocation of OrderField.'''
+
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user('instructor', password='pass')
+        self.subject = Subject.objects.create(title='Maths', slug='maths')
+        self.course = create_course(owner, self.subject, 'course',
+                                    items_per_module=0)
+        self.text = Text.objects.create(owner=owner, title='Text',
+                                        content='Text')
+
+    def test_orders_follow_existing_objects(self):
+        Module.objects.create(course=self.course, title='Explicit', order=5)
+        module = Module.objects.create(course=self.course, title='Next')
+        self.assertEqual(module.order, 6)
+
+    def test_sequences_are_deleted_with_their_parent(self):
+        module = self.course.modules.get()
+        Content.objects.create(module=module, item=self.text)
+        scopes = [
+            Module._meta.get_field('order').get_scope(module),
+            Content._meta.get_field('order').get_scope(
+                Content(module=module)
+            ),
+        ]
+        self.assertEqual(
+            OrderSequence.objects.filter(scope__in=scopes).count(), 2
+        )
+        self.course.delete()
+        self.assertFalse(OrderSequence.objects.filter(scope__in=scopes)
+                                      .exists())
+
+    def test_orders_follow_reordered_objects(self):
+        module = self.course.modules.get()
+        self.client.force_login(self.course.owner)
+        self.client.post(reverse('module_order'),
+                         data=json.dumps({module.id: 7}),
+                         content_type='application/json')
+        added = Module.objects.create(course=self.course, title='Next')
+        self.assertEqual(added.order, 8)
+
+    def test_orders_are_scoped_by_for_fields(self):
+        first = Module.objects.create(course=self.course, title='Second')
+        other = create_course(self.course.owner, self.subject, 'other',
+                              items_per_module=0)
+        self.assertEqual(first.order, 1)
+        self.assertEqual(other.modules.get().order, 0)
+
+    def test_allocation_cost_is_constant(self):
+        module = self.course.modules.get()
+        Content.objects.create(module=module, item=self.text)
+        # savepoint, sequence update, sequence select, release, the
+        # insert and the course update
+        with self.assertNumQueries(6):
+            Content.objects.create(module=module, item=self.text)
+
+    def test_bulk_create_assigns_orders(self):
+        module = self.course.modules.get()
+        Content.objects.create(module=module, item=self.text)
+        with self.assertNumQueries(5):
+            Content.objects.bulk_create([
+                Content(module=module, item=self.text) for i in range(50)
+            ])
+        self.assertEqual(
+            list(module.contents.values_list('order', flat=True)),
+            list(range(51))
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConditionalGetTest(TestCase):
+    '''Tests for the ETag and Last-Modified validators of the course
+    views.'''
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('instructor', password='pass')
+        self.student = User.objects.create_user('student', password='pass')
+        self.other = User.objects.create_user('other', password='pass')
+        subject = Subject.objects.create(title='Maths', slug='maths')
+        self.course = create_course(self.owner, subject, 'algebra')
+        self.course.students.add(self.student)
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+        self.url = reverse('api:course-contents', args=[self.course.id])
+
+    def test_unchanged_contents_are_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        # only the course validator is queried
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_changes_move_the_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        text = Text.objects.first()
+        text.content = 'Changed'
+        text.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+        Module.objects.create(course=self.course, title='Second')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_enrollment_is_checked_first(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.force_authenticate(self.other)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 403)
+
+    def test_course_detail(self):
+        url = reverse('api:course-detail', args=[self.course.id])
+        response = APIClient().get(url)
+        self.assertIn('Last-Modified', response)
+        response = APIClient().get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_student_course_detail(self):
+        url = reverse('student_course_detail', args=[self.course.id])
+        self.client.force_login(self.student)
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # the page displays the user, their ETags differ
+        self.other.courses_joined.add(self.course)
+        self.client.force_login(self.other)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class CounterTest(TestCase):
+    '''Tests for the denormalized course counters.'''
+
+    def setUp(self):
+        self.owner = User.objects.create_user('instructor', password='pass')
+        self.students = [
+            User.objects.create_user(f'student{i}', password='pass')
+            for i in range(3)
+        ]
+        self.maths = Subject.objects.create(title='Maths', slug='maths')
+        self.physics = Subject.objects.create(title='Physics', slug='physics')
+        self.course = create_course(self.owner, self.maths, 'algebra',
+                                    modules=2)
+
+    def assertCounts(self, total_modules, student_count, maths, physics):
+        self.course.refresh_from_db()
+        self.maths.refresh_from_db()
+        self.physics.refresh_from_db()
+        self.assertEqual(
+            (self.course.total_modules, self.course.student_count,
+             self.maths.total_courses, self.physics.total_courses),
+            (total_modules, student_count, maths, physics)
+        )
+        self.assertEqual(counters.find_stale(), [])
+
+    def test_modules_and_courses(self):
+        self.assertCounts(2, 0, 1, 0)
+        Module.objects.create(course=self.course, title='Third')
+        self.course.modules.first().delete()
+        self.assertCounts(2, 0, 1, 0)
+        course = Course.objects.get(pk=self.course.pk)
+        course.subject = self.physics
+        course.save()
+        self.assertCounts(2, 0, 0, 1)
+        course.delete()
+        self.maths.refresh_from_db()
+        self.physics.refresh_from_db()
+        self.assertEqual(
+            (self.maths.total_courses, self.physics.total_courses), (0, 0)
+        )
+
+    def test_enrollments(self):
+        self.course.students.add(*self.students)
+        self.course.students.add(self.students[0])
+        self.assertCounts(2, 3, 1, 0)
+        self.students[0].courses_joined.remove(self.course)
+        self.course.students.remove(self.students[0])
+        self.assertCounts(2, 2, 1, 0)
+        self.students[1].delete()
+        self.assertCounts(2, 1, 1, 0)
+        self.students[2].courses_joined.clear()
+        self.assertCounts(2, 0, 1, 0)
+        self.students[0].courses_joined.add(self.course)
+        self.course.students.clear()
+        self.assertCounts(2, 0, 1, 0)
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_enrollments_invalidate_the_catalog(self):
+        cache.clear()
+        for change in (
+            lambda: self.course.students.add(self.students[0]),
+            lambda: self.students[0].courses_joined.remove(self.course),
+            lambda: self.students[1].courses_joined.add(self.course),
+            lambda: self.course.students.clear(),
+        ):
+            version = get_catalog_version()
+            with self.captureOnCommitCallbacks() as callbacks:
+                change()
+            # the catalog is invalidated once the count is committed
+            self.assertEqual(get_catalog_version(), version)
+            for callback in callbacks:
+                callback()
+            self.assertNotEqual(get_catalog_version(), version)
+
+    def test_rebuild(self):
+        self.course.students.add(*self.students)
+        Course.objects.filter(pk=self.course.pk).update(
+            total_modules=0, student_count=7
+        )
+        stale = counters.rebuild()
+        self.assertEqual(
+            sorted((field, stored, actual) for _, field, _, stored, actual
+                   in stale),
+            [('student_count', 7, 3), ('total_modules', 0, 2)]
+        )
+        self.assertCounts(2, 3, 1, 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CourseSearchTest(TestCase):
+    '''Tests for the full-text course search.'''
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('instructor', password='pass')
+        self.subject = Subject.objects.create(title='Maths', slug='maths')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.algebra = create_course(self.owner, self.subject, 'algebra')
+            self.geometry = create_course(self.owner, self.subject,
+                                          'geometry')
+            module = self.geometry.modules.first()
+            module.description = 'Triangles and algebra'
+            module.save()
+
+    def search(self, query):
+        return list(search_courses(query).values_list('slug', flat=True))
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(self.search('algebra'), ['algebra', 'geometry'])
+
+    def test_text_items_are_indexed(self):
+        self.assertEqual(self.search('lorem'), ['geometry', 'algebra'])
+        self.assertEqual(self.search('triangles'), ['geometry'])
+        self.assertEqual(self.search('no such words'), [])
+
+    def test_index_is_updated_on_save(self):
+        text = Text.objects.filter(
+            id__in=self.algebra.modules.first().contents.values('object_id')
+        ).first()
+        text.content = 'Quadratic equations'
+        with self.captureOnCommitCallbacks(execute=True):
+            text.save()
+        self.assertEqual(self.search('quadratic'), ['algebra'])
+
+    def test_api_search(self):
+        response = APIClient().get(reverse('api:course-search'),
+                                   {'q': 'algebra', 'page_size': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(
+            [c['slug'] for c in response.data['results']], ['algebra']
+        )
+        self.assertIsNotNone(response.data['next'])
+
+    def test_catalog_search(self):
+        response = self.client.get(reverse('course_list'), {'q': 'triangles'})
+        self.assertEqual(
+            [c['slug'] for c in response.context['courses']], ['geometry']
+        )
+        self.assertContains(response, 'value="triangles"')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ContentStorageTest(TestCase):
+    '''Tests for the content-addressed storage of File and Image
+    items.'''
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.owner = User.objects.create_superuser('instructor',
+                                                   password='pass')
+        subject = Subject.objects.create(title='Maths', slug='maths')
+        course = create_course(self.owner, subject, 'algebra',
+                               items_per_module=0)
+        self.module = course.modules.get()
+        self.client.force_login(self.owner)
+
+    def upload(self, data, name='notes.pdf'):
+        self.client.post(
+            reverse('module_content_create', args=[self.module.id, 'file']),
+            {'title': 'Notes', 'content': SimpleUploadedFile(name, data)}
+        )
+        return File.objects.latest('id')
+
+    def test_known_content_is_not_written_again(self):
+        first = self.upload(b'%PDF lecture notes')
+        with mock.patch.object(FileSystemStorage, '_save') as save:
+            second = self.upload(b'%PDF lecture notes', 'copy.pdf')
+        save.assert_not_called()
+        digest = hashlib.sha256(b'%PDF lecture notes').hexdigest()
+        self.assertEqual(first.content.name, second.content.name)
+        self.assertEqual(first.content.name,
+                         f'blobs/{digest[:2]}/{digest}.pdf')
+        blob = Blob.objects.get()
+        self.assertEqual((blob.digest, blob.references), (digest, 2))
+        self.assertEqual(second.content.read(), b'%PDF lecture notes')
+
+    def test_concurrent_upload_keeps_the_existing_blob(self):
+        data = b'%PDF lecture notes'
+        digest = hashlib.sha256(data).hexdigest()
+        name = content_storage.blob_name(digest, '.pdf')
+        save = FileSystemStorage._save
+
+        def upload_concurrently(self, name, content):
+            # another upload stores the same content meanwhile
+            save(self, name, ContentFile(data))
+            Blob.objects.create(digest=digest, name=name, size=len(data))
+            return save(self, name, content)
+
+        with mock.patch.object(FileSystemStorage, '_save',
+                               upload_concurrently):
+            with transaction.atomic():
+                saved = content_storage.save('notes.pdf', ContentFile(data))
+                # the transaction is still usable
+                self.assertEqual(Blob.objects.count(), 1)
+        self.assertEqual(saved, name)
+        self.assertEqual(
+            os.listdir(os.path.dirname(content_storage.path(name))),
+            [os.path.basename(name)]
+        )
+
+    def test_references_are_counted(self):
+        first = self.upload(b'first')
+        second = self.upload(b'first')
+        second.content = self.upload(b'second').content
+        second.save()
+        self.assertEqual(
+            dict(Blob.objects.values_list('size', 'references')),
+            {5: 1, 6: 2}
+        )
+        first.delete()
+        self.assertEqual(Blob.objects.get(size=5).references, 0)
+
+    def test_cleanup_deletes_unreferenced_blobs(self):
+        item = self.upload(b'content')
+        name = item.content.name
+        item.delete()
+        call_command('cleanup_blobs', stdout=io.StringIO())
+        self.assertTrue(content_storage.exists(name))
+        call_command('cleanup_blobs', grace_hours=-1, stdout=io.StringIO())
+        self.assertFalse(content_storage.exists(name))
+        self.assertFalse(Blob.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES, IMAGE_VARIANT_WORKERS=0)
+class ImageVariantTest(TestCase):
+    '''Tests for the responsive variants of Image items.'''
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.owner = User.objects.create_user('instructor', password='pass')
+
+    def create_image(self, data, name='photo.png'):
+        return Image.objects.create(owner=self.owner, title='Photo',
+                                    content=ContentFile(data, name=name))
+
+    def png(self, width, height):
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (width, height), 'red').save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def test_variants_are_generated_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = self.create_image(self.png(1000, 500))
+            # the original is served until the variants are ready
+            self.assertNotIn('srcset', image.render())
+        image.refresh_from_db()
+        self.assertEqual(
+            [v['width'] for v in image.variants['widths']],
+            [320, 640, 1000]
+        )
+        for v in image.variants['widths']:
+            self.assertTrue(default_storage.exists(v['webp']))
+        with default_storage.open(image.variants['widths'][0]['src']) as f:
+            self.assertEqual(PILImage.open(f).size, (320, 160))
+        html = image.render()
+        self.assertIn('type="image/webp"', html)
+        self.assertIn(f'{image.download_url} 1000w', html)
+        self.assertIsNotNone(image.thumbnail_url)
+
+    def test_variants_are_shared_by_identical_files(self):
+        data = self.png(400, 400)
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.create_image(data)
+        with mock.patch.object(default_storage, 'save') as save, \
+                self.captureOnCommitCallbacks(execute=True):
+            second = self.create_image(data, 'copy.png')
+        save.assert_not_called()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.variants, second.variants)
+
+    def test_unreadable_files_are_served_as_is(self):
+        with self.assertLogs('courses.images', 'WARNING'), \
+                self.captureOnCommitCallbacks(execute=True):
+            image = self.create_image(b'not an image', 'photo.jpg')
+        image.refresh_from_db()
+        self.assertEqual(image.variants['widths'], [])
+        self.assertNotIn('srcset', image.render())
+
+    @override_settings(IMAGE_VARIANT_WORKERS=2)
+    def test_variants_are_generated_by_the_workers(self):
+        with mock.patch.object(images, 'get_executor') as get_executor, \
+                self.captureOnCommitCallbacks(execute=True):
+            image = self.create_image(self.png(10, 10))
+        get_executor.return_value.submit.assert_called_once_with(
+            images.run_in_worker, image.pk
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ContentDownloadTest(TestCase):
+    '''Tests for the permission checked download view.'''
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.owner = User.objects.create_user('instructor', password='pass')
+        self.student = User.objects.create_user('student', password='pass')
+        subject = Subject.objects.create(title='Maths', slug='maths')
+        course = create_course(self.owner, subject, 'algebra',
+                               items_per_module=0)
+        course.students.add(self.student)
+        self.file = File.objects.create(
+            owner=self.owner, title='Lecture notes',
+            content=ContentFile(b'0123456789', name='notes.pdf')
+        )
+        Content.objects.create(module=course.modules.get(), item=self.file)
+        self.url = reverse('content_download', args=['file', self.file.id])
+
+    def get(self, user, url=None, **headers):
+        self.client.force_login(user)
+        return self.client.get(url or self.url, **headers)
+
+    def test_enrolled_students_and_owner_can_download(self):
+        for user in (self.student, self.owner):
+            response = self.get(user)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content),
+                             b'0123456789')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Disposition'],
+                         "attachment; filename*=UTF-8''lecture-notes.pdf")
+
+    def test_other_users_cannot_download(self):
+        stranger = User.objects.create_user('stranger', password='pass')
+        self.assertEqual(self.get(stranger).status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+        url = reverse('content_download_variant',
+                      args=['file', self.file.id, '320.webp'])
+        self.assertEqual(self.get(self.student, url).status_code, 404)
+
+    def test_range_requests(self):
+        response = self.get(self.student, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        response = self.get(self.student, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+        response = self.get(self.student, HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    @override_settings(PROTECTED_MEDIA_ACCEL_REDIRECT=True)
+    def test_transfer_is_handed_to_nginx(self):
+        response = self.get(self.student)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'],
+                         f'/protected/{self.file.content.name}')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response.content, b'')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class JobQueueTest(TestCase):
+    '''Tests for the background job queue and its handlers.'''
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.owner = User.objects.create_superuser('instructor',
+                                                   password='pass')
+        self.student = User.objects.create_user('student', password='pass')
+        self.subject = Subject.objects.create(title='Maths', slug='maths')
+        self.client.force_login(self.owner)
+        Job.objects.all().delete()
+
+    def run_jobs(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('run_jobs', once=True, stdout=io.StringIO())
+
+    def test_course_delete_is_enqueued(self):
+        course = create_course(self.owner, self.subject, 'algebra',
+                               modules=2)
+        course.students.add(self.student)
+        modules = list(course.modules.all())
+        scopes = [Module._meta.get_field('order').get_scope(modules[0])] + \
+            [Content._meta.get_field('order').get_scope(Content(module=m))
+             for m in modules]
+        self.assertEqual(
+            OrderSequence.objects.filter(scope__in=scopes).count(), 3
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('course_delete',
+                                                args=[course.id]))
+        self.assertRedirects(response, reverse('manage_course_list'))
+        # the course is hidden until a worker removes it
+        self.assertFalse(Course.objects.filter(pk=course.pk).exists())
+        self.assertTrue(Course.all_objects.filter(pk=course.pk).exists())
+        self.assertEqual(counters.find_stale(), [])
+        self.assertNotContains(self.client.get(reverse('course_list')),
+                               'Algebra')
+        self.assertNotContains(self.client.get(reverse('manage_course_list')),
+                               'Algebra')
+        response = self.client.get(reverse('api:course-detail',
+                                           args=[course.id]))
+        self.assertEqual(response.status_code, 404)
+        # the slug can be taken again, not the one of the hidden course
+        create_course(self.owner, self.subject, 'algebra')
+        response = self.client.post(reverse('course_create'), {
+            'subject': self.subject.id, 'title': 'Geometry',
+            'slug': f'deleted-{course.id}', 'overview': 'Overview',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('slug', response.context['form'].errors)
+        self.assertTrue(Job.objects.filter(kind='delete_courses').exists())
+        self.run_jobs()
+        self.assertFalse(Course.all_objects.filter(pk=course.pk).exists())
+        self.assertFalse(Module.objects.filter(course_id=course.pk).exists())
+        self.assertFalse(OrderSequence.objects.filter(scope__in=scopes)
+                                      .exists())
+        # only the contents and items of the new course are left
+        self.assertEqual(Content.objects.count(), 4)
+        self.assertEqual(
+            sum(model.objects.count() for model in (Text, Video, Image, File)),
+            4
+        )
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(counters.find_stale(), [])
+        self.assertFalse(is_enrolled(self.student, course.pk))
+
+    def test_course_delete_runs_in_batched_statements(self):
+        small = create_course(self.owner, self.subject, 'algebra',
+                              items_per_module=4)
+        large = create_course(self.owner, self.subject, 'geometry',
+                              modules=4, items_per_module=8)
+        counts = []
+        for course in (small, large):
+            Job.objects.all().delete()
+            jobs.enqueue('delete_courses', course_id=course.id)
+            with CaptureQueriesContext(connection) as queries:
+                jobs.run_pending('worker')
+            counts.append(len(queries))
+            # leave out the file deletion enqueued by the handler
+            Job.objects.all().delete()
+        self.assertEqual(counts[0], counts[1])
+        self.assertFalse(Content.objects.exists())
+
+    def test_content_delete_removes_unreferenced_files(self):
+        module = create_course(self.owner, self.subject, 'algebra',
+                               items_per_module=0).modules.get()
+        name = default_storage.save('files/legacy.pdf', ContentFile(b'old'))
+        legacy = File.objects.create(owner=self.owner, title='Legacy',
+                                     content=name)
+        blob = File.objects.create(owner=self.owner, title='Notes',
+                                   content=ContentFile(b'new', 'notes.pdf'))
+        for item in (legacy, blob):
+            Content.objects.create(module=module, item=item)
+        for content in Content.objects.all():
+            self.client.post(reverse('module_content_delete',
+                                     args=[content.id]))
+        self.assertFalse(Content.objects.exists())
+        self.assertEqual(File.objects.count(), 2)
+        self.run_jobs()
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(default_storage.exists(name))
+        # blobs are left to cleanup_blobs
+        self.assertEqual(Blob.objects.get().references, 0)
+        self.assertTrue(content_storage.exists(blob.content.name))
+
+    def test_saved_items_enqueue_no_jobs(self):
+        text = Text.objects.create(owner=self.owner, title='Intro',
+                                   content='Hello')
+        text.save()
+        # the rendered items are cached when the students ask for them
+        self.assertFalse(Job.objects.exists())
+
+    def test_failed_jobs_are_retried(self):
+        def explode(payloads):
+            if any(p['fail'] for p in payloads):
+                raise ValueError('boom')
+        good = jobs.enqueue('explode', fail=False)
+        bad = jobs.enqueue('explode', fail=True)
+        with mock.patch.dict(jobs.HANDLERS, explode=explode), \
+                self.assertLogs('courses.jobs', 'ERROR'):
+            jobs.run_pending('worker')
+            self.assertFalse(Job.objects.filter(pk=good.pk).exists())
+            bad.refresh_from_db()
+            self.assertEqual((bad.status, bad.attempts),
+                             (Job.PENDING, 1))
+            self.assertIn('boom', bad.error)
+            # not due until the retry delay has passed
+            self.assertEqual(jobs.run_pending('worker'), 0)
+            Job.objects.filter(pk=bad.pk).update(
+                run_after=timezone.now(), attempts=4
+            )
+            jobs.run_pending('worker')
+        bad.refresh_from_db()
+        self.assertEqual((bad.status, bad.attempts), (Job.FAILED, 5))
+
+    def test_expired_leases_are_claimed_again(self):
+        job = jobs.enqueue('delete_files', names=[])
+        self.assertEqual(jobs.claim('first', 10), [job])
+        self.assertEqual(jobs.claim('second', 10), [])
+        Job.objects.update(locked_until=timezone.now())
+        self.assertEqual(jobs.claim('second', 10), [job])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, IMAGE_VARIANT_WORKERS=0)
+class CourseTransferTest(TestCase):
+    '''Tests for the export and import of whole courses.'''
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.owner = User.objects.create_superuser('instructor',
+                                                   password='pass')
+        self.other = User.objects.create_superuser('other', password='pass')
+        self.subject = Subject.objects.create(title='Maths', slug='maths')
+        self.course = create_course(self.owner, self.subject, 'algebra',
+                                    modules=3, items_per_module=8)
+        self.client = APIClient()
+
+    def structure(self, course):
+        return [
+            (module.title, [(c.content_type.model, c.item.title)
+                            for c in module.contents.all()])
+            for module in course.modules.all()
+        ]
+
+    def export(self, course, **params):
+        self.client.force_authenticate(course.owner)
+        response = self.client.get(
+            reverse('api:course-export', args=[course.id]), params
+        )
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_commands_round_trip(self):
+        with tempfile.NamedTemporaryFile(suffix='.ndjson') as f:
+            call_command('export_course', 'algebra', output=f.name,
+                         stderr=io.StringIO())
+            call_command('import_course', f.name, owner='other',
+                         stdout=io.StringIO())
+        course = Course.objects.get(slug='algebra-2')
+        self.assertEqual(course.owner, self.other)
+        self.assertEqual(self.structure(course), self.structure(self.course))
+        self.assertEqual(
+            [m.order for m in course.modules.all()], [0, 1, 2]
+        )
+        self.assertEqual(
+            list(course.modules.first().contents.values_list('order',
+                                                             flat=True)),
+            list(range(8))
+        )
+        self.assertEqual(counters.find_stale(), [])
+
+    def test_zip_archive_carries_the_files(self):
+        module = self.course.modules.first()
+        item = File.objects.create(
+            owner=self.owner, title='Notes',
+            content=ContentFile(b'lecture notes', name='notes.pdf')
+        )
+        Content.objects.create(module=module, item=item)
+        data = self.export(self.course, archive='zip')
+        # the importing environment has none of the files
+        content_storage.delete(item.content.name)
+        Blob.objects.all().delete()
+        self.client.force_authenticate(self.other)
+        response = self.client.post(
+            reverse('api:course-import'),
+            {'archive': SimpleUploadedFile('algebra.zip', data),
+             'slug': 'imported'}
+        )
+        self.assertEqual(response.status_code, 201)
+        course = Course.objects.get(slug='imported')
+        self.assertEqual(response.data['id'], course.id)
+        imported = File.objects.get(title='Notes', owner=self.other)
+        self.assertEqual(imported.content.read(), b'lecture notes')
+        self.assertEqual(Blob.objects.get(name=imported.content.name)
+                             .references, 1)
+
+    def test_import_queries_do_not_grow_with_the_course(self):
+        large = create_course(self.owner, self.subject, 'geometry',
+                              modules=6, items_per_module=40)
+        counts = []
+        for course in (self.course, large):
+            data = io.BytesIO(self.export(course))
+            with CaptureQueriesContext(connection) as queries:
+                transfer.import_course(data, self.other, reuse_files=True)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(
+            Content.objects.filter(module__course__owner=self.other).count(),
+            3 * 8 + 6 * 40
+        )
+
+    def test_duplicate_shares_the_files(self):
+        item = File.objects.create(
+            owner=self.owner, title='Notes',
+            content=ContentFile(b'lecture notes', name='notes.pdf')
+        )
+        Content.objects.create(module=self.course.modules.first(), item=item)
+        image = Image.objects.filter(owner=self.owner).first()
+        self.client.force_login(self.owner)
+        with mock.patch.object(FileSystemStorage, '_save') as save:
+            response = self.client.post(
+                reverse('course_duplicate', args=[self.course.id])
+            )
+        save.assert_not_called()
+        copy = Course.objects.get(slug='algebra-2')
+        self.assertRedirects(response, reverse('course_edit', args=[copy.id]))
+        self.assertEqual(copy.title, 'Algebra (copy)')
+        self.assertEqual(self.structure(copy), self.structure(self.course))
+        self.assertEqual(Blob.objects.get().references, 2)
+        copied = Image.objects.filter(
+            id__in=Content.objects.filter(module__course=copy)
+                                  .values('object_id'),
+            title=image.title
+        ).first()
+        self.assertEqual(copied.variants, image.variants)
+        self.assertEqual(counters.find_stale(), [])
+
+    def test_duplicate_queries_do_not_grow_with_the_course(self):
+        large = create_course(self.owner, self.subject, 'geometry',
+                              modules=6, items_per_module=40)
+        counts = []
+        for course in (self.course, large):
+            with CaptureQueriesContext(connection) as queries:
+                transfer.clone_course(course)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_only_owners_export(self):
+        student = User.objects.create_user('student', password='pass')
+        self.client.force_authenticate(student)
+        response = self.client.get(
+            reverse('api:course-export', args=[self.course.id])
+        )
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(
+            reverse('api:course-import'),
+            {'archive': SimpleUploadedFile('c.ndjson', b'')}
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_api_imports_only_take_files_from_the_archive(self):
+        item = File.objects.create(
+            owner=self.owner, title='Notes',
+            content=ContentFile(b'private notes', name='notes.pdf')
+        )
+        Content.objects.create(module=self.course.modules.first(), item=item)
+        data = self.export(self.course)
+        blob = Blob.objects.get(name=item.content.name)
+        self.client.force_authenticate(self.other)
+        for archive in (SimpleUploadedFile('algebra.ndjson', data),
+                        SimpleUploadedFile('algebra.zip', self.zip(data))):
+            response = self.client.post(reverse('api:course-import'),
+                                        {'archive': archive})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('not in the archive', response.data['archive'][0])
+        self.assertFalse(File.objects.filter(owner=self.other).exists())
+        blob.refresh_from_db()
+        self.assertEqual(blob.references, 1)
+
+    def test_invalid_slugs_are_rejected(self):
+        data = self.export(self.course)
+        records = [json.loads(line) for line in data.splitlines()]
+        course = next(r for r in records if r['type'] == 'course')
+        course['subject']['slug'] = 's s'
+        course['slug'] = 'bad slug!'
+        invalid = '\n'.join(json.dumps(r) for r in records).encode()
+        course['subject']['slug'] = 'maths'
+        course['slug'] = 'x' * 201
+        too_long = '\n'.join(json.dumps(r) for r in records).encode()
+        self.client.force_authenticate(self.other)
+        for archive, slug in ((invalid, ''), (data, 'bad slug!'),
+                              (too_long, '')):
+            response = self.client.post(reverse('api:course-import'), {
+                'archive': SimpleUploadedFile('algebra.ndjson', archive),
+                'slug': slug,
+            })
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid slug', response.data['archive'][0])
+        self.assertEqual(Course.objects.count(), 1)
+        self.assertFalse(Subject.objects.filter(slug='s s').exists())
+        self.assertEqual(self.client.get(reverse('course_list')).status_code,
+                         200)
+
+    def zip(self, data):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr(transfer.NDJSON_NAME, data)
+        return buffer.getvalue()
+
+    def test_invalid_exports_are_rejected(self):
+        self.client.force_authenticate(self.other)
+        header = b'{"type": "header", "format": "educa-course", "version": 1}'
+        for data in (b'not json', b'{"type": "course"}',
+                     header + b'\n{"type": "module", "id": 1}'):
+            response = self.client.post(
+                reverse('api:course-import'),
+                {'archive': SimpleUploadedFile('c.ndjson', data)}
+            )
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Course.objects.count(), 1)
+
+
+class RenderTimer:
+    '''Context manager measuring the time spent rendering templates,
+    counting nested renders (extends, includes, items) once.'''
+
+    def __init__(self):
+        self.elapsed = 0
+        self.depth = 0
+
+    def __enter__(self):
+        render = Template.render
+        timer = self
+
+        def timed_render(template, context):
+            timer.depth += 1
+            start = time.perf_counter()
+            try:
+                return render(template, context)
+            finally:
+                timer.depth -= 1
+                if not timer.depth:
+                    timer.elapsed += time.perf_counter() - start
+
+        self.patch = mock.patch.object(Template, 'render', timed_render)
+        self.patch.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.patch.stop()
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PROTECTED_MEDIA_ACCEL_REDIRECT=True)
+class QueryBudgetTest(TestCase):
+    '''Query and template render time budgets per URL name.
+
+    Every URL is requested with a cold cache against a small dataset,
+    and again after the dataset has grown, including the course being
+    requested. The number of queries must stay within the budget and
+    must not grow with the data.
+    '''
+    # url name: (max queries, max template render ms), measured with a
+    # cold cache and including the session and user queries
+    BUDGETS = {
+        # courses/urls.py
+        'manage_course_list': (3, 250),
+        'course_create': (3, 250),
+        'course_edit': (4, 250),
+        'course_delete': (3, 250),
+        'course_duplicate': (45, 0),
+        'course_module_update': (4, 250),
+        'module_content_create': (3, 250),
+        'module_content_update': (4, 250),
+        'module_content_delete': (11, 0),
+        'module_content_list': (9, 250),
+        'module_order': (8, 0),
+        'content_order': (8, 0),
+        'course_list_subject': (4, 250),
+        'course_detail': (6, 250),
+        'content_download': (4, 0),
+        'content_download_variant': (4, 0),
+        # educa/urls.py
+        'course_list': (4, 250),
+        # students/urls.py
+        'student_registration': (2, 250),
+        'student_enroll_course': (4, 0),
+        'student_course_list': (4, 250),
+        'student_course_detail': (12, 250),
+        'student_course_detail_module': (12, 250),
+        # courses/api/urls.py
+        'api:api-root': (0, 0),
+        'api:subject_list': (1, 0),
+        'api:subject_detail': (1, 0),
+        'api:course-list': (2, 0),
+        'api:course-detail': (3, 0),
+        'api:course-contents': (9, 100),
+        'api:course-enroll': (3, 0),
+        'api:course-search': (2, 0),
+        'api:course-export': (7, 0),
+        'api:course-import': (35, 0),
+        'api:course-enroll-bulk': (1, 0),
+    }
+
+    def setUp(self):
+        self.instructor = User.objects.create_superuser(
+            'instructor', password='pass'
+        )
+        self.student = User.objects.create_user('student', password='pass')
+        self.subject = Subject.objects.create(title='Maths', slug='maths')
+        self.course = create_course(self.instructor, self.subject, 'course',
+                                    modules=2, items_per_module=4)
+        self.course.students.add(self.student)
+
+    def grow(self):
+        '''Adds modules and items to the course and adds more courses.'''
+        module = self.course.modules.first()
+        create_items(self.instructor, module, 12)
+        for m in range(4):
+            new = Module.objects.create(course=self.course, title='New')
+            create_items(self.instructor, new, 8)
+        for c in range(4):
+            other = create_course(self.instructor, self.subject, f'other-{c}',
+                                  modules=3, items_per_module=4)
+            other.students.add(self.student)
+
+    def prepare(self, url_name):
+        '''Returns a function requesting the given URL name, with the
+        client authenticated and the request data prepared up front.'''
+        course = self.course
+        module = course.modules.first()
+        contents = module.contents.all()
+        text = Text.objects.filter(owner=self.instructor).first()
+        image = Image.objects.first()
+        image.variants = {'source': image.content.name, 'widths': [],
+                          'thumbnail': 'variants/images/image/thumbnail.png'}
+        image.save()
+        requests = {
+            'manage_course_list': ('get', []),
+            'course_create': ('get', []),
+            'course_edit': ('get', [course.id]),
+            'course_delete': ('get', [course.id]),
+            'course_duplicate': ('post', [course.id]),
+            'course_module_update': ('get', [course.id]),
+            'module_content_create': ('get', [module.id, 'text']),
+            'module_content_update': ('get', [module.id, 'text', text.id]),
+            # delete from another module, so the measured module keeps
+            # all of its content types
+            'module_content_delete': (
+                'post', [course.modules.last().contents.last().id]
+            ),
+            'module_content_list': ('get', [module.id]),
+            'module_order': ('json', [], {
+                m.id: i for i, m in enumerate(course.modules.reverse())
+            }),
+            'content_order': ('json', [], {
+                c.id: i for i, c in enumerate(contents.reverse())
+            }),
+            'course_list_subject': ('get', [self.subject.slug]),
+            'course_detail': ('get', [course.slug]),
+            'content_download': ('get', ['file', File.objects.first().id]),
+            'content_download_variant': (
+                'get', ['image', image.id, 'thumbnail.png']
+            ),
+            'course_list': ('get', []),
+            'student_registration': ('get', []),
+            'student_enroll_course': ('post', [], {'course': course.id}),
+            'student_course_list': ('get', []),
+            'student_course_detail': ('get', [course.id]),
+            'student_course_detail_module': ('get', [course.id, module.id]),
+            'api:api-root': ('get', []),
+            'api:subject_list': ('get', []),
+            'api:subject_detail': ('get', [self.subject.id]),
+            'api:course-list': ('get', []),
+            'api:course-detail': ('get', [course.id]),
+            'api:course-contents': ('get', [course.id]),
+            'api:course-enroll': ('post', [course.id]),
+            'api:course-search': ('get', [], {'q': 'lorem'}),
+            'api:course-export': ('get', [course.id]),
+            'api:course-enroll-bulk': ('post', [course.id], {
+                'roster': SimpleUploadedFile('roster.csv', b'student\n')
+            }),
+            'api:course-import': ('post', [], {'archive': SimpleUploadedFile(
+                'course.zip', b''.join(transfer.export_zip(course))
+            )}),
+        }
+        if url_name == 'api:course-search':
+            index_courses(Course.objects.values_list('id', flat=True))
+        method, args, *data = requests[url_name]
+        data = data[0] if data else {}
+        client = APIClient()
+        if url_name in ('api:course-export', 'api:course-import',
+                        'api:course-enroll-bulk'):
+            client.force_authenticate(self.instructor)
+        elif url_name.startswith('api:'):
+            client.force_authenticate(self.student)
+        elif url_name.startswith('student_'):
+            client.force_login(self.student)
+        else:
+            client.force_login(self.instructor)
+        url = reverse(url_name, args=args)
+        if method == 'json':
+            return lambda: client.post(url, data=json.dumps(data),
+                                       content_type='application/json')
+        return lambda: getattr(client, method)(url, data)
+
+    def measure(self):
+        '''Returns the number of queries and the template render time of
+        every URL name, measured with a cold cache.'''
+        costs = {}
+        for url_name in self.BUDGETS:
+            self.prepare(url_name)()
+            request = self.prepare(url_name)
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries, \
+                    RenderTimer() as timer:
+                response = request()
+            self.assertLess(response.status_code, 400, url_name)
+            costs[url_name] = (len(queries), timer.elapsed * 1000)
+        return costs
+
+    def test_every_url_has_a_budget(self):
+        url_names = {p.name for p in course_urls.urlpatterns} \
+            | {p.name for p in student_urls.urlpatterns} \
+            | {'api:' + p.name for p in api_urls.urlpatterns
+               if getattr(p, 'name', None)} \
+            | {'api:' + p.name for p in api_urls.router.urls} \
+            | {'course_list'}
+        self.assertEqual(url_names, set(self.BUDGETS))
+
+    def test_costs_stay_within_budget_and_do_not_grow(self):
+        small = self.measure()
+        self.grow()
+        large = self.measure()
+        for url_name, (max_queries, max_render_ms) in self.BUDGETS.items():
+            with self.subTest(url_name):
+                queries, render_ms = large[url_name]
+                self.assertEqual(queries, small[url_name][0],
+                                 'query count grows with the data')
+                self.assertLessEqual(queries, max_queries)
+                self.assertLessEqual(render_ms, max_render_ms)
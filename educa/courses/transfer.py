@@ -0,0 +1,429 @@
+'''
+Export and import of whole courses, to move them between environments.
+
+A course is exported as NDJSON: a header line, then one JSON record per
+line for the course, its modules, its content items and its contents,
+each record carrying its type. The records are read with
+.iterator(chunk_size=CHUNK_SIZE) and streamed as they are encoded, so
+the memory used does not grow with the course. A zip archive holds the
+NDJSON as course.ndjson, along with the files of the File and Image
+items under files/, for environments that do not share the media files.
+
+An import creates the course in one transaction and inserts each model
+with bulk_create, in batches, reserving the order values of modules and
+contents for the whole batch at once. The number of queries grows with
+the number of batches, not of objects; only files imported from a zip
+archive cost queries each, in the content-addressed storage. Courses
+are copied the same way by clone_course().
+'''
+import json
+import zipfile
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.core.files import File as DjangoFile
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from .bulk import BATCH_SIZE, bulk_insert
+from .caching import bump_catalog_version
+from .counters import adjust
+from .images import schedule_variants
+from .models import Subject, Course, Module, Content, Text, Video, Image, File
+from .storage import acquire, content_storage
+
+FORMAT = 'educa-course'
+VERSION = 1
+# rows fetched per query while exporting
+CHUNK_SIZE = 2000
+# size of the chunks of a streamed export
+STREAM_CHUNK_SIZE = 64 * 1024
+
+ITEM_MODELS = {
+    'text': Text,
+    'video': Video,
+    'image': Image,
+    'file': File,
+}
+# items with a file
+FILE_TYPES = ('image', 'file')
+NDJSON_NAME = 'course.ndjson'
+FILES_DIR = 'files/'
+
+
+class ArchiveError(ValueError):
+    '''Raised when an exported course cannot be imported.'''
+
+
+def item_fields(model):
+    '''Returns the exported fields of a content item model.'''
+    return [f.attname for f in model._meta.concrete_fields
+            if f.editable and not f.primary_key and f.name != 'owner']
+
+
+def export_records(course, variants=False):
+    '''Yields the records of the given course, its modules, items and
+    contents, in the order they are imported. The generated variants of
+    the images are included on request, for copies sharing the files.'''
+    yield {'type': 'header', 'format': FORMAT, 'version': VERSION}
+    yield {
+        'type': 'course',
+        'subject': {'title': course.subject.title,
+                    'slug': course.subject.slug},
+        'title': course.title,
+        'slug': course.slug,
+        'overview': course.overview,
+    }
+    modules = Module.objects.filter(course=course).order_by('order')
+    for row in modules.values('id', 'title', 'description') \
+                      .iterator(chunk_size=CHUNK_SIZE):
+        yield {'type': 'module', **row}
+    contents = Content.objects.filter(module__course=course)
+    types = {}
+    for name, model in ITEM_MODELS.items():
+        content_type = ContentType.objects.get_for_model(model)
+        types[content_type.id] = name
+        items = model.objects.filter(id__in=contents.filter(
+            content_type=content_type
+        ).values('object_id')).order_by('id')
+        fields = item_fields(model)
+        if variants and model is Image:
+            fields.append('variants')
+        for row in items.values('id', *fields) \
+                        .iterator(chunk_size=CHUNK_SIZE):
+            yield {'type': name, **row}
+    contents = contents.order_by('module__order', 'order').values(
+        'module_id', 'content_type_id', 'object_id'
+    )
+    for row in contents.iterator(chunk_size=CHUNK_SIZE):
+        yield {
+            'type': 'content',
+            'module': row['module_id'],
+            'item': [types[row['content_type_id']], row['object_id']],
+        }
+
+
+def encode(record):
+    return json.dumps(record, cls=DjangoJSONEncoder).encode() + b'\n'
+
+
+def export_ndjson(course):
+    '''Yields the course as NDJSON, in chunks of about
+    STREAM_CHUNK_SIZE bytes.'''
+    chunk = []
+    size = 0
+    for record in export_records(course):
+        line = encode(record)
+        chunk.append(line)
+        size += len(line)
+        if size >= STREAM_CHUNK_SIZE:
+            yield b''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield b''.join(chunk)
+
+
+class StreamBuffer:
+    '''Write-only file object collecting the output of a zip archive, so
+    it can be yielded while the archive is written.'''
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        '''Returns and forgets the data written so far.'''
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+def export_zip(course):
+    '''Yields the course as a zip archive, with the files of its items,
+    in chunks of about STREAM_CHUNK_SIZE bytes.'''
+    buffer = StreamBuffer()
+    names = {}
+    # the buffer is not seekable, the archive is written sequentially
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(NDJSON_NAME, 'w', force_zip64=True) as f:
+            for record in export_records(course):
+                name = record.get('content') \
+                    if record['type'] in FILE_TYPES else None
+                if name:
+                    if name not in names:
+                        names[name] = content_storage.exists(name)
+                    if not names[name]:
+                        # the file is gone, the item is exported without
+                        # it, as the import only takes files from the
+                        # archive
+                        record['content'] = ''
+                f.write(encode(record))
+                if buffer.size >= STREAM_CHUNK_SIZE:
+                    yield buffer.drain()
+        for name in sorted(name for name, exists in names.items() if exists):
+            # files are stored as they are, most are compressed already
+            info = zipfile.ZipInfo(FILES_DIR + name)
+            info.compress_type = zipfile.ZIP_STORED
+            with archive.open(info, 'w', force_zip64=True) as f, \
+                    content_storage.open(name, 'rb') as source:
+                for data in source.chunks():
+                    f.write(data)
+                    if buffer.size >= STREAM_CHUNK_SIZE:
+                        yield buffer.drain()
+    yield buffer.drain()
+
+
+def read_records(lines):
+    '''Yields the records of NDJSON lines, given as bytes.'''
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise ArchiveError(f'Line {number} is not valid JSON.')
+        if not isinstance(record, dict) or 'type' not in record:
+            raise ArchiveError(f'Line {number} is not a record.')
+        yield record
+
+
+def valid_slug(model, slug):
+    '''Returns the given slug of an object of the model, e.g. taken from
+    an archive, if it passes the validators of the slug field.'''
+    try:
+        return model._meta.get_field('slug').clean(slug, None)
+    except ValidationError as e:
+        raise ArchiveError(f'Invalid slug {slug!r}: {" ".join(e.messages)}')
+
+
+def unique_slug(slug):
+    '''Returns the given course slug, or the slug followed by the first
+    free number if it is taken.'''
+    taken = set(Course.objects.filter(slug__startswith=slug)
+                              .values_list('slug', flat=True))
+    if slug not in taken:
+        return slug
+    number = 2
+    while f'{slug}-{number}' in taken:
+        number += 1
+    return f'{slug}-{number}'
+
+
+class CourseImporter:
+    '''Creates a course from the records of an export, inserting the
+    records of each type in batches of BATCH_SIZE.
+
+    Attributes:
+        owner: The user owning the imported course and its items.
+        slug: The slug of the course, the exported slug if None. A taken
+            slug is followed by a number.
+        archive: The zip archive holding the files of the items, if any.
+        reuse_files: Whether files missing from the archive are taken
+            from the storage by name. Only for trusted exports, as the
+            owner gets access to the files: a name could be the file of
+            another instructor.
+    '''
+
+    def __init__(self, owner, slug=None, archive=None, reuse_files=False):
+        self.owner = owner
+        self.slug = slug
+        self.archive = archive
+        self.reuse_files = reuse_files
+        self.course = None
+        self.header = False
+        self.pending = []
+        self.pending_type = None
+        self.modules = {}
+        self.items = {name: {} for name in ITEM_MODELS}
+        self.content_types = {
+            name: ContentType.objects.get_for_model(model)
+            for name, model in ITEM_MODELS.items()
+        }
+        # stored name of each file, each file is only stored once
+        self.files = {}
+        self.names = []
+        self.images = []
+
+    def add(self, record):
+        kind = record['type']
+        if not self.header:
+            if kind != 'header' or record.get('format') != FORMAT or \
+                    record.get('version') != VERSION:
+                raise ArchiveError('Not a course export.')
+            self.header = True
+        elif kind == 'course':
+            if self.course is not None:
+                raise ArchiveError('More than one course.')
+            self.create_course(record)
+        elif self.course is None:
+            raise ArchiveError('The course must come first.')
+        elif kind in self.items or kind in ('module', 'content'):
+            if kind != self.pending_type or len(self.pending) >= BATCH_SIZE:
+                self.flush()
+                self.pending_type = kind
+            self.pending.append(record)
+        else:
+            raise ArchiveError(f'Unknown record type {kind}.')
+
+    def create_course(self, record):
+        try:
+            subject, created = Subject.objects.get_or_create(
+                slug=valid_slug(Subject, record['subject']['slug']),
+                defaults={'title': record['subject']['title']}
+            )
+            slug = unique_slug(valid_slug(Course, self.slug or record['slug']))
+            self.course = Course.objects.create(
+                owner=self.owner,
+                subject=subject,
+                title=record['title'],
+                # the number may take the slug over its max_length
+                slug=valid_slug(Course, slug),
+                overview=record['overview']
+            )
+        except (KeyError, TypeError):
+            raise ArchiveError('Invalid course record.')
+
+    def flush(self):
+        records, self.pending = self.pending, []
+        if not records:
+            return
+        try:
+            if self.pending_type == 'module':
+                self.add_modules(records)
+            elif self.pending_type == 'content':
+                self.add_contents(records)
+            else:
+                self.add_items(self.pending_type, records)
+        except ArchiveError:
+            raise
+        except (KeyError, TypeError, ValueError) as e:
+            raise ArchiveError(
+                f'Invalid {self.pending_type} record: {e!r}.'
+            )
+
+    def add_modules(self, records):
+        # order values are reserved in the order of the records
+        modules = bulk_insert(Module, [
+            Module(course=self.course, title=r['title'],
+                   description=r['description'])
+            for r in records
+        ])
+        for record, module in zip(records, modules):
+            self.modules[record['id']] = module.pk
+
+    def add_items(self, name, records):
+        model = ITEM_MODELS[name]
+        fields = item_fields(model)
+        objs = []
+        for record in records:
+            values = {field: record[field] for field in fields}
+            if name in FILE_TYPES:
+                values['content'] = self.store_file(values['content'])
+                self.names.append(values['content'])
+            if name == 'image' and 'variants' in record:
+                values['variants'] = record['variants']
+            objs.append(model(owner=self.owner, **values))
+        objs = bulk_insert(model, objs)
+        for record, obj in zip(records, objs):
+            self.items[name][record['id']] = obj.pk
+        if name == 'image':
+            # as Image.save() would, see courses.signals.image_saved
+            self.images += [
+                obj.pk for obj in objs if obj.content and
+                obj.variants.get('source') != obj.content.name
+            ]
+
+    def store_file(self, name):
+        '''Stores a file of the archive and returns its storage name.
+        A file missing from the archive is taken from the storage at the
+        same name with reuse_files, and rejected otherwise.'''
+        if not name:
+            return name
+        if name not in self.files:
+            try:
+                if self.archive is None:
+                    raise KeyError(name)
+                with self.archive.open(FILES_DIR + name) as f:
+                    self.files[name] = content_storage.save(
+                        name, DjangoFile(f, name)
+                    )
+            except KeyError:
+                if not self.reuse_files:
+                    raise ArchiveError(f'File {name} is not in the archive.')
+                self.files[name] = name
+        return self.files[name]
+
+    def add_contents(self, records):
+        contents = []
+        for record in records:
+            name, object_id = record['item']
+            contents.append(Content(
+                module_id=self.modules[record['module']],
+                content_type=self.content_types[name],
+                object_id=self.items[name][object_id]
+            ))
+        # order values are reserved for all the modules at once
+        Content.objects.bulk_create(contents, batch_size=BATCH_SIZE)
+
+    def finish(self):
+        '''Inserts the remaining records and does the bookkeeping that
+        the signals do for objects saved one by one.'''
+        self.flush()
+        if self.course is None:
+            raise ArchiveError('No course in the export.')
+        adjust(Course, 'total_modules', [self.course.pk], len(self.modules))
+        acquire(self.names)
+        for image_id in self.images:
+            schedule_variants(image_id)
+        # the course was indexed when it was created, once committed
+        transaction.on_commit(bump_catalog_version)
+        return self.course
+
+
+def import_course(file, owner, slug=None, reuse_files=False):
+    '''Creates a course from an NDJSON export or zip archive, given as a
+    binary file object, and returns it. Raises ArchiveError if the file
+    is not a valid export. The files of the items must be in the archive
+    unless reuse_files is set, see CourseImporter.'''
+    archive = None
+    if zipfile.is_zipfile(file):
+        file.seek(0)
+        archive = zipfile.ZipFile(file)
+        try:
+            lines = archive.open(NDJSON_NAME)
+        except KeyError:
+            raise ArchiveError(f'No {NDJSON_NAME} in the archive.')
+    else:
+        file.seek(0)
+        lines = file
+    importer = CourseImporter(owner, slug, archive, reuse_files)
+    with transaction.atomic():
+        for record in read_records(lines):
+            importer.add(record)
+        return importer.finish()
+
+
+def clone_course(course, owner=None, title=None, slug=None):
+    '''Copies a course with its modules, contents and content items,
+    for the given owner, the owner of the course by default, and returns
+    the copy.
+
+    The copy is made in one transaction with the same batched inserts
+    as an import, without encoding the records. The items share the
+    files and image variants of the original by reference.'''
+    importer = CourseImporter(owner or course.owner, slug or course.slug,
+                              reuse_files=True)
+    with transaction.atomic():
+        for record in export_records(course, variants=True):
+            if record['type'] == 'course':
+                record['title'] = title or f'{course.title} (copy)'
+            importer.add(record)
+        return importer.finish()
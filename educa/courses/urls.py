@@ -17,6 +17,11 @@ urlpatterns = [
         views.CourseUpdateView.as_view(),
         name='course_edit'
     ),
+    path(
+        '<pk>/duplicate/',
+        views.CourseDuplicateView.as_view(),
+        name='course_duplicate'
+    ),
     path(
         '<pk>/delete/',
         views.CourseDeleteView.as_view(),
@@ -57,6 +62,16 @@ urlpatterns = [
         views.ContentOrderView.as_view(),
         name='content_order'
     ),
+    path(
+        'download/<model_name>/<int:id>/',
+        views.ContentDownloadView.as_view(),
+        name='content_download'
+    ),
+    path(
+        'download/<model_name>/<int:id>/<variant>',
+        views.ContentDownloadView.as_view(),
+        name='content_download_variant'
+    ),
     path(
         'subject/<slug:subject>/',
         views.CourseListView.as_view(),
@@ -1,3 +1,5 @@
+import asyncio
+from asgiref.sync import sync_to_async
 from django.urls import reverse_lazy
 from django.views.generic.list import ListView
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
@@ -10,11 +12,25 @@ from django.forms.models import modelform_factory
 from django.apps import apps
 from . models import Module, Content
 from braces.views import CsrfExemptMixin, JsonRequestResponseMixin
-from django.db.models import Count
+from django.db import transaction
+from django.db.models import Case, When, Value, PositiveIntegerField, \
+    Subquery, OuterRef
 from .models import Subject
-from django.views.generic.detail import DetailView
+from django.views.generic.detail import DetailView, SingleObjectMixin
 from students.forms import CourseEnrollForm
 from django.core.cache import cache
+from .caching import bump_module_versions, get_catalog_version
+from .search import search_courses
+from .jobs import enqueue, hide_courses
+from .transfer import clone_course
+from .downloads import accel_response, file_response
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import PermissionDenied
+from django.core.files.storage import default_storage
+from students.membership import is_enrolled
+from django.http import Http404
+from educa.routers import ReplicaReadMixin, primary_reads
 
 
 #Mixins
@@ -88,6 +104,16 @@ class ManageCourseListView(OwnerCourseMixin, ListView):
     template_name = 'courses/manage/course/list.html'
     permission_required = 'courses.view_course'
 
+    def get_queryset(self):
+        '''Annotate each course with the id of its first module, which
+        the template links to.'''
+        qs = super().get_queryset()
+        return qs.annotate(first_module_id=Subquery(
+            Module.objects.filter(course=OuterRef('pk'))
+                          .order_by('order')
+                          .values('id')[:1]
+        ))
+
 
 class CourseCreateView(OwnerCourseEditMixin, CreateView):
     '''Uses a model form to create a new Course object. 
@@ -117,6 +143,21 @@ class CourseUpdateView(OwnerCourseEditMixin, UpdateView):
     permission_required = 'courses.change_course'
 
 
+class CourseDuplicateView(OwnerCourseMixin, SingleObjectMixin, View):
+    '''Copies a course of the user with its modules and contents, e.g.
+    for a new term, and redirects the user to the edit form of the copy.
+
+    The copy is made with a few batched inserts per content type and
+    shares the files of the original (see courses.transfer).
+    '''
+    permission_required = 'courses.add_course'
+
+    def post(self, request, *args, **kwargs):
+        course = self.get_object()
+        copy = clone_course(course, request.user)
+        return redirect('course_edit', copy.id)
+
+
 class CourseDeleteView(OwnerCourseMixin, DeleteView):
     '''Will allow deletion of an existing object.
     
@@ -131,6 +172,16 @@ class CourseDeleteView(OwnerCourseMixin, DeleteView):
     template_name = 'courses/manage/course/delete.html'
     permission_required = 'courses.delete_course'
 
+    def delete(self, request, *args, **kwargs):
+        '''Hides the course right away and enqueues its deletion, which
+        is carried out with its modules, contents and files by the job
+        workers (see courses.jobs), then redirects to the success_url.'''
+        self.object = self.get_object()
+        with transaction.atomic():
+            hide_courses([self.object.id])
+            enqueue('delete_courses', course_id=self.object.id)
+        return redirect(self.get_success_url())
+
 
 class CourseModuleUpdateView(TemplateResponseMixin, View):
     '''View to handle the formset for adding, updating, and deleting
@@ -278,19 +329,20 @@ class ContentDeleteView(View):
         received.
         
         Based on the given id, this method retrieves the Content 
-        object, then deletes the related Text, Video, Image or File 
-        object. Then deletes the Content object, and redirects the user
-        to the list of other contents for the module.
+        object and deletes it, then enqueues the deletion of the related
+        Text, Video, Image or File object and of its file (see
+        courses.jobs), and redirects the user to the list of other
+        contents for the module.
         '''
         content = get_object_or_404(
             Content,
             id=id,
             module__course__owner=request.user
         )
-        module = content.module
-        content.item.delete()
         content.delete()
-        return redirect('module_content_list', module.id)
+        enqueue('delete_items', content_type_id=content.content_type_id,
+                object_id=content.object_id)
+        return redirect('module_content_list', content.module_id)
 
 
 class ModuleContentListView(TemplateResponseMixin, View):
@@ -299,86 +351,323 @@ class ModuleContentListView(TemplateResponseMixin, View):
     template_name = 'courses/manage/module/content_list.html'
 
     def get(self, request, module_id):
-        module = get_object_or_404(Module,
+        module = get_object_or_404(Module.objects.select_related('course'),
                                    id=module_id,
                                    course__owner=request.user)
+        # resolve the content items with one query per content type
+        contents = module.contents.prefetch_related('item')
+        return self.render_to_response({'module': module,
+                                        'contents': contents})
 
-        return self.render_to_response({'module': module}) 
 
+class OrderUpdateMixin(CsrfExemptMixin, JsonRequestResponseMixin):
+    '''Mixin for views receiving a new order of objects encoded in JSON
+    as {id: order} pairs.
+
+    The new order is applied in a single transaction, with one UPDATE
+    statement for all of the changed objects. The request is rejected
+    if it contains ids of objects that are not owned by the user.
+
+    Child views define the following attributes:
+
+        model:
+            The model of the objects being reordered.
+        owner_lookup:
+            Lookup from the model to the owner of the objects.
+        parent_field:
+            Attribute name of the foreign key the objects are ordered
+            for.
+    '''
+    model = None
+    owner_lookup = None
+    parent_field = None
+
+    def get_orders(self):
+        '''Returns the received {id: order} pairs as integers, or None
+        if the request data is not valid.'''
+        if not isinstance(self.request_json, dict):
+            return None
+        try:
+            orders = {int(id): int(order)
+                      for id, order in self.request_json.items()}
+        except (TypeError, ValueError):
+            return None
+        if any(order < 0 for order in orders.values()):
+            return None
+        return orders
+
+    def orders_changed(self, parent_ids):
+        '''Called after the order of objects of the given parents has
+        been updated.'''
+        pass
 
-class ModuleOrderView(CsrfExemptMixin,
-                      JsonRequestResponseMixin,
-                      View):
-    '''View to receive the new order of module IDs encoded in JSON.'''
     def post(self, request):
-        for id, order in self.request_json.items():
-            Module.objects.filter(id=id,
-                   course__owner=request.user).update(order=order)
-        return self.render_json_response({'saved': 'OK'})
+        orders = self.get_orders()
+        if orders is None:
+            return self.render_bad_request_response(
+                {'error': 'Expected a JSON object of id: order pairs.'}
+            )
+        with transaction.atomic():
+            current = {
+                id: (order, parent_id)
+                for id, order, parent_id in self.model.objects
+                    .select_for_update(of=('self',))
+                    .filter(id__in=orders,
+                            **{self.owner_lookup: request.user})
+                    .values_list('id', 'order', self.parent_field)
+                    .order_by()
+            }
+            rejected = sorted(set(orders) - set(current))
+            if rejected:
+                return self.render_json_response(
+                    {'error': 'Objects not found.', 'rejected': rejected},
+                    status=403
+                )
+            changed = {id: order for id, order in orders.items()
+                       if current[id][0] != order}
+            if changed:
+                self.model.objects.filter(id__in=changed).update(
+                    order=Case(
+                        *[When(id=id, then=Value(order))
+                          for id, order in changed.items()],
+                        output_field=PositiveIntegerField()
+                    )
+                )
+                # the orders reserved next follow the new ones
+                self.model._meta.get_field('order').advance([
+                    self.model(**{self.parent_field: current[id][1],
+                                  'order': order})
+                    for id, order in changed.items()
+                ])
+                self.orders_changed({current[id][1] for id in changed})
+        return self.render_json_response({
+            'saved': 'OK',
+            'updated': sorted(changed)
+        })
 
 
-class ContentOrderView(CsrfExemptMixin,
-                       JsonRequestResponseMixin,
-                       View):
+class ModuleOrderView(OrderUpdateMixin, View):
+    '''View to receive the new order of module IDs encoded in JSON.'''
+    model = Module
+    owner_lookup = 'course__owner'
+    parent_field = 'course_id'
+
+    def orders_changed(self, parent_ids):
+        # update() does not send signals, mark the courses as updated
+        Course.objects.filter(id__in=parent_ids).touch()
+
+
+class ContentOrderView(OrderUpdateMixin, View):
     '''View to receive the new order of content IDs of a module encoded
     in JSON.'''
-    def post(self, request):
-        for id, order in self.request_json.items():
-            Content.objects.filter(id=id,
-                       module__course__owner=request.user) \
-                       .update(order=order)
-        return self.render_json_response({'saved': 'OK'})
+    model = Content
+    owner_lookup = 'module__course__owner'
+    parent_field = 'module_id'
+
+    def orders_changed(self, parent_ids):
+        # update() does not send signals, invalidate the module contents
+        # once the new order is visible to the readers filling the cache
+        transaction.on_commit(lambda: bump_module_versions(parent_ids))
+        Course.objects.filter(modules__id__in=parent_ids).touch()
+
+
+class ContentDownloadView(LoginRequiredMixin, View):
+    '''Serves the file of a File or Image item, or a variant of an Image,
+    to the owner of the item and to the students enrolled on a course
+    containing it.
+
+    With PROTECTED_MEDIA_ACCEL_REDIRECT the transfer is handed to nginx
+    by courses.downloads, otherwise the file is streamed by Django.
+    '''
+
+    def has_access(self, user, item):
+        if item.owner_id == user.id:
+            return True
+        course_ids = Content.objects.filter(
+            content_type=ContentType.objects.get_for_model(item),
+            object_id=item.id
+        ).values_list('module__course_id', flat=True)
+        return any(is_enrolled(user, course_id) for course_id in course_ids)
+
+    def get(self, request, model_name, id, variant=''):
+        if model_name not in ('file', 'image'):
+            raise Http404('No content matches the given query.')
+        item = get_object_or_404(
+            apps.get_model(app_label='courses', model_name=model_name),
+            id=id
+        )
+        if not self.has_access(request.user, item):
+            raise PermissionDenied
+        if variant:
+            name = item.get_variant_files().get(variant)
+            storage = default_storage
+        else:
+            name, storage = item.content.name, item.content.storage
+        if not name:
+            raise Http404('No file matches the given query.')
+        filename = item.get_download_filename()
+        # images are displayed, files are downloaded
+        attachment = model_name == 'file'
+        if settings.PROTECTED_MEDIA_ACCEL_REDIRECT:
+            return accel_response(name, filename, attachment)
+        return file_response(request, storage, name, filename, attachment)
+
+
+class AsyncViewMixin(object):
+    '''Mixin for class-based views with coroutine handlers, such as
+    async def get(). Under ASGI the view runs on the event loop and only
+    hands its queries and cache lookups to a thread with sync_to_async;
+    under WSGI Django runs it with async_to_sync.
+
+    Django 3.2 only recognizes async function views, so the view function
+    is marked as a coroutine function, as Django marks async middleware.
+    '''
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        view._is_coroutine = asyncio.coroutines._is_coroutine
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        response = super().dispatch(request, *args, **kwargs)
+        # the handlers without a coroutine, e.g. options(), return the
+        # response itself
+        if asyncio.iscoroutine(response):
+            response = await response
+        return response
 
 
 #Public views for displaying course information
-class CourseListView(TemplateResponseMixin, View):
-    '''View to display the course catalog.'''
+class CourseListView(AsyncViewMixin, ReplicaReadMixin, TemplateResponseMixin,
+                     View):
+    '''View to display the course catalog.
+
+    The subjects and courses are cached as lists of plain rows under
+    the current catalog generation, which is bumped whenever a subject,
+    course or module changes. A warm catalog page makes no queries.
+
+    The courses are searched with the ?q= query parameter. Searches are
+    served by the read replicas; the cached rows are read from the
+    default database, so a lagging replica is never cached under a new
+    catalog generation (see educa.routers).
+    '''
 
     model = Course
     template_name = 'courses/course/list.html'
-
-    def get(self, request, subject=None):
-        '''Returns an HTTP response, by rendering the retrieved objects
-        to a template.'''
-        # Retrieve all subjects, and the total number of courses
-        # for each subject. And cache the queryset in memory.
-        subjects = cache.get('all_subjects')
-        if not subjects:
-            subjects = Subject.objects.annotate(
-                total_courses = Count('courses')
-            )
-            cache.set('all_subjects', subjects)
-        # Retrieve all available courses, and the total number of
-        # modules for each course.
-        all_courses = Course.objects.annotate(
-            total_modules=Count('modules')
+    search_results = 50
+
+    def get_subjects(self, version):
+        '''Returns all subjects, and the total number of courses for
+        each subject.'''
+        key = f'catalog:{version}:subjects'
+        subjects = cache.get(key)
+        if subjects is None:
+            with primary_reads():
+                subjects = [
+                    {
+                        'id': s.id,
+                        'title': s.title,
+                        'slug': s.slug,
+                        'total_courses': s.total_courses,
+                    }
+                    for s in Subject.objects.all()
+                ]
+            cache.set(key, subjects)
+        return subjects
+
+    def get_courses(self, version, subject=None):
+        '''Returns the available courses, limited to the given subject
+        if provided, and the total number of modules for each course.'''
+        if subject:
+            key = f'catalog:{version}:subject_{subject["id"]}_courses'
+        else:
+            key = f'catalog:{version}:all_courses'
+        courses = cache.get(key)
+        if courses is None:
+            qs = Course.objects.all()
+            if subject:
+                qs = qs.filter(subject_id=subject['id'])
+            with primary_reads():
+                courses = self.course_rows(qs)
+            cache.set(key, courses)
+        return courses
+
+    def search_courses(self, query, subject=None):
+        '''Returns the best matches of the search query, limited to the
+        given subject if provided. Search results are not cached.'''
+        qs = Course.objects.all()
+        if subject:
+            qs = qs.filter(subject_id=subject['id'])
+        return self.course_rows(
+            search_courses(query, qs)[:self.search_results]
         )
+
+    def course_rows(self, qs):
+        '''Returns the courses of the queryset as plain rows, with the
+        total number of modules and of students of each course.'''
+        qs = qs.select_related('owner', 'subject')
+        return [
+            {
+                'id': c.id,
+                'title': c.title,
+                'slug': c.slug,
+                'total_modules': c.total_modules,
+                'student_count': c.student_count,
+                'owner_name': c.owner.get_full_name(),
+                'subject': {
+                    'title': c.subject.title,
+                    'slug': c.subject.slug,
+                },
+            }
+            for c in qs
+        ]
+
+    def get_context(self, request, subject=None):
+        '''Returns the context of the catalog page. Runs in a thread,
+        the cache and the ORM are synchronous.'''
+        version = get_catalog_version()
+        subjects = self.get_subjects(version)
         # If Subject slug provided, retrieve that subject and limit 
         # courses to those that relate to the given subject.
         if subject:
-            subject = get_object_or_404(Subject, slug=subject)
-            key = f'subject_{subject.id}_courses'
-            courses = cache.get(key)
-            if not courses:
-                courses = all_courses.filter(subject = subject)
-                cache.set(key,courses)
+            subject = next(
+                (s for s in subjects if s['slug'] == subject), None
+            )
+            if subject is None:
+                raise Http404('No subject matches the given query.')
+        query = request.GET.get('q', '').strip()
+        if query:
+            courses = self.search_courses(query, subject)
         else:
-            courses = cache.get('all_courses')
-            if not courses:
-                courses = all_courses
-                cache.set('all_courses', courses)
-        return self.render_to_response({
+            courses = self.get_courses(version, subject)
+        return {
             'subjects':subjects,
             'subject':subject,
-            'courses':courses
-        })
+            'courses':courses,
+            'query':query
+        }
+
+    async def get(self, request, subject=None):
+        '''Returns an HTTP response, by rendering the retrieved objects
+        to a template.'''
+        context = await sync_to_async(self.get_context)(request, subject)
+        return self.render_to_response(context)
 
         
-class CourseDetailView(DetailView):
-    '''Detail view to display the overview for a single course.'''
+class CourseDetailView(AsyncViewMixin, ReplicaReadMixin, DetailView):
+    '''Detail view to display the overview for a single course, read
+    from the read replicas.'''
     model = Course
     template_name = 'courses/course/detail.html'
 
+    async def get(self, request, *args, **kwargs):
+        self.object = await sync_to_async(self.get_object)()
+        context = await sync_to_async(self.get_context_data)(
+            object=self.object
+        )
+        return self.render_to_response(context)
+
     def get_context_data(self, **kwargs):
         '''Override get_context_data to include the enrollment form
         in the context being rendered for the template.
@@ -0,0 +1,341 @@
+"""
+Request instrumentation for educa.
+
+RequestMetricsMiddleware records, for every request, the number and
+duration of SQL queries, the hits, misses and sets of the instrumented
+cache backends and the template render time. The measurements are sent
+back in a Server-Timing header and aggregated per view, in histograms
+exposed in the Prometheus text format by the metrics view.
+
+Aggregates are kept in memory, per process.
+"""
+import asyncio
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+from threading import Lock
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.memcached import MemcachedCache
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import DjangoTemplates, Template
+from django.utils.crypto import constant_time_compare
+
+# metrics of the request being handled in the current context
+_current = ContextVar('request_metrics', default=None)
+_MISSING = object()
+
+
+class RequestMetrics:
+    '''Measurements of a single request.'''
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_sets = 0
+        self.template_time = 0.0
+        self.template_depth = 0
+        # set while a query is recorded, see record_query
+        self.in_query = False
+
+    def server_timing(self, duration):
+        '''Returns the value of the Server-Timing header.'''
+        return ', '.join([
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f'cache;desc="hits={self.cache_hits} misses={self.cache_misses} '
+            f'sets={self.cache_sets}"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+        ])
+
+
+def record_query(execute, sql, params, many, context):
+    '''Database execute wrapper counting and timing queries.
+
+    Concurrent async requests share the connections of the thread their
+    queries run in, so a connection can have the wrapper installed more
+    than once; each query is still counted once, for the request of the
+    current context.'''
+    metrics = _current.get()
+    if metrics is None or metrics.in_query:
+        return execute(sql, params, many, context)
+    metrics.in_query = True
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.in_query = False
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - start
+
+
+class InstrumentedCacheMixin:
+    '''Mixin for cache backends counting hits, misses and sets in the
+    metrics of the current request.'''
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version)
+        metrics = _current.get()
+        if metrics is not None:
+            if value is _MISSING:
+                metrics.cache_misses += 1
+            else:
+                metrics.cache_hits += 1
+        return default if value is _MISSING else value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values = super().get_many(keys, version)
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.cache_hits += len(values)
+            metrics.cache_misses += len(keys) - len(values)
+        return values
+
+    def _count_sets(self, count):
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.cache_sets += count
+
+    def set(self, *args, **kwargs):
+        self._count_sets(1)
+        return super().set(*args, **kwargs)
+
+    def add(self, *args, **kwargs):
+        self._count_sets(1)
+        return super().add(*args, **kwargs)
+
+    def set_many(self, data, *args, **kwargs):
+        self._count_sets(len(data))
+        return super().set_many(data, *args, **kwargs)
+
+
+class InstrumentedMemcachedCache(InstrumentedCacheMixin, MemcachedCache):
+    '''Memcached cache backend with request metrics.'''
+
+
+class InstrumentedLocMemCache(InstrumentedCacheMixin, LocMemCache):
+    '''Local memory cache backend with request metrics.'''
+
+
+class InstrumentedTemplate(Template):
+    '''Django template timing its rendering in the metrics of the current
+    request. Nested renders, e.g. of content items, are counted once.'''
+
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return super().render(context, request)
+        metrics.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - start
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    '''Django templates backend with request metrics.'''
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(
+            super().from_string(template_code).template, self
+        )
+
+    def get_template(self, template_name):
+        return InstrumentedTemplate(
+            super().get_template(template_name).template, self
+        )
+
+
+class Histogram:
+    '''Cumulative histogram with fixed bucket upper bounds.'''
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class ViewMetrics:
+    '''Aggregated measurements of the requests to a view.'''
+    DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+    def __init__(self):
+        self.duration = Histogram(self.DURATION_BUCKETS)
+        self.queries = Histogram(self.QUERY_BUCKETS)
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_sets = 0
+
+
+class MetricsRegistry:
+    '''Per-view aggregates of the request metrics of this process.'''
+
+    def __init__(self):
+        self.lock = Lock()
+        self.views = {}
+
+    def observe(self, view, duration, metrics):
+        with self.lock:
+            stats = self.views.get(view)
+            if stats is None:
+                stats = self.views[view] = ViewMetrics()
+            stats.duration.observe(duration)
+            stats.queries.observe(metrics.queries)
+            stats.db_time += metrics.db_time
+            stats.template_time += metrics.template_time
+            stats.cache_hits += metrics.cache_hits
+            stats.cache_misses += metrics.cache_misses
+            stats.cache_sets += metrics.cache_sets
+
+    def render(self):
+        '''Returns the aggregates in the Prometheus text format.'''
+        lines = []
+
+        def histogram(name, help, attr):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} histogram')
+            for view, stats in sorted(self.views.items()):
+                h = getattr(stats, attr)
+                label = f'view="{escape(view)}"'
+                for bound, count in zip(h.buckets, h.counts):
+                    lines.append(
+                        f'{name}_bucket{{{label},le="{bound}"}} {count}'
+                    )
+                lines.append(f'{name}_bucket{{{label},le="+Inf"}} {h.count}')
+                lines.append(f'{name}_sum{{{label}}} {h.sum}')
+                lines.append(f'{name}_count{{{label}}} {h.count}')
+
+        def counter(name, help, attr):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} counter')
+            for view, stats in sorted(self.views.items()):
+                lines.append(
+                    f'{name}{{view="{escape(view)}"}} {getattr(stats, attr)}'
+                )
+
+        with self.lock:
+            histogram('educa_request_duration_seconds',
+                      'Request duration in seconds.', 'duration')
+            histogram('educa_request_db_queries',
+                      'SQL queries per request.', 'queries')
+            counter('educa_db_duration_seconds_total',
+                    'Time spent in SQL queries.', 'db_time')
+            counter('educa_template_render_seconds_total',
+                    'Time spent rendering templates.', 'template_time')
+            counter('educa_cache_hits_total', 'Cache hits.', 'cache_hits')
+            counter('educa_cache_misses_total', 'Cache misses.',
+                    'cache_misses')
+            counter('educa_cache_sets_total', 'Cache sets.', 'cache_sets')
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    '''Escapes a Prometheus label value.'''
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+                .replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+class RequestMetricsMiddleware:
+    '''Middleware recording the metrics of every request. Should be the
+    first middleware, so the queries of the other middleware (e.g. the
+    session and user lookups) are included.
+
+    The middleware is sync and async capable. Under ASGI the queries run
+    in the thread of sync_to_async, so the execute wrappers are installed
+    on the connections of that thread.'''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # as django.utils.deprecation.MiddlewareMixin, so Django
+            # awaits this middleware
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            with self.record_queries():
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, start)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            stack = await sync_to_async(self.record_queries)()
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(stack.close)()
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, start)
+
+    def record_queries(self):
+        '''Installs record_query on the connections of this thread, until
+        the returned stack is closed.'''
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(record_query))
+        return stack
+
+    def finish(self, request, response, metrics, start):
+        duration = time.perf_counter() - start
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else '<unresolved>'
+        registry.observe(view, duration, metrics)
+        if settings.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = metrics.server_timing(duration)
+        return response
+
+
+def metrics_allowed(request):
+    '''Returns True if the request carries the METRICS_TOKEN as a bearer
+    token, or, when there is no token, comes from the
+    METRICS_ALLOWED_IPS.'''
+    if settings.METRICS_TOKEN:
+        return constant_time_compare(
+            request.META.get('HTTP_AUTHORIZATION', ''),
+            f'Bearer {settings.METRICS_TOKEN}'
+        )
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def metrics_view(request):
+    '''Returns the aggregated request metrics of this process in the
+    Prometheus text format, to the scrapers allowed by metrics_allowed().'''
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4')
@@ -0,0 +1,176 @@
+"""
+Read replica routing for educa.
+
+The reads of the catalog and of the read-only API views are served by
+the read replicas of DATABASE_REPLICAS, when there are any; all the
+other reads and every write go to the default database.
+
+The replicas lag behind the default database, so once a user writes,
+their reads stick to the default database for REPLICA_STICKY_SECONDS,
+so they see their own writes. The writes are noticed by the router, in
+the routing state that ReplicaMiddleware keeps for each request.
+"""
+import asyncio
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+# routing state of the request being handled in the current context
+_state = ContextVar('replica_routing', default=None)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class RoutingState:
+    '''Routing state of a single request.'''
+
+    def __init__(self, request):
+        self.request = request
+        # the view allows its reads to be sent to the replicas
+        self.replica_reads = False
+        # the user wrote recently, checked on the first read of the view
+        self.pinned = None
+        # the request wrote to the database
+        self.wrote = False
+
+
+def pin_key(user_id):
+    return f'replica:pin:{user_id}'
+
+
+def is_pinned(request):
+    '''Returns True if the user of the request wrote recently.'''
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_authenticated and \
+        bool(cache.get(pin_key(user.pk)))
+
+
+def use_replicas(request):
+    '''Allows the reads of the rest of a GET request to be sent to the
+    replicas. The user is only looked up on the first read, in the
+    thread of the queries, so async views can call this on the event
+    loop.'''
+    state = _state.get()
+    if state is not None and settings.DATABASE_REPLICAS and \
+            request.method in SAFE_METHODS:
+        state.replica_reads = True
+
+
+@contextmanager
+def primary_reads():
+    '''Sends the reads within the block to the default database, e.g.
+    the reads filling a cache entry keyed by a version bumped on commit,
+    so the rows of a lagging replica are not cached under the new
+    version.'''
+    state = _state.get()
+    if state is None:
+        yield
+        return
+    allowed = state.replica_reads
+    state.replica_reads = False
+    try:
+        yield
+    finally:
+        state.replica_reads = allowed
+
+
+class ReplicaRouter:
+    '''Database router sending the reads of the views that allow it to a
+    random replica of DATABASE_REPLICAS, unless the user wrote within
+    REPLICA_STICKY_SECONDS. The first write of a request sends its
+    remaining reads to the default database.'''
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.replica_reads or state.wrote:
+            return None
+        if state.pinned is None:
+            # the reads of the check itself go to the default database
+            state.pinned = True
+            state.pinned = is_pinned(state.request)
+        if state.pinned:
+            return None
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the default database
+        aliases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+
+class ReplicaReadMixin:
+    '''Mixin for views whose reads can be served by the replicas.'''
+
+    def setup(self, request, *args, **kwargs):
+        super().setup(request, *args, **kwargs)
+        use_replicas(request)
+
+
+class ReplicaReadAPIMixin:
+    '''Mixin for REST framework views whose reads can be served by the
+    replicas. The replicas are chosen once the request is authenticated,
+    so the reads of users authenticated by the API stick to the default
+    database after their writes as well.'''
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        use_replicas(request)
+
+
+class ReplicaMiddleware:
+    '''Middleware keeping the routing state of every request, and making
+    the reads of a user who wrote stick to the default database for
+    REPLICA_STICKY_SECONDS. Should come after the authentication
+    middleware.'''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        state = RoutingState(request)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        if state.wrote and settings.DATABASE_REPLICAS:
+            self.pin(request)
+        return response
+
+    async def __acall__(self, request):
+        state = RoutingState(request)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        if state.wrote and settings.DATABASE_REPLICAS:
+            await sync_to_async(self.pin)(request)
+        return response
+
+    def pin(self, request):
+        '''Makes the reads of the user of the request stick to the
+        default database for REPLICA_STICKY_SECONDS.'''
+        # REST framework sets the user it authenticated on the request
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            cache.set(pin_key(user.pk), True,
+                      settings.REPLICA_STICKY_SECONDS)
@@ -1,11 +1,15 @@
 from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter
+from django.core.asgi import get_asgi_application
 import chat.routing
 
 application = ProtocolTypeRouter({
+    # HTTP requests are served by Django's ASGI handler, in the same
+    # server as the WebSockets
+    'http': get_asgi_application(),
     'websocket': AuthMiddlewareStack(
         URLRouter(
             chat.routing.websocket_urlpatterns
         )
     ),
-})
\ No newline at end of file
+})
@@ -52,6 +52,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'educa.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     #'django.middleware.cache.UpdateCacheMiddleware',
@@ -59,6 +60,7 @@ MIDDLEWARE = [
     #'django.middleware.cache.FetchFromCacheMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'educa.routers.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -67,7 +69,7 @@ ROOT_URLCONF = 'educa.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'educa.metrics.InstrumentedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -93,6 +95,14 @@ WSGI_APPLICATION = 'educa.wsgi.application'
 #    }
 #}
 
+# Reads of the catalog and of the read-only API views are sent to these
+# read replicas of the default database, see educa/routers.py. A user's
+# reads stick to the default database for REPLICA_STICKY_SECONDS after
+# they write.
+DATABASE_ROUTERS = ['educa.routers.ReplicaRouter']
+DATABASE_REPLICAS = []
+REPLICA_STICKY_SECONDS = 15
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -149,11 +159,38 @@ LOGIN_REDIRECT_URL = reverse_lazy('student_course_list')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 
+# Responsive variants of Image content items, generated by a pool of
+# worker threads; with no workers they are generated inline.
+IMAGE_VARIANT_WIDTHS = [320, 640, 1280]
+IMAGE_THUMBNAIL_SIZE = 160
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_VARIANT_WORKERS = 2
+
+# Course files are served by the permission checked download view. With
+# PROTECTED_MEDIA_ACCEL_REDIRECT the transfer is handed to nginx, which
+# serves MEDIA_ROOT at the internal PROTECTED_MEDIA_LOCATION.
+PROTECTED_MEDIA_ACCEL_REDIRECT = False
+PROTECTED_MEDIA_LOCATION = '/protected/'
+
+# Uploads are hashed as they are received, for the content-addressed
+# storage of File and Image items.
+FILE_UPLOAD_HANDLERS = [
+    'courses.storage.HashingMemoryFileUploadHandler',
+    'courses.storage.HashingTemporaryFileUploadHandler',
+]
+
+# Background job queue (see courses.jobs), processed by the run_jobs
+# command. Jobs are claimed JOB_BATCH_SIZE at a time for JOB_LEASE
+# seconds, and retried with a growing delay up to JOB_MAX_ATTEMPTS times.
+JOB_BATCH_SIZE = 100
+JOB_LEASE = 300
+JOB_MAX_ATTEMPTS = 5
+
 # Configuring Memcached for the project
 CACHES_LOCATION=os.getenv('CACHES_LOCATION')
 CACHES = {
     'default': {
-        'BACKEND':'django.core.cache.backends.memcached.MemcachedCache',
+        'BACKEND':'educa.metrics.InstrumentedMemcachedCache',
         'LOCATION':CACHES_LOCATION,
     }
 }
@@ -162,6 +199,18 @@ CACHE_MIDDLEWARE_ALIAS = 'default'
 CACHE_MIDDLEWARE_SECONDS = 60 * 15 #15 minutes
 CACHE_MIDDLEWARE_KEY_PREFIX = 'educa'
 
+# Text search configuration of the PostgreSQL course search
+SEARCH_CONFIG = 'english'
+
+# Request metrics: add a Server-Timing header to every response, and
+# serve the aggregated metrics at /metrics/ to scrapers sending the
+# METRICS_TOKEN as a bearer token. Without a token, the metrics are
+# served to the METRICS_ALLOWED_IPS, which only works when the clients
+# connect directly (behind a proxy REMOTE_ADDR is the proxy).
+METRICS_SERVER_TIMING = True
+METRICS_TOKEN = None
+METRICS_ALLOWED_IPS = ['127.0.0.1']
+
 # Global settings for REST framework API
 REST_FRAMEWORK = {
     # Use Django's standard `django.contrib.auth` permissions,
@@ -171,6 +220,11 @@ REST_FRAMEWORK = {
     ]
 }
 
+# Default and maximum number of objects per page for paginated API
+# list views. Clients can request a page size with ?page_size=.
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+
 #Channels Config
 
 ASGI_APPLICATION = 'educa.routing.application'
@@ -186,3 +240,23 @@ CHANNEL_LAYERS = {
         }
     }
 }
+
+# Chat messages are saved in batches of up to CHAT_BUFFER_SIZE messages,
+# at most CHAT_BUFFER_FLUSH_INTERVAL seconds after they were sent.
+CHAT_BUFFER_SIZE = 100
+CHAT_BUFFER_FLUSH_INTERVAL = 1.0
+CHAT_HISTORY_PAGE_SIZE = 50
+
+# Chat rate limits as (messages per second, burst) token buckets, per
+# user and per room, for each consumer process.
+CHAT_RATE_LIMITS = {
+    'user': (1.0, 5),
+    'room': (20.0, 50),
+}
+# Slow clients: messages are coalesced into a single catch_up frame when
+# a client is more than CHAT_SEND_WINDOW messages behind, or messages
+# wait more than CHAT_MAX_QUEUE_LAG seconds in the channel layer. Clients
+# that stay behind for CHAT_SLOW_CONSUMER_TIMEOUT seconds are closed.
+CHAT_SEND_WINDOW = 100
+CHAT_MAX_QUEUE_LAG = 5.0
+CHAT_SLOW_CONSUMER_TIMEOUT = 30.0
@@ -7,5 +7,17 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
-}
\ No newline at end of file
+    },
+    # second SQLite database standing in for a read replica; reads are
+    # only sent to it with DATABASE_REPLICAS=replica in the environment,
+    # after copying db.sqlite3 to it or migrating it with
+    # manage.py migrate --database replica
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db-replica.sqlite3'),
+    },
+}
+
+DATABASE_REPLICAS = [
+    alias for alias in os.getenv('DATABASE_REPLICAS', '').split(',') if alias
+]
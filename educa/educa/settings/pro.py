@@ -31,4 +31,22 @@ DATABASES = {
         'USER': DATABASES_USER,
         'PASSWORD': DATABASES_PASSWORD,
     }
-}
\ No newline at end of file
+}
+
+# read replicas of the default database; comma separated hosts
+DATABASES_REPLICA_HOSTS = [
+    host for host in os.getenv('DATABASES_REPLICA_HOSTS', '').split(',')
+    if host
+]
+DATABASE_REPLICAS = []
+for i, host in enumerate(DATABASES_REPLICA_HOSTS):
+    DATABASES[f'replica_{i}'] = dict(DATABASES['default'], HOST=host)
+    DATABASE_REPLICAS.append(f'replica_{i}')
+
+# request metrics stay enabled; requests reach Daphne through nginx, so
+# the scrapers authenticate with the token rather than their address
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+METRICS_ALLOWED_IPS = []
+
+# course files are sent by nginx, see config/ngninx-sample.conf
+PROTECTED_MEDIA_ACCEL_REDIRECT = True
@@ -0,0 +1,265 @@
+import base64
+import re
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.test import (AsyncClient, Client, RequestFactory, TestCase,
+                         override_settings)
+from django.urls import reverse
+from courses.models import Subject
+from courses.tests import create_course
+from students.membership import get_enrolled_course_ids
+from . import metrics, routers
+from .routing import application
+
+INSTRUMENTED_CACHES = {
+    'default': {
+        'BACKEND': 'educa.metrics.InstrumentedLocMemCache',
+    }
+}
+
+
+@override_settings(CACHES=INSTRUMENTED_CACHES)
+class RequestMetricsTest(TestCase):
+    '''Tests for the request metrics middleware and endpoint.'''
+
+    def setUp(self):
+        cache.clear()
+        metrics.registry = metrics.MetricsRegistry()
+        self.addCleanup(setattr, metrics, 'registry', metrics.registry)
+        owner = User.objects.create_user('instructor', password='pass')
+        subject = Subject.objects.create(title='Maths', slug='maths')
+        create_course(owner, subject, 'algebra')
+
+    def server_timing(self, response):
+        return dict(
+            re.match(r'(\w+);(.*)', part.strip()).groups()
+            for part in response['Server-Timing'].split(',')
+        )
+
+    def test_server_timing_header(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('course_list'))
+        timing = self.server_timing(response)
+        self.assertIn('desc="2 queries"', timing['db'])
+        self.assertIn('tpl', timing)
+        self.assertIn('total', timing)
+
+    async def test_server_timing_header_under_asgi(self):
+        response = await AsyncClient().get(reverse('course_list'))
+        timing = self.server_timing(response)
+        self.assertIn('desc="2 queries"', timing['db'])
+        self.assertIn('tpl', timing)
+
+    def test_cache_hits_and_misses(self):
+        response = self.client.get(reverse('course_list'))
+        cold = self.server_timing(response)['cache']
+        self.assertNotIn('misses=0', cold)
+        response = self.client.get(reverse('course_list'))
+        warm = self.server_timing(response)['cache']
+        self.assertIn('misses=0 sets=0', warm)
+
+    def test_metrics_are_aggregated_by_view(self):
+        self.client.get(reverse('course_list'))
+        self.client.get(reverse('course_list'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn(
+            'educa_request_duration_seconds_count{view="course_list"} 2',
+            body
+        )
+        self.assertIn(
+            'educa_request_db_queries_bucket{view="course_list",le="5"} 2',
+            body
+        )
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_metrics_are_restricted(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_require_the_token(self):
+        url = reverse('metrics')
+        # the address does not matter behind a proxy
+        self.assertEqual(self.client.get(url).status_code, 403)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(CACHES=INSTRUMENTED_CACHES)
+class ASGIRoutingTest(TestCase):
+    '''Tests for the HTTP routes of the ASGI application.'''
+
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user('instructor', password='pass')
+        subject = Subject.objects.create(title='Maths', slug='maths')
+        self.course = create_course(owner, subject, 'algebra')
+        User.objects.create_user('learner')
+
+    async def get(self, path, method='GET', body=b'', headers=()):
+        '''Returns the status and body of a request to the application.
+        Unlike HttpCommunicator, accepts the final empty body message of
+        Django's streaming responses.'''
+        communicator = ApplicationCommunicator(application, {
+            'type': 'http',
+            'http_version': '1.1',
+            'method': method,
+            'path': path,
+            'query_string': b'',
+            'headers': [(b'host', b'testserver'),
+                        (b'content-length', str(len(body)).encode()),
+                        *headers],
+        })
+        await communicator.send_input({'type': 'http.request', 'body': body})
+        start = await communicator.receive_output(5)
+        content = b''
+        while True:
+            message = await communicator.receive_output(5)
+            content += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        return {'status': start['status'], 'body': content}
+
+    def authorization(self, username, password='pass'):
+        credentials = base64.b64encode(f'{username}:{password}'.encode())
+        return (b'authorization', b'Basic ' + credentials)
+
+    async def test_async_view(self):
+        response = await self.get(reverse('course_list'))
+        self.assertEqual(response['status'], 200)
+        self.assertIn(b'Algebra', response['body'])
+
+    async def test_sync_view(self):
+        response = await self.get(reverse('api:course-list'))
+        self.assertEqual(response['status'], 200)
+        self.assertIn(b'algebra', response['body'])
+
+    async def test_course_export(self):
+        # the export is generated with queries, before it is sent
+        response = await self.get(
+            reverse('api:course-export', args=[self.course.id]),
+            headers=[self.authorization('instructor')]
+        )
+        self.assertEqual(response['status'], 200)
+        lines = response['body'].splitlines()
+        self.assertIn(b'"educa-course"', lines[0])
+        self.assertEqual(len(lines), 1 + 1 + 1 + 4 + 4)
+
+    async def test_bulk_enrollment(self):
+        response = await self.get(
+            reverse('api:course-enroll-bulk', args=[self.course.id]),
+            method='POST',
+            body=b'learner\nnobody\n',
+            headers=[self.authorization('instructor'),
+                     (b'content-type', b'text/csv')]
+        )
+        self.assertEqual(response['status'], 200)
+        self.assertEqual(response['body'].decode().splitlines(), [
+            'row,identifier,outcome',
+            '1,learner,enrolled',
+            '2,nobody,not found',
+        ])
+        self.assertTrue(await sync_to_async(
+            self.course.students.filter(username='learner').exists
+        )())
+
+
+@override_settings(CACHES=INSTRUMENTED_CACHES, DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTest(TestCase):
+    '''Tests for the read replica router, against a replica database
+    holding other rows than the default database.'''
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('student', password='pass')
+        owner = User.objects.create_user('instructor', password='pass')
+        subject = Subject.objects.create(title='Maths', slug='maths')
+        self.course = create_course(owner, subject, 'algebra')
+        Subject.objects.using('replica').create(title='Replicated',
+                                                slug='replicated')
+
+    def request(self, method='get'):
+        request = getattr(RequestFactory(), method)('/')
+        request.user = AnonymousUser()
+        return request
+
+    def test_router(self):
+        router = routers.ReplicaRouter()
+        request = self.request()
+        token = routers._state.set(routers.RoutingState(request))
+        self.addCleanup(routers._state.reset, token)
+        self.assertIsNone(router.db_for_read(Subject))
+        routers.use_replicas(request)
+        self.assertEqual(router.db_for_read(Subject), 'replica')
+        with routers.primary_reads():
+            self.assertIsNone(router.db_for_read(Subject))
+        self.assertEqual(router.db_for_read(Subject), 'replica')
+        # reads follow the writes of the request to the default database
+        self.assertIsNone(router.db_for_write(Subject))
+        self.assertIsNone(router.db_for_read(Subject))
+
+    def test_memberships_are_read_from_default(self):
+        self.course.students.add(self.user)
+        request = self.request()
+        token = routers._state.set(routers.RoutingState(request))
+        self.addCleanup(routers._state.reset, token)
+        routers.use_replicas(request)
+        # the enrollment is not on the replica yet
+        self.assertEqual(get_enrolled_course_ids(self.user),
+                         {self.course.id})
+
+    def test_writes_are_not_routed(self):
+        router = routers.ReplicaRouter()
+        request = self.request('post')
+        token = routers._state.set(routers.RoutingState(request))
+        self.addCleanup(routers._state.reset, token)
+        routers.use_replicas(request)
+        self.assertIsNone(router.db_for_read(Subject))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas(self):
+        response = self.client.get(reverse('api:subject_list'))
+        self.assertContains(response, 'Maths')
+
+    def test_api_reads_from_replica(self):
+        response = self.client.get(reverse('api:subject_list'))
+        self.assertContains(response, 'Replicated')
+        self.assertNotContains(response, 'Maths')
+        response = self.client.get(
+            reverse('api:course-detail', args=[self.course.id])
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_catalog(self):
+        # the cached rows come from the default database
+        response = self.client.get(reverse('course_list'))
+        self.assertContains(response, 'Algebra')
+        # searches come from the replica
+        response = self.client.get(reverse('course_list'), {'q': 'algebra'})
+        self.assertNotContains(response, 'Algebra')
+
+    def test_reads_stick_to_default_after_a_write(self):
+        url = reverse('course_detail', args=['algebra'])
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        response = self.client.post(reverse('student_enroll_course'),
+                                    {'course': self.course.id})
+        self.assertEqual(response.status_code, 302)
+        self.assertContains(self.client.get(url), 'Algebra')
+        # other users still read from the replica
+        self.assertEqual(Client().get(url).status_code, 404)
+        # the reads go back to the replica after REPLICA_STICKY_SECONDS
+        cache.delete(routers.pin_key(self.user.pk))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    async def test_async_view(self):
+        url = reverse('course_detail', args=['algebra'])
+        response = await AsyncClient().get(url)
+        self.assertEqual(response.status_code, 404)
@@ -19,6 +19,7 @@ from django.contrib.auth import views as auth_views
 from courses.views import CourseListView
 from django.conf import settings
 from django.conf.urls.static import static
+from .metrics import metrics_view
 
 urlpatterns = [
     path('accounts/login/', auth_views.LoginView.as_view(),name='login'),
@@ -29,6 +30,7 @@ urlpatterns = [
     path('students/',include('students.urls')),
     path('api/', include('courses.api.urls', namespace='api')),
     path('chat/', include('chat.urls', namespace='chat')),
+    path('metrics/', metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG:
@@ -0,0 +1,54 @@
+import sys
+from collections import Counter
+from django.core.management.base import BaseCommand, CommandError
+from courses.models import Course
+from students.roster import (CHUNK_SIZE, enroll_roster, read_roster,
+                             write_outcomes)
+
+
+class Command(BaseCommand):
+    '''Enrolls the students of a CSV roster, holding a username or an
+    email address in its first column, on a course. The outcome of each
+    row is written as CSV to the standard output, and a summary to the
+    standard error.'''
+    help = 'Enroll the students of a CSV roster on a course.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('course', help='Id or slug of the course.')
+        parser.add_argument('roster',
+                            help='CSV file of usernames or email '
+                                 'addresses, - for the standard input.')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Rows enrolled per transaction.')
+
+    def handle(self, *args, **options):
+        course = options['course']
+        lookup = {'pk': course} if course.isdigit() else {'slug': course}
+        try:
+            course = Course.objects.get(**lookup)
+        except Course.DoesNotExist:
+            raise CommandError(f'No course {options["course"]}.')
+        if options['roster'] == '-':
+            self.enroll(course, sys.stdin.buffer, options)
+            return
+        try:
+            with open(options['roster'], 'rb') as f:
+                self.enroll(course, f, options)
+        except OSError as e:
+            raise CommandError(str(e))
+
+    def enroll(self, course, lines, options):
+        totals = Counter()
+
+        def count(outcomes):
+            for outcome in outcomes:
+                totals[outcome[2]] += 1
+                yield outcome
+
+        outcomes = enroll_roster(course, read_roster(lines),
+                                 options['chunk_size'])
+        for line in write_outcomes(count(outcomes)):
+            self.stdout.write(line, ending='')
+        summary = ', '.join(f'{n} {outcome}'
+                            for outcome, n in sorted(totals.items()))
+        self.stderr.write(f'{course}: {summary or "no rows"}.')
@@ -0,0 +1,47 @@
+from django.core.cache import cache
+from courses.models import Course
+from educa.routers import primary_reads
+
+# Memberships are invalidated on every enrollment change, the timeout
+# only bounds the lifetime of entries of inactive users.
+MEMBERSHIP_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def membership_key(user_id):
+    '''Returns the cache key of the enrolled courses of a user.'''
+    return f'enrollment:user:{user_id}'
+
+
+def get_enrolled_course_ids(user):
+    '''Returns the ids of the courses the given user is enrolled in, as
+    a frozenset cached per user.'''
+    if not user.is_authenticated:
+        return frozenset()
+    key = membership_key(user.id)
+    course_ids = cache.get(key)
+    if course_ids is None:
+        # a lagging replica would be cached until the next enrollment
+        # change of the user
+        with primary_reads():
+            course_ids = frozenset(
+                Course.students.through.objects
+                      .filter(user_id=user.id)
+                      .values_list('course_id', flat=True)
+            )
+        cache.set(key, course_ids, MEMBERSHIP_CACHE_TIMEOUT)
+    return course_ids
+
+
+def is_enrolled(user, course_id):
+    '''Returns True if the given user is enrolled in the course with the
+    given id.'''
+    try:
+        course_id = int(course_id)
+    except (TypeError, ValueError):
+        return False
+    return course_id in get_enrolled_course_ids(user)
+
+
+def invalidate_memberships(user_ids):
+    '''Removes the cached enrolled courses of the given users.'''
+    cache.delete_many([membership_key(user_id) for user_id in user_ids])
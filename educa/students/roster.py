@@ -0,0 +1,181 @@
+'''
+Bulk enrollment of students from a roster, a CSV file with the username
+or the email address of a student in its first column.
+
+The roster is read as a stream and processed in chunks of CHUNK_SIZE
+rows: the users of a chunk are resolved with one query, the existing
+enrollments with another, and the new enrollments are inserted with a
+single bulk_create. Each row gets an outcome, yielded as soon as its
+chunk is committed, so neither the roster nor the outcomes are held in
+memory.
+
+A student enrolled by another request after the existing enrollments
+were read makes the insert fail; the enrollments are then read again
+and the rest inserted, so the counter and the outcomes only count the
+rows the roster actually inserted.
+'''
+import codecs
+import csv
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from courses.caching import bump_catalog_version
+from courses.counters import adjust
+from courses.models import Course
+from .membership import invalidate_memberships
+
+CHUNK_SIZE = 500
+
+# outcomes of the rows of a roster
+ENROLLED = 'enrolled'
+ALREADY_ENROLLED = 'already enrolled'
+DUPLICATE = 'duplicate'
+NOT_FOUND = 'not found'
+AMBIGUOUS = 'ambiguous'
+
+HEADERS = ('username', 'email', 'user', 'student')
+
+
+def read_roster(lines, encoding='utf-8-sig'):
+    '''Yields (row number, identifier) for the rows of a CSV roster,
+    given as an iterable of bytes lines. Blank rows and a header row are
+    skipped.'''
+    rows = csv.reader(codecs.iterdecode(lines, encoding))
+    for number, row in enumerate(rows, 1):
+        identifier = row[0].strip() if row else ''
+        if not identifier:
+            continue
+        if number == 1 and identifier.lower() in HEADERS:
+            continue
+        yield number, identifier
+
+
+def chunked(rows, size):
+    '''Yields successive lists of at most size rows of an iterable,
+    without reading it further than the current chunk.'''
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def resolve(identifiers):
+    '''Returns a dict of identifier: list of the ids of the users with
+    that username or email address. Email addresses are matched without
+    regard to case.'''
+    emails = [i.lower() for i in identifiers if '@' in i]
+    users = User.objects.annotate(email_lower=Lower('email')).filter(
+        Q(username__in=identifiers) | Q(email_lower__in=emails)
+    ).values_list('id', 'username', 'email_lower')
+    by_username = {}
+    by_email = {}
+    for user_id, username, email in users:
+        by_username[username] = user_id
+        if email:
+            by_email.setdefault(email, set()).add(user_id)
+    matches = {}
+    for identifier in identifiers:
+        ids = set(by_email.get(identifier.lower(), ()))
+        if identifier in by_username:
+            ids.add(by_username[identifier])
+        matches[identifier] = sorted(ids)
+    return matches
+
+
+def insert_enrollments(course_id, user_ids):
+    '''Enrolls the given users on the course, leaving out the ones
+    enrolled concurrently, and returns the set of the ids of the users
+    it enrolled. Must be called within a transaction.'''
+    Enrollment = Course.students.through
+    user_ids = set(user_ids)
+    while user_ids:
+        try:
+            with transaction.atomic():
+                Enrollment.objects.bulk_create([
+                    Enrollment(course_id=course_id, user_id=user_id)
+                    for user_id in user_ids
+                ])
+            break
+        except IntegrityError:
+            # the rows committed by other requests are visible now
+            enrolled = set(Enrollment.objects.filter(
+                course_id=course_id, user_id__in=user_ids
+            ).values_list('user_id', flat=True))
+            if not enrolled:
+                raise
+            user_ids -= enrolled
+    return user_ids
+
+
+def enroll_roster(course, rows, chunk_size=CHUNK_SIZE):
+    '''Enrolls the students of the given (row number, identifier) rows
+    on the course, one chunk of rows per transaction, and yields the
+    (row number, identifier, outcome) of every row.'''
+    Enrollment = Course.students.through
+    seen = set()
+    enrolled = 0
+    for chunk in chunked(rows, chunk_size):
+        matches = resolve({identifier for number, identifier in chunk})
+        user_ids = {ids[0] for ids in matches.values() if len(ids) == 1}
+        with transaction.atomic():
+            existing = set(Enrollment.objects.filter(
+                course_id=course.pk, user_id__in=user_ids
+            ).values_list('user_id', flat=True))
+            outcomes = []
+            new = []
+            for number, identifier in chunk:
+                ids = matches[identifier]
+                if not ids:
+                    outcome = NOT_FOUND
+                elif len(ids) > 1:
+                    outcome = AMBIGUOUS
+                elif ids[0] in seen:
+                    outcome = DUPLICATE
+                elif ids[0] in existing:
+                    outcome = ALREADY_ENROLLED
+                else:
+                    outcome = ENROLLED
+                    new.append(ids[0])
+                if ids and len(ids) == 1:
+                    seen.add(ids[0])
+                outcomes.append((number, identifier, outcome))
+            inserted = insert_enrollments(course.pk, new)
+            # bulk_create sends no m2m_changed signals, see
+            # courses.signals.students_changed
+            adjust(Course, 'student_count', [course.pk], len(inserted))
+            transaction.on_commit(
+                lambda inserted=inserted: invalidate_memberships(inserted)
+            )
+        enrolled += len(inserted)
+        for number, identifier, outcome in outcomes:
+            if outcome == ENROLLED and matches[identifier][0] not in inserted:
+                # enrolled by another request meanwhile
+                outcome = ALREADY_ENROLLED
+            yield number, identifier, outcome
+    if enrolled:
+        bump_catalog_version()
+
+
+class Echo:
+    '''File-like object returning what is written to it, for a csv
+    writer producing the lines of a streamed response.'''
+
+    def write(self, value):
+        return value
+
+
+def write_outcomes(outcomes):
+    '''Yields the given outcomes as CSV lines, after a header line. A
+    roster that cannot be read ends with an error line.'''
+    writer = csv.writer(Echo())
+    yield writer.writerow(('row', 'identifier', 'outcome'))
+    try:
+        for outcome in outcomes:
+            yield writer.writerow(outcome)
+    except (UnicodeDecodeError, csv.Error) as e:
+        yield writer.writerow(('', '', f'error: {e}'))
@@ -0,0 +1,23 @@
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+from courses.models import Course
+from .membership import invalidate_memberships
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def enrollment_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    '''Invalidates the cached enrolled courses of the students affected
+    by a change of Course.students, from either side of the relation.'''
+    if reverse:
+        # user.courses_joined was changed
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_memberships([instance.pk])
+    elif action == 'pre_clear':
+        # the students are unknown once the relation has been cleared
+        instance._cleared_student_ids = list(
+            instance.students.values_list('id', flat=True)
+        )
+    elif action == 'post_clear':
+        invalidate_memberships(instance._cleared_student_ids)
+    elif action in ('post_add', 'post_remove'):
+        invalidate_memberships(pk_set)
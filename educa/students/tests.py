@@ -1,3 +1,235 @@
-from django.test import TestCase
+import io
+import tempfile
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from courses import counters
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from courses.models import Subject, Course, Module
+from .membership import get_enrolled_course_ids, is_enrolled
+from . import roster
+from .roster import enroll_roster, read_roster
 
-# Create your tests here.
+# Tests run against a local memory cache rather than memcached.
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MembershipTest(TestCase):
+    '''Tests for the cached enrollment membership service.'''
+
+    def setUp(self):
+        cache.clear()
+        self.student = User.objects.create_user('student', password='pass')
+        subject = Subject.objects.create(title='Maths', slug='maths')
+        owner = User.objects.create_user('instructor')
+        self.course = Course.objects.create(
+            owner=owner, subject=subject, title='Course', slug='course',
+            overview='Overview'
+        )
+        self.other = Course.objects.create(
+            owner=owner, subject=subject, title='Other', slug='other',
+            overview='Overview'
+        )
+        Module.objects.create(course=self.course, title='Module')
+
+    def test_warm_membership_makes_no_queries(self):
+        self.course.students.add(self.student)
+        self.assertTrue(is_enrolled(self.student, self.course.id))
+        with self.assertNumQueries(0):
+            self.assertTrue(is_enrolled(self.student, self.course.id))
+            self.assertFalse(is_enrolled(self.student, self.other.id))
+            self.assertFalse(is_enrolled(self.student, 'invalid'))
+
+    def test_course_side_changes_invalidate(self):
+        self.assertFalse(is_enrolled(self.student, self.course.id))
+        self.course.students.add(self.student)
+        self.assertTrue(is_enrolled(self.student, self.course.id))
+        self.course.students.remove(self.student)
+        self.assertFalse(is_enrolled(self.student, self.course.id))
+        self.course.students.add(self.student)
+        self.assertTrue(is_enrolled(self.student, self.course.id))
+        self.course.students.clear()
+        self.assertFalse(is_enrolled(self.student, self.course.id))
+
+    def test_user_side_changes_invalidate(self):
+        self.assertEqual(get_enrolled_course_ids(self.student), frozenset())
+        self.student.courses_joined.add(self.course, self.other)
+        self.assertEqual(get_enrolled_course_ids(self.student),
+                         {self.course.id, self.other.id})
+        self.student.courses_joined.clear()
+        self.assertEqual(get_enrolled_course_ids(self.student), frozenset())
+
+    def test_course_detail_requires_enrollment(self):
+        self.client.force_login(self.student)
+        url = reverse('student_course_detail', args=[self.course.id])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.course.students.add(self.student)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CourseDetailPageCacheTest(TestCase):
+    '''Tests for the shared page cache of the student course page.'''
+
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user('instructor')
+        subject = Subject.objects.create(title='Maths', slug='maths')
+        self.course = Course.objects.create(
+            owner=owner, subject=subject, title='Course', slug='course',
+            overview='Overview'
+        )
+        self.module = Module.objects.create(course=self.course,
+                                            title='First module')
+        self.students = [
+            User.objects.create_user(f'student{i}', password='pass')
+            for i in range(2)
+        ]
+        self.course.students.add(*self.students)
+        self.url = reverse('student_course_detail', args=[self.course.id])
+
+    def get(self, user):
+        self.client.force_login(user)
+        return self.client.get(self.url)
+
+    def test_page_is_shared_by_enrolled_students(self):
+        self.get(self.students[0])
+        self.client.force_login(self.students[1])
+        is_enrolled(self.students[1], self.course.id)
+        # session, user and the course validator
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertContains(response, 'First module')
+        self.assertContains(response, 'Sign out')
+        self.assertNotContains(response, '<!--hole:')
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_enrollment_is_checked_per_request(self):
+        self.get(self.students[0])
+        stranger = User.objects.create_user('stranger', password='pass')
+        self.assertEqual(self.get(stranger).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_changes_are_displayed(self):
+        self.get(self.students[0])
+        self.module.title = 'Renamed module'
+        self.module.save()
+        self.assertContains(self.get(self.students[1]), 'Renamed module')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RosterEnrollmentTest(TestCase):
+    '''Tests for the bulk enrollment of CSV rosters.'''
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('instructor', password='pass')
+        subject = Subject.objects.create(title='Maths', slug='maths')
+        self.course = Course.objects.create(
+            owner=self.owner, subject=subject, title='Course',
+            slug='course', overview='Overview'
+        )
+        self.students = [
+            User.objects.create_user(f'student{i}',
+                                     email=f'student{i}@example.com')
+            for i in range(5)
+        ]
+        User.objects.create_user('twin1', email='twin@example.com')
+        User.objects.create_user('twin2', email='twin@example.com')
+        self.course.students.add(self.students[0])
+        self.roster = (
+            'username\n'
+            'student0\n'
+            'student1\n'
+            'STUDENT2@example.com\n'
+            '\n'
+            'student1@example.com\n'
+            'nobody\n'
+            'twin@example.com\n'
+            'student3\n'
+        ).encode()
+
+    def test_command_reports_each_row(self):
+        # warm the cached memberships of a student being enrolled
+        self.assertFalse(is_enrolled(self.students[1], self.course.id))
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(self.roster)
+            f.flush()
+            stdout = io.StringIO()
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('enroll_students', 'course', f.name,
+                             chunk_size=3, stdout=stdout,
+                             stderr=io.StringIO())
+        self.assertEqual(stdout.getvalue().splitlines(), [
+            'row,identifier,outcome',
+            '2,student0,already enrolled',
+            '3,student1,enrolled',
+            '4,STUDENT2@example.com,enrolled',
+            '6,student1@example.com,duplicate',
+            '7,nobody,not found',
+            '8,twin@example.com,ambiguous',
+            '9,student3,enrolled',
+        ])
+        self.assertEqual(
+            set(self.course.students.all()), set(self.students[:4])
+        )
+        self.assertTrue(is_enrolled(self.students[1], self.course.id))
+        self.assertEqual(counters.find_stale(), [])
+
+    def test_concurrent_enrollments_are_not_counted(self):
+        insert_enrollments = roster.insert_enrollments
+
+        def enroll_concurrently(course_id, user_ids):
+            # another request enrolls a student after the roster read
+            # the existing enrollments
+            self.course.students.add(self.students[3])
+            return insert_enrollments(course_id, user_ids)
+
+        rows = read_roster(self.roster.splitlines(keepends=True))
+        with mock.patch.object(roster, 'insert_enrollments',
+                               enroll_concurrently):
+            outcomes = list(enroll_roster(self.course, rows))
+        self.assertEqual(outcomes[-1], (9, 'student3', 'already enrolled'))
+        self.assertEqual(outcomes[1], (3, 'student1', 'enrolled'))
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.student_count, 4)
+        self.assertEqual(counters.find_stale(), [])
+
+    def test_queries_grow_with_the_chunks_not_the_rows(self):
+        users = [User(username=f'user{i}') for i in range(100)]
+        User.objects.bulk_create(users)
+        counts = []
+        for names in (['user0'], [f'user{i}' for i in range(1, 100)]):
+            rows = read_roster(name.encode() + b'\n' for name in names)
+            with CaptureQueriesContext(connection) as queries:
+                list(enroll_roster(self.course, rows, chunk_size=100))
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(self.course.students.count(), 101)
+
+    def test_api_streams_the_outcomes(self):
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        url = reverse('api:course-enroll-bulk', args=[self.course.id])
+        response = client.generic('POST', url, self.roster,
+                                  content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 8)
+        self.assertEqual(lines[-1], '9,student3,enrolled')
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.student_count, 4)
+        client.force_authenticate(self.students[0])
+        response = client.post(url, {'roster': io.BytesIO(self.roster)})
+        self.assertEqual(response.status_code, 403)
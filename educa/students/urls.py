@@ -1,6 +1,5 @@
 from django.urls import path
 from . import views
-from django.views.decorators.cache import cache_page
 
 urlpatterns = [
     path(
@@ -20,12 +19,12 @@ urlpatterns = [
     ),
     path(
         'course/<pk>/',
-        cache_page(60*15) (views.StudentCourseDetailView.as_view()),
+        views.StudentCourseDetailView.as_view(),
         name='student_course_detail'
     ),
     path(
         'course/<pk>/<module_id>/',
-        cache_page(60*15) (views.StudentCourseDetailView.as_view()),
+        views.StudentCourseDetailView.as_view(),
         name='student_course_detail_module'
     ),
 ]
@@ -7,6 +7,14 @@ from .forms import CourseEnrollForm
 from django.views.generic.list import ListView
 from courses.models import Course
 from django.views.generic.detail import DetailView
+from courses.caching import (get_module_version, page_key, fill_holes,
+                             PAGE_CACHE_TIMEOUT)
+from courses.conditional import course_condition, get_course_updated
+from django.core.cache import cache
+from django.http import Http404, HttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from .membership import get_enrolled_course_ids, is_enrolled
 
 class StudentRegistrationView(CreateView):
     '''View for users to register on the site.'''
@@ -57,19 +65,51 @@ class StudentCourseListView(LoginRequiredMixin, ListView):
         model for those courses the student is enrolled in.
         '''
         qs =  super().get_queryset()
-        return qs.filter(students__in=[self.request.user])
+        return qs.filter(id__in=get_enrolled_course_ids(self.request.user))
 
 
+@method_decorator(course_condition(enrolled_only=True, per_user=True),
+                  name='get')
 class StudentCourseDetailView(DetailView):
-    '''View to display the detail of a specific course.'''
+    '''View to display the detail of a specific course. Conditional GETs
+    of enrolled students are answered with 304 Not Modified while the
+    course is unchanged.
+
+    The rendered page is cached once for all enrolled students, keyed by
+    the last update of the course, so any change to the course, its
+    modules or their contents is displayed at once. The enrollment is
+    checked on every request, and the per-user parts of the page are
+    left out of the cached page and rendered per request.
+    '''
     model = Course
     template_name = 'students/course/detail.html'
 
+    def get(self, request, *args, **kwargs):
+        course_id = kwargs['pk']
+        if not is_enrolled(request.user, course_id):
+            raise Http404('No course matches the given query.')
+        updated = get_course_updated(request, course_id)
+        if updated is None:
+            raise Http404('No course matches the given query.')
+        key = page_key('student_course_detail', updated, course_id,
+                       kwargs.get('module_id', ''))
+        page = cache.get(key)
+        if page is None:
+            response = super().get(request, *args, **kwargs)
+            page = response.render().content.decode(response.charset)
+            cache.set(key, page, PAGE_CACHE_TIMEOUT)
+        response = HttpResponse(fill_holes(page, request))
+        patch_cache_control(response, private=True)
+        return response
+
     def get_queryset(self):
         '''Override the get_queryset() method to only return those
-        courses for which the user is registered.'''
+        courses for which the user is registered. The enrollment is
+        checked against the cached memberships of the user.'''
         qs =  super().get_queryset()
-        return qs.filter(students__in=[self.request.user])
+        if not is_enrolled(self.request.user, self.kwargs['pk']):
+            return qs.none()
+        return qs
 
     def get_context_data(self, **kwargs):
         '''Override get_context_data() method in order to set a
@@ -78,7 +118,7 @@ class StudentCourseDetailView(DetailView):
         of the course.'''
         context =  super().get_context_data(**kwargs)
         # get course object
-        course = self.get_object()
+        course = self.object
         if 'module_id' in self.kwargs:
             # get current module
             context['module'] = course.modules.get(
@@ -87,6 +127,13 @@ class StudentCourseDetailView(DetailView):
         else:
             # get first module
             context['module'] = course.modules.all()[0]
+        module = context['module']
+        # the contents are only evaluated when the cached contents of
+        # the module are missing or out of date
+        context['contents'] = module.contents.prefetch_related('item')
+        context['module_version'] = get_module_version(module.id)
+        # the page is shared by the enrolled students
+        context['page_cache'] = True
         return context
 
 